@@ -1,19 +1,70 @@
-from flask import Flask, jsonify, make_response, request
+from flask import Flask, jsonify, make_response, request, Response, stream_with_context
 from os import environ as env
+from pathlib import Path
+import json
+import threading
+import time
+
+from sessions.session_factory import create_application_session
 
 # Initialization of application
 app = Flask(__name__)
 
+# one application session per worker process, created on the first request
+_app_session = None
+_app_session_lock = threading.Lock()
+_app_session_startup_seconds = None
+
+def _get_app_session():
+    global _app_session, _app_session_startup_seconds
+    with _app_session_lock:
+        if _app_session is None:
+            start = time.perf_counter()
+            app_session, query_settings = create_application_session(Path(__file__).parent / 'src' / 'universal_config.yaml',
+                                                                     Path(__file__).parent / 'src' / 'application_questions_config.yaml')
+            _app_session = (app_session.initialize_session(), query_settings)
+            _app_session_startup_seconds = time.perf_counter() - start
+    return _app_session
+
 def _get_fields_f_json(request):
     entry_json = request.json
     return  entry_json["id"], entry_json["entity"]
 
+def _stream_answer(user_id, tokens, stream_format):
+    """Forwards answer tokens as server-sent events or json lines, followed by a final message with the full answer."""
+    answer = []
+    for token in tokens:
+        answer.append(token)
+        if stream_format == 'sse':
+            yield f'data: {json.dumps({"token": token})}\n\n'
+        else:
+            yield json.dumps({'token': token}) + '\n'
+    done = {'response': ''.join(answer), 'id': user_id}
+    if stream_format == 'sse':
+        yield f'event: done\ndata: {json.dumps(done)}\n\n'
+    else:
+        yield json.dumps(done) + '\n'
+
 @app.route('/question', methods=["POST", "GET"])
 def question_processing():
+    """
+    Tunes historical answers to a new application question.
+    With "stream": "sse" (server-sent events) or "stream": "jsonl" (chunked json lines) in the request, the answer is
+    streamed token by token as the gpt model produces it. Otherwise all tuned answers are returned at once.
+    """
     user_id, question_entity = _get_fields_f_json(request)
+    stream_format = request.json.get('stream')
+    app_session, query_settings = _get_app_session()
+
+    if stream_format in ('sse', 'jsonl'):
+        tokens = app_session.stream_tune_answer(query_settings['user_string'], query_settings['system_string'],
+                                                query_settings['substring_to_replace'], new_question=question_entity,
+                                                hist_qa_return_limit=query_settings['hist_qa_return_limit'])
+        mimetype = 'text/event-stream' if stream_format == 'sse' else 'application/x-ndjson'
+        return Response(stream_with_context(_stream_answer(user_id, tokens, stream_format)), mimetype=mimetype,
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
-    #result = your_app_session_f_questions_function(question_entity)
-    result = "Question processing"
+    _, result = app_session.query_tune_answer(new_question=question_entity, **query_settings)
 
     return make_response(jsonify({'response': result, "id": user_id}))
 
@@ -27,10 +78,22 @@ def smthelse_processing():
     return make_response(jsonify({'response': result, "id": user_id}))
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Metrics of this worker's application session, without creating it: whether it exists yet, how long creating and
+    initializing it took, how long loading the spaCy model took once it was first used, and cache hit rates.
+    """
+    if _app_session is None:
+        return make_response(jsonify({'session_ready': False}))
+    app_session, _ = _app_session
+    return make_response(jsonify({'session_ready': True, 'session_startup_seconds': _app_session_startup_seconds,
+                                  **app_session.startup_metrics(), 'caches': app_session.cache_stats()}))
+
 @app.route('/', methods=['GET'])
 def welcome():
     return make_response(jsonify({'welcomeMessage': "Welcome to Flask!"}))
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=env.get("PORT", 3000))
\ No newline at end of file
+    app.run(host="0.0.0.0", port=env.get("PORT", 3000))
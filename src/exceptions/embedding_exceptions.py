@@ -0,0 +1,5 @@
+class EmbeddingConfigurationError(Exception):
+    def __init__(self, embedder_name, reason):
+        super().__init__(f'{embedder_name} can not be used as configured: {reason}')
+        self.embedder_name = embedder_name
+        self.reason = reason
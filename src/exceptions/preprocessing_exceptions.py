@@ -0,0 +1,8 @@
+class SpacyModelNotFoundError(Exception):
+    def __init__(self, model_name, model_path=None):
+        location = f'at {model_path}' if model_path is not None else 'as an installed package'
+        super().__init__(f'spaCy model {model_name} was not found {location}. Install it when building the '
+                         f'environment with "python -m spacy download {model_name}", or vendor the model folder '
+                         f'and set preprocessing.spacy.model_path')
+        self.model_name = model_name
+        self.model_path = model_path
@@ -1,5 +1,9 @@
 import os
-from typing import List, Optional
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
 from yaml import safe_load
 from pathlib import Path
 import numpy as np
@@ -12,7 +16,9 @@ load_dotenv()
 
 
 from qdrant_client import QdrantClient
-from qdrant_client.models import PointStruct, Distance, VectorParams, \
+from qdrant_client.http.exceptions import ResponseHandlingException, UnexpectedResponse
+from qdrant_client.local.qdrant_local import QdrantLocal
+from qdrant_client.models import Batch, PointStruct, Distance, VectorParams, \
     Filter, FieldCondition, MatchText, PointIdsList
 
 from utils.logging_utils import create_logger
@@ -32,6 +38,12 @@ class AbstractDatabase(ABC):
 class VectorDataBase(AbstractDatabase):
     """
     Represents a vector database.
+
+    Whether a table's collection exists, and its status and vector params, are fetched from qdrant once per table
+    and cached (collection_info), so searches and writes are a single round trip. The collection is created on the
+    first write to a table that does not exist. Changes made through this object (create_table, drop_table) update
+    the cache; changes made elsewhere need invalidate_collection, although a write or search that fails on a
+    collection the cache wrongly believes in refreshes it by itself.
     """
 
     def __init__(self, table_name: str, vec_size: int = 300, log_level:str = 'INFO'):
@@ -48,6 +60,8 @@ class VectorDataBase(AbstractDatabase):
         self.table_name = table_name
         self.vec_size = vec_size
         self.client = None
+        self.collections = {}  # table name -> collection_info
+        self.collections_lock = threading.Lock()
         self.logger = create_logger(log_level, log_name = 'VectorDataBase')
 
     def reset_table(self, table_name: str, table_schema: List[str]):
@@ -82,51 +96,174 @@ class VectorDataBase(AbstractDatabase):
             collection_name=self.table_name,
             vectors_config=VectorParams(size=self.vec_size, distance=Distance.COSINE),
         )
+        self._cache_collection(self.table_name, {'exists': True, 'status': 'green', 'vec_size': self.vec_size,
+                                                 'distance': Distance.COSINE.value})
         self.logger.info(f'Qdrant table {self.table_name} has been created')
 
-    
+    def _cache_collection(self, table_name: str, info: Dict):
+        with self.collections_lock:
+            self.collections[table_name] = info
+
+    def _fetch_collection_info(self, table_name: str) -> Dict:
+        """Asks qdrant for the collection of a table, a missing collection is a 404 (a ValueError for the local client)."""
+        try:
+            collection = self.client.get_collection(table_name)
+        except (UnexpectedResponse, ValueError) as err:
+            if isinstance(err, UnexpectedResponse) and err.status_code != 404:
+                raise
+            return {'exists': False, 'status': None, 'vec_size': None, 'distance': None}
+        vectors = collection.config.params.vectors
+        distance = getattr(vectors, 'distance', None)
+        return {'exists': True, 'status': getattr(collection.status, 'value', collection.status),
+                'vec_size': getattr(vectors, 'size', None), 'distance': getattr(distance, 'value', distance)}
+
+    def collection_info(self, refresh: bool = False) -> Dict:
+        """
+        Metadata of the current table's collection, fetched from qdrant on first use and then served from the cache.
+
+        Args:
+            refresh: Fetch it again even if it is cached.
+
+        Returns:
+            Dict: exists, and the status, vec_size and distance of the collection (None if it does not exist).
+        """
+        table_name = self.table_name
+        with self.collections_lock:
+            info = self.collections.get(table_name)
+        if info is None or refresh:
+            info = self._fetch_collection_info(table_name)
+            self._cache_collection(table_name, info)
+        return info
+
+    def invalidate_collection(self, table_name: str = None):
+        """
+        Forget the cached metadata of a table's collection, e.g. after another process dropped or recreated it.
+
+        Args:
+            table_name: Name of the table, defaults to the current one.
+        """
+        with self.collections_lock:
+            self.collections.pop(table_name or self.table_name, None)
+
+    def _ensure_collection(self):
+        """
+        Creates the current table's collection if it does not exist, before the first write.
+
+        Raises:
+            ValueError: If the collection exists with vectors of another size.
+        """
+        info = self.collection_info()
+        if not info['exists']:
+            self.logger.warning(f'Qdrant table {self.table_name} does not exist, creating a new table')
+            try:
+                self.client.create_collection(
+                    collection_name=self.table_name,
+                    vectors_config=VectorParams(size=self.vec_size, distance=Distance.COSINE),
+                )
+            except (UnexpectedResponse, ValueError):
+                if not self.collection_info(refresh=True)['exists']:
+                    raise
+                return  # created by another writer meanwhile
+            self._cache_collection(self.table_name, {'exists': True, 'status': 'green', 'vec_size': self.vec_size,
+                                                     'distance': Distance.COSINE.value})
+        elif info['vec_size'] is not None and info['vec_size'] != self.vec_size:
+            raise ValueError(f'Qdrant table {self.table_name} holds vectors of size {info["vec_size"]}, '
+                             f'not {self.vec_size}')
+
+    def _write(self, write):
+        """
+        Runs a write on the current table, creating its collection first if needed. If the write fails because the
+        cached collection no longer exists, the collection is created again and the write retried once.
+        """
+        self._ensure_collection()
+        try:
+            return write()
+        except (UnexpectedResponse, ValueError):
+            if self.collection_info(refresh=True)['exists']:
+                raise
+            self._ensure_collection()
+            return write()
+
+    @property
+    def is_local(self) -> bool:
+        """Whether the client runs qdrant in this process (':memory:' or a path) rather than talking to a server."""
+        return isinstance(getattr(self.client, '_client', None), QdrantLocal)
+
     def insert_rows(self, vectors: List[List[float]], id_list: List[int],
                     key: str, key_value:int):
         """
-        Insert rows to the table with the given vectors and IDs.
+        Insert rows to the table with the given vectors and IDs, in batches (see bulk_insert).
 
         Args:
-            vectors: List of vectors.
+            vectors: List of vectors, or a numpy matrix with one vector per row.
             id_list: List of IDs.
             key: String name of the key. For example: "user_id"
             key_value: String value of the key, For example, a key:key_value pair looks like this - "user_id": 123
 
         """
-        status = self.client.get_collection(os.environ.get('QDRANT_QUESTIONS_TABLE_NAME'))
-        if status.status[0] != 'g':
-            self.logger.warning(f'Qdrant table {self.table_name} does not exist, creating a new table')
-            self.create_table()
-        if key_value == None:
-            self.client.upsert(
-            collection_name=self.table_name,
-            points=[PointStruct(
-                id=idx,
-                vector=vector,
-                
-            )
-            for vector, idx in zip(vectors, id_list)
-            ]
-        )
-        else:
-            self.client.upsert(
-                collection_name=self.table_name,
-                points=[PointStruct(
-                    id=idx,
-                    vector=vector,
-                    payload={
-                            key : key_value
-                            }
-                    
-                )
-                for vector, idx in zip(vectors, id_list)
-                ]
-            )
-        self.logger.info(f'Qdrant table {self.table_name} rows have been inserted')
+        payloads = None if key_value == None else [{key: key_value} for _ in id_list]
+        self.bulk_insert(vectors, id_list, payloads=payloads)
+
+    def bulk_insert(self, vectors: np.ndarray, id_list: List, payloads: List[Dict] = None, batch_size: int = 256,
+                    parallel: int = 2, max_retries: int = 3, retry_delay: float = 0.5) -> Dict:
+        """
+        Upsert many points in batches sent by `parallel` writers. Each batch is converted to lists only when it is
+        sent, as one columnar Batch rather than a PointStruct per point, and without waiting for qdrant to apply it
+        (wait=False). A failed batch is retried with exponential backoff; client errors (4xx) are not retried. When
+        every batch has been acknowledged, the last batch is upserted again with wait=True: qdrant applies the updates
+        of a collection in order, so once it returns every point is searchable. The batches are sent through _write,
+        so if the collection has disappeared meanwhile it is created again and every batch sent once more (upserts
+        are idempotent). The local client is not thread safe, it gets one batch at a time whatever `parallel` is.
+
+        Args:
+            vectors: Numpy matrix with one vector per row, or a list of vectors.
+            id_list: List of IDs, one per vector.
+            payloads: Optional list of payload dicts, one per vector.
+            batch_size: Number of points per upsert request.
+            parallel: Number of batches in flight at a time, 1 for the local client.
+            max_retries: Number of times a failed batch is sent again before the error is raised.
+            retry_delay: Seconds before the first retry, doubled for every further one.
+
+        Returns:
+            Dict: Number of points and batches, retries, seconds and points per second.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        id_list = id_list.tolist() if isinstance(id_list, np.ndarray) else list(id_list)
+        if len(vectors) != len(id_list) or (payloads is not None and len(payloads) != len(id_list)):
+            raise ValueError(f'Got {len(vectors)} vectors, {len(id_list)} ids and '
+                             f'{len(payloads) if payloads is not None else None} payloads')
+        starts = range(0, len(id_list), batch_size)
+        parallel = 1 if self.is_local else parallel
+        start_time = time.perf_counter()
+
+        def upsert_batch(start: int, wait: bool = False) -> int:
+            end = start + batch_size
+            batch = Batch(ids=id_list[start:end], vectors=vectors[start:end].tolist(),
+                          payloads=payloads[start:end] if payloads is not None else None)
+            for attempt in range(max_retries + 1):
+                try:
+                    self.client.upsert(collection_name=self.table_name, points=batch, wait=wait)
+                    return attempt
+                except (UnexpectedResponse, ResponseHandlingException) as err:
+                    status_code = getattr(err, 'status_code', None)
+                    if attempt == max_retries or (status_code is not None and status_code < 500):
+                        raise  # a missing collection (404) is handled by _write
+                    self.logger.warning(f'Upserting points {start}-{min(end, len(id_list))} into qdrant table '
+                                        f'{self.table_name} failed ({err}), retry {attempt + 1} of {max_retries}')
+                    time.sleep(retry_delay * 2 ** attempt)
+
+        def upsert_all() -> int:
+            with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix='qdrant-bulk') as executor:
+                batch_retries = sum(executor.map(upsert_batch, starts))
+            return batch_retries + upsert_batch(starts[-1], wait=True)  # consistency barrier
+
+        retries = self._write(upsert_all) if len(id_list) > 0 else 0
+        seconds = time.perf_counter() - start_time
+        stats = {'points': len(id_list), 'batches': len(starts), 'retries': retries, 'seconds': seconds,
+                 'points_per_second': len(id_list) / seconds if seconds else None}
+        self.logger.info(f'Qdrant table {self.table_name} rows have been inserted: {len(id_list)} in {len(starts)} '
+                         f'batches, {stats["points_per_second"] or 0:.0f} points/s')
+        return stats
 
 
     def query_app_q(self, query_vector: List[float], key: str = None, key_value: str = None, limit: int = 1):
@@ -146,35 +283,50 @@ class VectorDataBase(AbstractDatabase):
             Otherwise:
                 self.rows: A list of lists of question_id's and similarity scores with this format:  
                            [[id, score],[id, score],...]
+            An empty dict if the table does not exist yet.
         """
-        status = self.client.get_collection(os.environ.get('QDRANT_QUESTIONS_TABLE_NAME'))
-        if status.status[0] != 'g':
-            self.logger.warning(f'Qdrant table {self.table_name} does not exist, creating a new table')
-            self.create_table()
+        self.rows = []
+        if not self.collection_info()['exists']:
+            self.logger.warning(f'Qdrant table {self.table_name} does not exist, no questions to match')
+            self.hist_question_id_score_dict = {}
+            return self.hist_question_id_score_dict
 
-        if key_value is not None:
-            self.rows = self.client.search(
+        try:
+            if key_value is not None:
+                self.rows = self.client.search(
+                    collection_name=self.table_name,
+                    query_vector=query_vector,
+                    query_filter=Filter(
+                        must=[FieldCondition(
+                            key=key,
+                            match=MatchText(text=key_value),
+                        )]
+                    ),
+                    limit=limit
+                )
+            else: 
+                self.rows = self.client.search(
                 collection_name=self.table_name,
                 query_vector=query_vector,
-                query_filter=Filter(
-                    must=[FieldCondition(
-                        key=key,
-                        match=MatchText(text=key_value),
-                    )]
-                ),
                 limit=limit
             )
-        else: 
-            self.rows = self.client.search(
-            collection_name=self.table_name,
-            query_vector=query_vector,
-            limit=limit
-        )
+        except (UnexpectedResponse, ValueError):
+            if self.collection_info(refresh=True)['exists']:
+                raise
+            self.logger.warning(f'Qdrant table {self.table_name} has been dropped, no questions to match')
         self.logger.info(f'Qdrant table {self.table_name} has been queried')
   
         self.hist_question_id_score_dict = {row.id: row.score for i, row in enumerate(self.rows)}
         return self.hist_question_id_score_dict
         
+    def drop_table(self):
+        """
+        Delete the table and all its vectors.
+        """
+        self.client.delete_collection(collection_name=self.table_name)
+        self._cache_collection(self.table_name, {'exists': False, 'status': None, 'vec_size': None, 'distance': None})
+        self.logger.info(f'Qdrant table {self.table_name} has been dropped')
+
     def delete_rows(self, id_list: List[int]):
         """
         Delete rows from the table with the given IDs.
@@ -182,17 +334,21 @@ class VectorDataBase(AbstractDatabase):
         Args:
             id_list: List of IDs.
         """
-        status = self.client.get_collection(os.environ.get('QDRANT_QUESTIONS_TABLE_NAME'))
-        if status.status[0] != 'g':
-            self.logger.warning(f'Qdrant table {self.table_name} does not exist, creating a new table')
+        if not self.collection_info()['exists']:
+            self.logger.warning(f'Qdrant table {self.table_name} does not exist')
             self.logger.error('Cant delete rows!')
+            return
 
-        self.client.delete(
-            collection_name=self.table_name,
-            points_selector=PointIdsList(
-                points=id_list,
-            ),
-        )
+        try:
+            self.client.delete(
+                collection_name=self.table_name,
+                points_selector=PointIdsList(
+                    points=id_list,
+                ),
+            )
+        except (UnexpectedResponse, ValueError):
+            self.invalidate_collection()
+            raise
         self.logger.info(f'Qdrant table {self.table_name} rows have been deleted')
     
     def update_vectors(self, vectors: List[List[float]], id_list: List[int]):
@@ -204,12 +360,7 @@ class VectorDataBase(AbstractDatabase):
             id_list: List of IDs.
 
         """
-        status = self.client.get_collection(os.environ.get('QDRANT_QUESTIONS_TABLE_NAME'))
-        if status.status[0] != 'g':
-            self.logger.warning(f'Qdrant table {self.table_name} does not exist, creating a new table')
-            self.create_table()
-
-        self.client.update_vectors(
+        self._write(lambda: self.client.update_vectors(
             collection_name=self.table_name,
             points=[PointStruct(
                 id=idx,
@@ -218,7 +369,7 @@ class VectorDataBase(AbstractDatabase):
             )
             for vector, idx in zip(vectors, id_list)
             ]
-        )
+        ))
         self.logger.info(f'Qdrant table {self.table_name} vectors have been updated')
 
 
@@ -368,6 +519,52 @@ class PostgresDatabase(AbstractDatabase):
         return self.df
 
 
+    def iter_questions(self, user_id: Optional[str] = None, chunksize: int = 1000,
+                       table_name_forms: str = 'forms_auto_fill', table_name_questions: str = 'questions'):
+        """
+        Streams question ids and texts in chunks through a server-side cursor, so that only one chunk is held in
+        memory however many questions there are. Meant to feed QuestionEmbeddingPipeline.
+
+        Args:
+            user_id: ID of the user whose questions are fetched, as in query_questions_user. None fetches every
+                question any user has answered, e.g. to re-embed all questions when the embedding model changes.
+            chunksize: Number of questions fetched per round trip and per chunk.
+            table_name_forms: Name of the forms table. Default is 'forms_auto_fill'.
+            table_name_questions: Name of the questions table. Default is 'questions'.
+
+        Returns:
+            generator: Yields (question ids, question texts) pairs of lists with up to chunksize questions.
+        """
+        if user_id is None:
+            query = f"""SELECT DISTINCT
+            f.question_id,
+            q.name
+            FROM {table_name_forms} f
+            INNER JOIN {table_name_questions} q ON q.id = f.question_id
+            """
+        else:
+            query = f"""SELECT
+            question_id,
+            name
+            FROM {table_name_forms} f
+            LEFT JOIN {table_name_questions} q ON q.id = f.question_id
+            WHERE f.user_id = '{user_id}'
+            """
+        # a named cursor keeps the result on the server and fetches it chunk by chunk
+        with self.conn.cursor(name=f'iter_questions_{uuid.uuid4().hex}') as cursor:
+            cursor.itersize = chunksize
+            cursor.execute(query)
+            n_questions = 0
+            while rows := cursor.fetchmany(chunksize):
+                n_questions += len(rows)
+                question_ids, names = (list(column) for column in zip(*rows))
+                yield question_ids, names
+        if n_questions == 0:
+            self.logger.warning(f'No questions for {"this user " + user_id if user_id else "any user"} were found')
+        else:
+            self.logger.info(f'streamed {n_questions} question ids and texts')
+
+
     def query_answers_question_id(self, table_name_forms: str = 'forms_auto_fill',
                              table_name_answers: str = 'answers',
                              table_name_questions: str = 'questions',
@@ -0,0 +1,220 @@
+import queue
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Tuple
+
+from utils.logging_utils import create_logger
+
+_DONE = object()
+
+
+class PipelineStopped(Exception):
+    """Raised inside a stage when another stage failed and the pipeline is shutting down."""
+
+
+class QuestionEmbeddingPipeline:
+    """
+    Streams questions from a source of chunks through preprocessing and embedding into the vector database.
+
+    The four stages (fetch, prep, embed, upsert) run on their own threads and hand chunks of questions to each other
+    through bounded queues: a stage that falls behind blocks the ones before it (backpressure), so no more than
+    about `queue_size` chunks wait between two stages and memory stays flat however many questions are streamed.
+    While one chunk is being upserted over the network the next one is embedded and the one after it cleaned, which
+    keeps the CPU busy during database round trips. Preprocessing is one continuous iter_prep_sentences stream, so a
+    SpacyPrep with n_process > 1 spreads it over that many processes without starting them again per chunk; embedding
+    and upserting can use several threads (onnxruntime and the qdrant client release the GIL).
+
+    If a stage fails the others stop and run() raises the error.
+
+    Attributes:
+        spc (AbstractPrep): Cleans the questions.
+        embed_model (AbstractEmbedder): Embeds the cleaned questions.
+        qdrant_db (VectorDataBase): Connected vector database the vectors are upserted into.
+        stats (Dict): Statistics of the last run, see run().
+    """
+
+    def __init__(self, spc, embed_model, qdrant_db, queue_size: int = 4, embed_workers: int = 1,
+                 upsert_workers: int = 2, upsert_batch_size: int = 256, upsert_parallel: int = 2,
+                 upsert_max_retries: int = 3, log_level: str = 'INFO'):
+        """
+        Args:
+            spc (AbstractPrep): Cleans the questions.
+            embed_model (AbstractEmbedder): Embeds the cleaned questions.
+            qdrant_db (VectorDataBase): Connected vector database the vectors are upserted into.
+            queue_size (int): Chunks buffered between two stages.
+            embed_workers (int): Threads embedding chunks.
+            upsert_workers (int): Threads upserting chunks.
+            upsert_batch_size (int): Points per upsert request, see VectorDataBase.bulk_insert.
+            upsert_parallel (int): Upsert requests in flight per upserted chunk.
+            upsert_max_retries (int): Retries of a failed upsert request.
+            log_level (str): logger level, can be 'INFO', 'DEBUG', 'WARNING', 'ERROR'
+        """
+        self.spc = spc
+        self.embed_model = embed_model
+        self.qdrant_db = qdrant_db
+        self.queue_size = queue_size
+        self.embed_workers = embed_workers
+        self.upsert_workers = upsert_workers
+        self.upsert_batch_size = upsert_batch_size
+        self.upsert_parallel = upsert_parallel
+        self.upsert_max_retries = upsert_max_retries
+        self.stats = None
+        self.logger = create_logger(log_level, log_name='QuestionEmbeddingPipeline')
+
+    def _put(self, out_queue: queue.Queue, item):
+        """Blocks while the next stage is behind, unless the pipeline is stopping."""
+        while True:
+            if self._stop.is_set():
+                raise PipelineStopped()
+            try:
+                return out_queue.put(item, timeout=0.1)
+            except queue.Full:
+                pass
+
+    def _get(self, in_queue: queue.Queue):
+        """Blocks until the previous stage hands over a chunk, unless the pipeline is stopping."""
+        while True:
+            if self._stop.is_set():
+                raise PipelineStopped()
+            try:
+                return in_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+    def _timed(self, stage: str, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        with self._stats_lock:
+            self.stats['busy_seconds'][stage] += time.perf_counter() - start
+        return result
+
+    def _fetch(self, chunks: Iterable[Tuple[List, List[str]]], out_queue: queue.Queue):
+        iterator = iter(chunks)
+        try:
+            while True:
+                chunk = self._timed('fetch', next, iterator, None)
+                if chunk is None:
+                    break
+                if len(chunk[0]) > 0:
+                    self._put(out_queue, chunk)
+        finally:
+            if hasattr(iterator, 'close'):  # releases e.g. the server-side cursor when the pipeline stops early
+                iterator.close()
+        self._put(out_queue, _DONE)
+
+    def _prep(self, in_queue: queue.Queue, out_queue: queue.Queue):
+        pending = deque()  # ids of the chunks whose texts have been handed to the prep, in order
+        waited = [0.0]  # seconds the prep spent waiting for chunks, not working
+
+        def texts():
+            while True:
+                start = time.perf_counter()
+                chunk = self._get(in_queue)
+                waited[0] += time.perf_counter() - start
+                if chunk is _DONE:
+                    return
+                ids, names = chunk
+                pending.append(list(ids))
+                yield from names
+
+        tokens = []
+        cleaned = iter(self.spc.iter_prep_sentences(texts()))
+        while True:
+            waited[0] = 0.0
+            start = time.perf_counter()
+            sentence_tokens = next(cleaned, _DONE)
+            with self._stats_lock:
+                self.stats['busy_seconds']['prep'] += time.perf_counter() - start - waited[0]
+            if sentence_tokens is _DONE:
+                break
+            tokens.append(sentence_tokens)
+            if len(tokens) == len(pending[0]):
+                self._put(out_queue, (pending.popleft(), tokens))
+                tokens = []
+        self._put(out_queue, _DONE)
+
+    def _embed(self, in_queue: queue.Queue, out_queue: queue.Queue):
+        while (chunk := self._get(in_queue)) is not _DONE:
+            ids, tokens = chunk
+            self._put(out_queue, (ids, self._timed('embed', self.embed_model.liststr_to_matrix, tokens)))
+        in_queue.put(_DONE)  # for the other workers of this stage
+
+    def _upsert(self, in_queue: queue.Queue):
+        while (chunk := self._get(in_queue)) is not _DONE:
+            ids, vectors = chunk
+            bulk_stats = self._timed('upsert', self.qdrant_db.bulk_insert, vectors, ids, None,
+                                     self.upsert_batch_size, self.upsert_parallel, self.upsert_max_retries)
+            with self._stats_lock:
+                self.stats['chunks'] += 1
+                self.stats['questions'] += len(ids)
+                self.stats['upsert_retries'] += bulk_stats['retries']
+        in_queue.put(_DONE)
+
+    def _run_stage(self, name: str, target, args, workers: int = 1, out_queue: queue.Queue = None) -> List:
+        """
+        Starts the workers of a stage. With several workers, the last one to finish tells the next stage (through
+        `out_queue`) that no more chunks are coming; single worker stages do that themselves.
+        """
+        remaining = [workers]
+
+        def run():
+            try:
+                target(*args)
+                with self._stats_lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last and out_queue is not None:
+                    self._put(out_queue, _DONE)
+            except PipelineStopped:
+                pass
+            except BaseException as err:
+                with self._stats_lock:
+                    self._error = self._error or err
+                self.logger.error(f'Stage {name} failed: {err}')
+                self._stop.set()
+
+        threads = [threading.Thread(target=run, name=f'pipeline-{name}-{i}', daemon=True) for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def run(self, chunks: Iterable[Tuple[List, List[str]]]) -> Dict:
+        """
+        Streams the chunks through the pipeline and returns when every question has been upserted.
+
+        Args:
+            chunks (Iterable[Tuple[List, List[str]]]): (question ids, question texts) pairs, e.g.
+                PostgresDatabase.iter_questions. Consumed lazily, one chunk ahead of the queue.
+
+        Returns:
+            Dict: Number of chunks and questions upserted, retried upsert requests, wall clock seconds, questions per
+                second, and the seconds every stage spent working (summed over its workers), which shows the
+                bottleneck.
+
+        Raises:
+            Exception: The error of the first stage that failed.
+        """
+        self._stop = threading.Event()
+        self._error = None
+        self._stats_lock = threading.Lock()
+        self.stats = {'chunks': 0, 'questions': 0, 'upsert_retries': 0, 'seconds': None, 'questions_per_second': None,
+                      'busy_seconds': {'fetch': 0.0, 'prep': 0.0, 'embed': 0.0, 'upsert': 0.0}}
+        fetched, cleaned, embedded = (queue.Queue(maxsize=self.queue_size) for _ in range(3))
+
+        start = time.perf_counter()
+        threads = (self._run_stage('fetch', self._fetch, (chunks, fetched)) +
+                   self._run_stage('prep', self._prep, (fetched, cleaned)) +
+                   self._run_stage('embed', self._embed, (cleaned, embedded), self.embed_workers, embedded) +
+                   self._run_stage('upsert', self._upsert, (embedded,), self.upsert_workers))
+        for thread in threads:
+            thread.join()
+        if self._error is not None:
+            raise self._error
+
+        self.stats['seconds'] = time.perf_counter() - start
+        self.stats['questions_per_second'] = (self.stats['questions'] / self.stats['seconds']
+                                              if self.stats['seconds'] else None)
+        self.logger.info(f'Upserted {self.stats["questions"]} questions in {self.stats["chunks"]} chunks in '
+                         f'{self.stats["seconds"]:.2f}s, busy seconds per stage {self.stats["busy_seconds"]}')
+        return self.stats
@@ -1,43 +1,193 @@
 # training_pipeline_a
 from utils.logging_utils import create_logger
+from utils.result_sink import BufferedResultSink
+from pathlib import Path
+from itertools import islice, product
+from typing import Iterator
+import hashlib
+import io
+import json
+import math
 import pandas as pd
 
 class jobPostIingest:
     """
     Ingestion of job posts, feeding in only the ones that haven't yet been processed.
+
+    Every posting is identified by a content hash of all its fields except 'salaries' and 'skill_summary'. The hashes
+    of postings that were already summarized are read from the checkpoint the gpt output sink keeps next to the output
+    csv, so a run only reads the raw postings and an index of hashes, never the previous output itself.
+    Line-delimited json (.jsonl/.ndjson) is read in chunks, so memory use follows the chunk size and the number of
+    new postings rather than the size of the archive.
+
+    Output csvs written before the checkpoint existed carry no hashes. The result sink seeds its checkpoint from them
+    with legacy_posting_hash, which matches their rows to the raw postings, so open the sink before iterating.
     """
 
-    def __init__(self, job_descr_path: str, gpt_output_path: str, log_level:str):
-        """                
+    HASH_COLUMN = 'posting_hash'
+    IGNORED_COLUMNS = ('salaries', 'skill_summary')
+    SUMMARY_COLUMN_PREFIX = 'hard_skills_'
+
+    def __init__(self, job_descr_path: str, gpt_output_path: str, log_level:str, manifest_path: Path = None,
+                 chunksize: int = 1000):
+        """
         Args:
         job_descr_path (str): Path to JSON file containing job descriptions.
         gpt_output_path (str): Path to CSV file containing ChatGPT responses.
         log_level (str): log level (INFO, DEBUG, etc)
+        manifest_path (Path): Index of the hashes of processed postings. Defaults to the checkpoint of the gpt output.
+        chunksize (int): Number of raw postings read at a time.
         """
         self.job_descr_path = job_descr_path
         self.gpt_output_path = gpt_output_path
+        self.manifest_path = manifest_path or Path(gpt_output_path).with_name(Path(gpt_output_path).name + '.checkpoint')
+        self.chunksize = chunksize
         self.logger = create_logger(log_level = log_level, log_name = 'jp_ingestion_log')
 
+    @classmethod
+    def record_hash(cls, record: dict) -> str:
+        """
+        Content hash of one posting, ignoring the columns that change between scrapes of the same posting.
+        Only the posting's own values are hashed, as the text a csv holds for them, and empty values are left out, so
+        the hash depends neither on the postings read along with it nor on the types pandas would infer for them.
+
+        Args:
+            record (dict): The raw posting, as parsed from json.
+
+        Returns:
+            str: Hex digest.
+        """
+        text = {column: cls._csv_text(value) for column, value in record.items()
+                if column not in cls.IGNORED_COLUMNS and column != cls.HASH_COLUMN}
+        text = {column: value for column, value in text.items() if value != ''}
+        return hashlib.blake2b(json.dumps(text, sort_keys=True).encode('utf-8'), digest_size=16).hexdigest()
+
+    @classmethod
+    def posting_hash(cls, df: pd.DataFrame) -> pd.Series:
+        """
+        Content hash of every posting of a data frame, see record_hash.
+
+        Args:
+            df (pd.DataFrame): Raw job postings.
+
+        Returns:
+            pd.Series: Hex digest per posting.
+        """
+        return pd.Series([cls.record_hash(record) for record in df.to_dict('records')], index=df.index, dtype=object)
+
+    @staticmethod
+    def _csv_text(value) -> str:
+        """Missing values are empty, whole floats are written as integers (3.0 and 3 are the same count)."""
+        if value is None or value is pd.NaT or (isinstance(value, float) and math.isnan(value)):
+            return ''
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        return str(value)
+
+    def legacy_posting_hash(self, df: pd.DataFrame) -> pd.Series:
+        """
+        Hashes of the postings of an output csv written before the checkpoint existed, read with dtype=str and
+        keep_default_na=False. Its rows hold the postings as pandas wrote them after inferring the column types of
+        the whole raw file of that time, which changes the raw values (a zip code '02139' became 2139.0, a count 3
+        became 3.0, a date column may be written as a timestamp), so they can't be hashed like the raw postings.
+        Instead every row is matched to the raw posting it was written from: numbers are compared by value, and
+        each value against both the raw text and the text pandas writes for the raw file now. Rows that match no
+        raw posting are left out and summarized again.
+
+        Args:
+            df (pd.DataFrame): Rows of the old output csv.
+
+        Returns:
+            pd.Series: Hex digest per matched posting.
+        """
+        columns = [c for c in df.columns if not c.startswith(self.SUMMARY_COLUMN_PREFIX)
+                   and c not in self.IGNORED_COLUMNS and c != self.HASH_COLUMN]
+        lines = Path(self.job_descr_path).suffix in ('.jsonl', '.ndjson')
+        with open(self.job_descr_path, 'r', encoding='utf-8') as file:
+            records = [json.loads(line) for line in file if line.strip()] if lines else json.load(file)
+        buffer = io.StringIO()
+        pd.read_json(self.job_descr_path, lines=lines).to_csv(buffer, index=False)
+        buffer.seek(0)
+        written = pd.read_csv(buffer, dtype=str, keep_default_na=False).reindex(columns=columns, fill_value='')
+        raw_text = [[self._csv_text(record.get(column)) for column in columns] for record in records]
+        candidates = [list(zip(*values)) for values in zip(raw_text, written.itertuples(index=False, name=None))]
+        hashes = {}
+        for record, values in zip(records, candidates):
+            record_hash = self.record_hash(record)
+            for key in product(*({self._number_text(v) for v in value} for value in values)):
+                hashes.setdefault(key, record_hash)
+        matched = [hashes.get(tuple(map(self._number_text, row)))
+                   for row in df[columns].itertuples(index=False, name=None)]
+        return pd.Series([h for h in matched if h is not None], dtype=object)
+
+    @staticmethod
+    def _number_text(text: str) -> str:
+        """Numbers as their value, '02139', '2139' and '2139.0' are the same."""
+        try:
+            number = float(text)
+        except ValueError:
+            return text
+        return str(int(number)) if number.is_integer() else repr(number)
+
+    def _read_chunks(self) -> Iterator[pd.DataFrame]:
+        """
+        Reads the raw postings chunk by chunk, with their hash. Postings are hashed from the parsed json, before pandas
+        infers column types from the other postings of the chunk.
+        """
+        if Path(self.job_descr_path).suffix in ('.jsonl', '.ndjson'):
+            with open(self.job_descr_path, 'r', encoding='utf-8') as file:
+                records = (json.loads(line) for line in file if line.strip())
+                while chunk := list(islice(records, self.chunksize)):
+                    yield self._to_frame(chunk)
+        else:
+            self.logger.info('raw job posts are a single json document, convert them to .jsonl to read them in chunks')
+            with open(self.job_descr_path, 'r', encoding='utf-8') as file:
+                records = json.load(file)
+            if not isinstance(records, list):  # column oriented
+                records = pd.read_json(self.job_descr_path, dtype=False, convert_dates=False).to_dict('records')
+            for start in range(0, len(records), self.chunksize):
+                yield self._to_frame(records[start:start + self.chunksize])
+
+    def _to_frame(self, records: list) -> pd.DataFrame:
+        return pd.DataFrame(records).assign(**{self.HASH_COLUMN: [self.record_hash(record) for record in records]})
+
+    def iter_new_postings(self) -> Iterator[pd.DataFrame]:
+        """
+        Yields chunks of postings that are neither in the manifest nor seen earlier in this run.
+        Each chunk carries a 'posting_hash' column to identify the posting downstream. The manifest is read when the
+        first chunk is requested, open the result sink before that so a legacy output csv is already accounted for.
+
+        Returns:
+            Iterator[pd.DataFrame]: Chunks of new job postings, empty chunks are skipped.
+        """
+        if not Path(self.job_descr_path).exists():
+            self.logger.warning(f'No raw job post data found at {self.job_descr_path}')
+            return
+        seen = BufferedResultSink.read_checkpoint_ids(self.manifest_path)
+        self.logger.info(f'{len(seen)} job posts were processed by earlier runs')
+
+        total_new = 0
+        for df in self._read_chunks():
+            df = df[~df[self.HASH_COLUMN].isin(seen)].drop_duplicates(subset=self.HASH_COLUMN)
+            seen.update(df[self.HASH_COLUMN])
+            if df.shape[0] > 0:
+                total_new += df.shape[0]
+                self.logger.info(f'reading in {df.shape[0]} new job posts')
+                yield df
+        self.logger.info(f'{total_new} new job posts in total')
+
     def ingest_jp(self):
         """
-        Reads job descriptions from a JSON file at `job_descr_path` and appends any new responses generated by ChatGPT to the end of the file. 
-        Removes duplicate rows based on all columns except 'salaries' and 'skill_summary'.
+        Reads job descriptions from a JSON file at `job_descr_path` and returns the ones that haven't been summarized yet.
+        Duplicates are detected on all columns except 'salaries' and 'skill_summary'.
+
 
-        
         Args:
             job_descr_path (str): Path to JSON file containing job descriptions.
             gpt_output_path (str): Path to CSV file containing ChatGPT responses.
-        
+
         Returns:
-            pandas.DataFrame: A merged DataFrame containing unique rows of job descriptions and ChatGPT responses.
-        """
-        if self.job_descr_path.exists():
-            df = pd.read_json(self.job_descr_path)
-            self.logger.info('reading in raw job post data')
-        column_mask = (df.columns != 'salaries') & (df.columns != f'skill_summary')
-        df = df.drop_duplicates(subset = df.columns[column_mask])
-        if self.gpt_output_path.exists():
-            df_gpt = pd.read_csv(self.gpt_output_path)
-            self.logger.info('reading in previously summarized job post data')
-            df = pd.concat([df,df_gpt]).drop_duplicates(subset = df.columns[column_mask], keep = False)
-        return df
\ No newline at end of file
+            pandas.DataFrame: The unique, not yet summarized job descriptions.
+        """
+        chunks = list(self.iter_new_postings())
+        return pd.concat(chunks) if chunks else pd.DataFrame()
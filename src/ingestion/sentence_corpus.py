@@ -0,0 +1,70 @@
+from utils.logging_utils import create_logger
+from pathlib import Path
+from typing import Iterator, List
+import pandas as pd
+
+
+class SentenceCorpus:
+    """
+    Restartable, streaming corpus of tokenized sentences for FastText training.
+
+    Every iteration reads the file again from the start in chunks of `chunksize` rows, so gensim can go over it once
+    to build the vocabulary and once per epoch, while memory use stays at one chunk no matter how large the corpus.
+
+    Two file formats are read, by suffix:
+        .csv    one sentence per row, one token per column, as in prep_data/prep_sentences_50K.csv. Empty cells of
+                shorter sentences are skipped
+        other   plain text with one sentence per line, tokens separated by whitespace
+
+    With a `prep`, the text (of the first csv column, or of each line) is raw and is streamed through
+    SpacyPrep.iter_prep_sentences instead of being split into tokens as is.
+    """
+
+    def __init__(self, path: Path, prep=None, chunksize: int = 10000, log_level: str = 'INFO'):
+        """
+        Args:
+            path (Path): The csv or text file.
+            prep (SpacyPrep, optional): Cleans raw sentences, None if the file is already preprocessed.
+            chunksize (int): Number of sentences read (and cleaned) at a time.
+            log_level (str): logger level, can be 'INFO', 'DEBUG', 'WARNING', 'ERROR'
+        """
+        self.path = Path(path)
+        self.prep = prep
+        self.chunksize = chunksize
+        self.logger = create_logger(log_level, log_name='SentenceCorpus')
+
+    def _read_chunks(self) -> Iterator[List]:
+        """Reads the file chunk by chunk, each chunk a list of csv rows or of lines."""
+        if self.path.suffix == '.csv':
+            with pd.read_csv(self.path, chunksize=self.chunksize) as reader:
+                for df in reader:
+                    yield df.values.tolist()
+        else:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                chunk = []
+                for line in file:
+                    chunk.append(line)
+                    if len(chunk) == self.chunksize:
+                        yield chunk
+                        chunk = []
+                if chunk:
+                    yield chunk
+
+    def _texts(self) -> Iterator[str]:
+        """The raw text of every sentence, for preprocessing."""
+        for chunk in self._read_chunks():
+            for row in chunk:
+                text = row[0] if isinstance(row, list) else row.strip()
+                yield text if isinstance(text, str) else ''
+
+    def __iter__(self) -> Iterator[List[str]]:
+        if self.prep is not None:
+            yield from self.prep.iter_prep_sentences(self._texts())
+            return
+        for chunk in self._read_chunks():
+            if self.path.suffix == '.csv':
+                for row in chunk:
+                    yield [token for token in row if isinstance(token, str)]
+            else:
+                for line in chunk:
+                    yield line.split()
@@ -4,7 +4,10 @@ from pathlib import Path
 import os
 
 from ingestion.jp_ingestion import jobPostIingest
+from preprocessing.description_prep import DescriptionPrep
 from modeling_clusterization.gpt_models import ChatGpt, gptPredict, Gpt4All  # can also import Gpt4All class to use with free model
+from modeling_clusterization.gpt_cache import CachedGptModel
+from utils.sqlite_cache import SqliteCache
 
 
 if __name__ == "__main__":
@@ -23,29 +26,59 @@ if __name__ == "__main__":
     prep_data_path = parent_folder_path / 'data' / cf_jobp['ingestion']['data_paths']['prep_data_path']
 
     # paths to gpt binaries and generated output csv files
-    cf_gpt_model_to_use = cf_jobp['gpt_model_constants']['cf_gpt_model_to_use']
+    cf_gpt_model_to_use = cf_jobp['gpt_model_constants']['gpt_model_to_use']
     model_path = parent_folder_path / 'data' / cf['gpt_model_constants']['model_path']
     gpt_output_path = prep_data_path / cf['gpt_model_constants'][cf_gpt_model_to_use]['gpt_output_path']  #or use gpt4all constants
     gpt_model_str =  cf['gpt_model_constants'][cf_gpt_model_to_use]['gpt_model_str'] #or use gpt4all constants
-    if cf_gpt_model_to_use == 'chatgpt':
-        chatgpt_api_timing_delay =  cf['gpt_model_constants'][cf_gpt_model_to_use]['chatgpt_api_timing_delay']
 
     # strings to generate prompts
     system_string = cf_jobp['gpt_model_constants']['default_prompt_strings']['system_string']
     user_string = cf_jobp['gpt_model_constants']['default_prompt_strings']['user_string']
+    merge_user_string = cf_jobp['gpt_model_constants']['default_prompt_strings']['merge_user_string']
 
     # logging constants and pipeline logger
     log_level = cf['utils']['log_level']
     tpa_logger = create_logger(log_level, log_name = 'training_pipeline_a_log')
 
     tpa_logger.info('running training_pipeline_a.py')
-    df = jobPostIingest(job_descr_path, gpt_output_path, log_level).ingest_jp()
+    ingestion = jobPostIingest(job_descr_path, gpt_output_path, log_level,
+                               chunksize=cf_jobp['ingestion']['chunksize'])
     
+    cf_chatgpt = cf_jobp['gpt_model_constants']['chatgpt']
     if cf_gpt_model_to_use == 'chatgpt':
-        chatgpt_api_timing_delay =  cf_jobp['gpt_model_constants'][cf_gpt_model_to_use]['chatgpt_api_timing_delay']
-        gpt_model = ChatGpt(gpt_model_str, model_path, chatgpt_api_timing_delay, log_level)
+        gpt_model = ChatGpt(gpt_model_str, model_path, cf_chatgpt['chatgpt_api_timing_delay'], log_level,
+                            requests_per_minute=cf_chatgpt['requests_per_minute'],
+                            tokens_per_minute=cf_chatgpt['tokens_per_minute'],
+                            max_concurrency=cf_chatgpt['max_concurrency'])
+    elif cf_gpt_model_to_use == 'instruct':
+        from modeling_clusterization.instruct_models import InstructGptModel  # torch is only needed for this model
+        cf_instruct = cf['gpt_model_constants']['instruct']
+        gpt_model = InstructGptModel(gpt_model_str, model_path, log_level,
+                                     max_batch_size=cf_instruct['max_batch_size'],
+                                     max_wait_ms=cf_instruct['max_wait_ms'],
+                                     num_threads=cf_instruct['num_threads'],
+                                     max_new_tokens=cf_instruct['max_new_tokens'])
     else:
-        gpt_model = Gpt4All(gpt_model_str, model_path, log_level)
+        gpt_model = Gpt4All(gpt_model_str, model_path, log_level,
+                            pool_size=cf['gpt_model_constants']['gpt4all']['pool_size']).warm_up()
+
+    cf_cache = cf['gpt_model_constants']['completion_cache']
+    if cf_cache['enabled']:
+        completion_cache = SqliteCache(parent_folder_path / 'data' / cf_cache['cache_path'],
+                                       ttl_seconds=cf_cache['ttl_days'] * 24 * 3600,
+                                       max_entries=cf_cache['max_entries'], log_level=log_level)
+        gpt_model = CachedGptModel(gpt_model, completion_cache, bypass=cf_cache['bypass'], log_level=log_level)
 
-    gpt = gptPredict(df, gpt_model, system_string, user_string, gpt_output_path, log_level)
-    gpt.apply_lambda_save_csv()
+    id_column = cf_jobp['gpt_model_constants']['id_column']
+    gpt = gptPredict(None, gpt_model, system_string, user_string, gpt_output_path, log_level,
+                     id_column=id_column,
+                     flush_interval=cf_jobp['gpt_model_constants']['flush_interval'],
+                     description_prep=DescriptionPrep(log_level=log_level) if cf_jobp['gpt_model_constants']['strip_boilerplate'] else None,
+                     max_description_tokens=cf_jobp['gpt_model_constants']['max_description_tokens'],
+                     chunk_tokens=cf_jobp['gpt_model_constants']['chunk_tokens'],
+                     merge_user_string=merge_user_string,
+                     legacy_ids=ingestion.legacy_posting_hash if id_column == jobPostIingest.HASH_COLUMN else None)
+    # opened before the postings are read: it commits the postings of an output csv from before checkpoints existed
+    gpt.result_sink(batch_size=cf_jobp['gpt_model_constants']['batch_size'])
+    for df in ingestion.iter_new_postings():
+        gpt.apply_lambda_save_csv(batch_size=cf_jobp['gpt_model_constants']['batch_size'], df=df)
@@ -3,13 +3,18 @@ import pandas as pd
 import json
 import numpy as np
 import time
+import copy
+import hashlib
+import os
 
 from utils.logging_utils import create_logger
+from exceptions.embedding_exceptions import EmbeddingConfigurationError
 
-from typing import List
+from typing import List, Callable, Dict, Iterable, Tuple
+from scipy import sparse
 from gensim.test.utils import common_texts, get_tmpfile, datapath
 from gensim.models import FastText
-from gensim.models.fasttext import load_facebook_vectors
+from gensim.models.fasttext import load_facebook_vectors, FastTextKeyedVectors, ft_ngram_hashes
 
 from abc import ABC, abstractclassmethod
 
@@ -31,6 +36,153 @@ class AbstractEmbedder(ABC):
     def liststr_to_listvec():
         pass
 
+    def liststr_to_matrix(self, sentences: List[List[str]]) -> np.ndarray:
+        """
+        Converts tokenized sentences to a float32 matrix with one sentence vector per row.
+        Embedders that can do better than stacking liststr_to_listvec override this.
+        """
+        return np.asarray(self.liststr_to_listvec(sentences), dtype=np.float32)
+
+    def model_version(self) -> str:
+        """
+        Identifies the saved model: the embedder class and the path, size and modification time of its model file.
+        Cached embeddings are only valid for the version they were computed with.
+        """
+        model_path = getattr(self, 'model_path', None)
+        stat = Path(model_path).stat() if model_path is not None and Path(model_path).exists() else None
+        version_source = f'{type(self).__name__}:{model_path}:{stat.st_size if stat else None}:{stat.st_mtime_ns if stat else None}'
+        return hashlib.sha256(version_source.encode('utf-8')).hexdigest()[:16]
+
+
+def average_token_vectors(sentences: List[List[str]],
+                          resolve_tokens: Callable[[List[str]], Tuple[np.ndarray, np.ndarray]]) -> np.ndarray:
+    """
+    Sentence vectors as the mean of their token vectors, computed in one vectorized pass.
+
+    Every distinct token is resolved once, then a sparse sentence-by-token averaging matrix is multiplied with the
+    token vectors. Tokens the model knows nothing about are left out of the mean, sentences without known tokens get
+    a zero vector.
+
+    Args:
+        sentences (List[List[str]]): Tokenized sentences.
+        resolve_tokens (Callable): Maps the distinct tokens to a float32 matrix of their (normalized) vectors and a
+            boolean mask of the tokens that have a vector.
+
+    Returns:
+        np.ndarray: A contiguous float32 array with one sentence vector per row.
+    """
+    token_index, tokens, indices, indptr = {}, [], [], [0]
+    for sent in sentences:
+        for token in sent:
+            if token not in token_index:
+                token_index[token] = len(tokens)
+                tokens.append(token)
+            indices.append(token_index[token])
+        indptr.append(len(indices))
+    token_vectors, known = resolve_tokens(tokens)
+
+    # sentence-by-token matrix of 1 / (known tokens in the sentence), the product with the token vectors is the mean
+    indices, indptr = np.asarray(indices, dtype=np.int64), np.asarray(indptr, dtype=np.int64)
+    weights = known[indices].astype(np.float32)
+    sentence_of_token = np.repeat(np.arange(len(sentences)), np.diff(indptr))
+    counts = np.bincount(sentence_of_token, weights=weights, minlength=len(sentences))[sentence_of_token]
+    averaging = sparse.csr_matrix((weights / np.maximum(counts, 1), indices, indptr), shape=(len(sentences), len(tokens)))
+    return np.ascontiguousarray(averaging @ token_vectors, dtype=np.float32)
+
+
+
+def embedding_drift_report(reference: AbstractEmbedder, candidate: AbstractEmbedder, sentences: List[List[str]],
+                           n_pairs: int = 10000, n_neighbour_queries: int = 1000, k: int = 10,
+                           seed: int = 0) -> Dict[str, float]:
+    """
+    Measures how far a compressed embedder drifts from the reference one on a sample of sentences.
+
+    Args:
+        reference (AbstractEmbedder): The full model.
+        candidate (AbstractEmbedder): The compressed model.
+        sentences (List[List[str]]): Tokenized sample sentences.
+        n_pairs (int): Random sentence pairs for the pairwise similarity drift.
+        n_neighbour_queries (int): Sentences whose nearest neighbours are compared.
+        k (int): Number of nearest neighbours compared.
+        seed (int): Random seed of the pair and query sample.
+
+    Returns:
+        Dict[str, float]: Cosine between the reference and candidate vector of the same sentence (only when the
+            dimensions match), absolute drift of pairwise cosine similarities, and recall@k of the candidate's
+            nearest neighbours among the sample against the reference's.
+    """
+    def unit(matrix):
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
+
+    ref, cand = unit(reference.liststr_to_matrix(sentences)), unit(candidate.liststr_to_matrix(sentences))
+    rng = np.random.default_rng(seed)
+    report = {'sentences': len(sentences), 'reference_dims': ref.shape[1], 'candidate_dims': cand.shape[1]}
+    if ref.shape[1] == cand.shape[1]:
+        both_empty = ~ref.any(axis=1) & ~cand.any(axis=1)  # sentences without known tokens agree trivially
+        same = np.where(both_empty, 1.0, (ref * cand).sum(axis=1))
+        report.update({'vector_cosine_mean': float(same.mean()), 'vector_cosine_p5': float(np.percentile(same, 5)),
+                       'vector_cosine_min': float(same.min())})
+
+    left, right = rng.integers(0, len(sentences), size=(2, n_pairs))
+    ref_sim, cand_sim = (ref[left] * ref[right]).sum(axis=1), (cand[left] * cand[right]).sum(axis=1)
+    drift = np.abs(ref_sim - cand_sim)
+    report.update({'pairwise_drift_mean': float(drift.mean()), 'pairwise_drift_p95': float(np.percentile(drift, 95)),
+                   'pairwise_drift_max': float(drift.max()),
+                   'pairwise_correlation': float(np.corrcoef(ref_sim, cand_sim)[0, 1])})
+
+    queries = rng.choice(len(sentences), size=min(n_neighbour_queries, len(sentences)), replace=False)
+    k = min(k, len(sentences) - 1)
+    neighbours = []
+    for matrix in (ref, cand):
+        scores = matrix[queries] @ matrix.T
+        scores[np.arange(len(queries)), queries] = -np.inf  # a sentence is not its own neighbour
+        neighbours.append(np.argpartition(-scores, k - 1, axis=1)[:, :k])
+    hits = [len(np.intersect1d(expected, found)) for expected, found in zip(*neighbours)]
+    report[f'neighbour_recall_at_{k}'] = float(np.sum(hits) / (k * len(queries)))
+    return report
+
+
+class InferenceFastTextKeyedVectors(FastTextKeyedVectors):
+    """
+    FastTextKeyedVectors stripped down to what inference needs, saved in a format that loads without recomputation.
+
+    gensim stores only the word and n-gram training matrices and recomposes every word vector on load, which costs
+    seconds and leaves each process with a private copy. Here the composed word vectors and the n-gram buckets are
+    saved as separate .npy files, so `load(path, mmap='r')` maps them read-only and all processes on the host share
+    the same physical pages.
+    """
+
+    TRAINING_ONLY = ['buckets_word', 'vectors_vocab', 'vectors_vocab_lockf', 'vectors_ngrams_lockf', 'vectors_lockf',
+                     'norms']
+
+    @classmethod
+    def from_keyed_vectors(cls, wv: FastTextKeyedVectors) -> 'InferenceFastTextKeyedVectors':
+        """Wraps trained keyed vectors without copying the arrays."""
+        kv = copy.copy(wv)
+        kv.__class__ = cls
+        return kv
+
+    def _save_specials(self, fname, separately, sep_limit, ignore, pickle_protocol, compress, subname):
+        # skips FastTextKeyedVectors._save_specials, which drops the composed vectors
+        ignore = set(ignore).union(self.TRAINING_ONLY)
+        return super(FastTextKeyedVectors, self)._save_specials(fname, separately, sep_limit, ignore, pickle_protocol,
+                                                                 compress, subname)
+
+    def _load_specials(self, *args, **kwargs):
+        # skips FastTextKeyedVectors._load_specials, which recomputes n-gram buckets and composed vectors
+        super(FastTextKeyedVectors, self)._load_specials(*args, **kwargs)
+        self.norms = None
+
+    def save_atomic(self, path: Path):
+        """Saves under a temporary name and renames the files into place, the pickle last, so a reader never loads a
+        partially written file."""
+        tmp = f'{path}.tmp{os.getpid()}'
+        self.save(tmp, separately=['vectors', 'vectors_ngrams'], sep_limit=0)
+        for attrib in ('vectors', 'vectors_ngrams'):
+            os.replace(f'{tmp}.{attrib}.npy', f'{path}.{attrib}.npy')
+        os.replace(tmp, path)
+
 
 
 class FastTextModel(AbstractEmbedder):
@@ -39,7 +191,9 @@ class FastTextModel(AbstractEmbedder):
 
     Attributes:
         model_path (str): The path to the saved model file.
-        model: The loaded FastText model.
+        model: The loaded FastText model, or only its keyed vectors when load_mode is 'mmap'.
+        load_mode (str): 'full' loads the whole trainable model, 'mmap' memory-maps inference-only keyed vectors.
+        keyed_vectors_path (Path): The path of the inference-only keyed vectors, next to the model file.
 
     Methods:
         load(): Loads a saved model from disk or initializes a new model if no path is given.
@@ -48,9 +202,13 @@ class FastTextModel(AbstractEmbedder):
         str_to_vec(sentences: List[str]) -> List[float]: Converts a list of sentences to a list of sentence vectors.
         str_to_listvec(sentences: List[List[str]]) -> List[List[float]]: Converts a list of lists of sentences to a 
             list of lists of sentence vectors.
+        liststr_to_matrix(sentences: List[List[str]]) -> np.ndarray: Converts tokenized sentences to a float32 matrix
+            of sentence vectors in one vectorized pass.
+        export_quantized(path: Path) -> QuantizedFastTextModel: Writes a pruned, quantized inference artifact.
     """
 
-    def __init__(self, model_path: str, epochs:int = 5, min_count:int = 5, log_level: str = 'INFO'):
+    def __init__(self, model_path: str, epochs:int = 5, min_count:int = 5, load_mode: str = 'full',
+                 workers: int = 3, log_level: str = 'INFO'):
         """
         Initializes an instance of FastTextModel based on saved path.
 
@@ -58,28 +216,44 @@ class FastTextModel(AbstractEmbedder):
             model_path (str): The path to the saved model file. If None, will create a sample fasttext model based on common texts
             epochs (int): Number of epochs to train the model for. More epochs = better result, but will consume more time. Performance will flatten out after too many epochs
             min_count (int): Number of repeats of a word that is needed in order to add it to vocabulary. Higher number = less memory, but less frequent words will be skipped
+            load_mode (str): 'full' loads the trainable model. 'mmap' loads inference-only keyed vectors memory-mapped
+                read-only, so gunicorn workers share one copy and start in milliseconds. They are exported from the
+                full model on save, or on first load if missing
+            workers (int): Number of worker threads used for training
         """
         self.model_path = model_path
+        self.load_mode = load_mode
+        self.keyed_vectors_path = Path(model_path).with_suffix('.kv')
         self.epochs = epochs
         self.model = None
         self.min_count = min_count
+        self.workers = workers
+        self.log_level = log_level
         self.logger = create_logger(log_level, log_name='FastTextModel')
 
 
-    def retrain(self, sentences: List[str]):
+    def retrain(self, sentences: Iterable[List[str]]):
         """
-        Retrains the model on the given list of sentences.
+        Retrains the model on the given tokenized sentences.
 
         Args:
-            sentences (List[str]): A list of sentences to train the model on.
+            sentences (Iterable[List[str]]): The sentences to train the model on. A list, or a restartable iterable
+                such as ingestion.sentence_corpus.SentenceCorpus, which is streamed from disk once for the vocabulary
+                and once per epoch. One-shot generators can't be used.
         """
 
+        if self.model is not None and not isinstance(self.model, FastText):
+            # memory-mapped keyed vectors can't be trained, continue from the full model
+            self.model = FastText.load(get_tmpfile(self.model_path))
         if self.model is None:
-            self.model = FastText(vector_size=300, window=3, min_count=self.min_count)  # instantiate
+            self.model = FastText(vector_size=300, window=3, min_count=self.min_count,
+                                  workers=self.workers)  # instantiate
             self.model.build_vocab(sentences)
         else:
+            self.model.workers = self.workers
             self.model.build_vocab(sentences, update=True)
-        self.model.train(sentences, total_examples=len(sentences), epochs=self.epochs)
+        # build_vocab counted the sentences, so a streamed corpus doesn't need a len()
+        self.model.train(sentences, total_examples=self.model.corpus_count, epochs=self.epochs)
         self.logger.info('Retraining fasttext model. Dont forget to run FastTextmodel.save() after')
         return self
     
@@ -87,6 +261,8 @@ class FastTextModel(AbstractEmbedder):
         """
         Loads a saved model from disk 
         """
+        if self.load_mode == 'mmap':
+            return self.load_keyed_vectors()
         if self.model_path.exists:
             fname = get_tmpfile(self.model_path)
             self.model = FastText.load(fname)
@@ -98,24 +274,143 @@ class FastTextModel(AbstractEmbedder):
         
     def load_keyed_vectors(self):
         """
-        Loads only keyed vectors. This consumes less cpu than full load during inference. 
+        Loads only keyed vectors, memory-mapped read-only. This consumes less cpu and memory than full load during
+        inference, processes that map the same file share its pages. The keyed vectors are exported from the full
+        model first if they don't exist yet.
         Note that you can't retrain in this case
         """
-        fname = datapath(self.model_path)
-        self.model = load_facebook_vectors(fname)
-        self.logger.info('Loaded keyed vectors only to speed up the str->vec conversion. Note that you cant retrain in this state')
+        if not self.keyed_vectors_path.exists():
+            self.logger.warning(f'No keyed vectors at {self.keyed_vectors_path}, exporting them from the full model')
+            self.model = FastText.load(get_tmpfile(self.model_path))
+            self.export_keyed_vectors()
+        start = time.perf_counter()
+        self.model = InferenceFastTextKeyedVectors.load(str(self.keyed_vectors_path), mmap='r')
+        self.logger.info(f'Memory-mapped keyed vectors in {(time.perf_counter() - start) * 1000:.0f} ms to speed up the str->vec conversion. Note that you cant retrain in this state')
         return self
 
+    def export_keyed_vectors(self):
+        """
+        Writes the inference-only keyed vectors of the trained model next to the model file.
+        """
+        InferenceFastTextKeyedVectors.from_keyed_vectors(self.model.wv).save_atomic(self.keyed_vectors_path)
+        self.logger.info(f'Exported keyed vectors to {self.keyed_vectors_path}')
+        return self
+
+    def export_quantized(self, path: Path, max_vocab: int = 50000, max_buckets: int = 200000, dtype: str = 'int8',
+                         dims: int = None) -> 'QuantizedFastTextModel':
+        """
+        Writes a compact inference artifact of the model, see QuantizedFastTextModel.
+
+        The vocabulary is cut to the most frequent words and the n-gram buckets to those used most by the kept words,
+        weighted by word frequency; buckets no trained word hashes to were never updated during training. Word vectors
+        are stored L2-normalized. With dims set, word and n-gram vectors are projected onto the top principal
+        directions of the word vectors (uncentered, so n-gram sums stay linear). Rows are stored as float16, or as
+        int8 with one float32 scale per row.
+
+        Args:
+            path (Path): Where to write the .npz artifact.
+            max_vocab (int): Number of most frequent words to keep.
+            max_buckets (int): Number of n-gram buckets to keep.
+            dtype (str): 'int8' or 'float16'.
+            dims (int): Output dimensions, None keeps vector_size.
+
+        Returns:
+            QuantizedFastTextModel: The exported model, loaded.
+        """
+        wv = self._keyed_vectors()
+        keys = wv.index_to_key[:max_vocab]  # gensim keeps the vocabulary sorted by descending frequency
+        word_vectors = np.asarray(wv.vectors[:len(keys)], dtype=np.float32)
+
+        bucket_ids, bucket_weights = [], []
+        for word in keys:
+            hashes = ft_ngram_hashes(word, wv.min_n, wv.max_n, wv.bucket)
+            bucket_ids.extend(hashes)
+            bucket_weights.extend([wv.get_vecattr(word, 'count') if 'count' in wv.expandos else 1] * len(hashes))
+        usage = np.bincount(np.asarray(bucket_ids, dtype=np.int64), weights=bucket_weights, minlength=wv.bucket)
+        kept_buckets = np.argsort(-usage, kind='stable')[:max_buckets]
+        kept_buckets = np.sort(kept_buckets[usage[kept_buckets] > 0]).astype(np.uint32)
+        ngram_vectors = np.asarray(wv.vectors_ngrams[kept_buckets], dtype=np.float32)
+
+        projection = None
+        if dims is not None and dims < wv.vector_size:
+            _, _, vt = np.linalg.svd(word_vectors, full_matrices=False)
+            projection = vt[:dims].T.astype(np.float32)
+            word_vectors, ngram_vectors = word_vectors @ projection, ngram_vectors @ projection
+        norms = np.linalg.norm(word_vectors, axis=1, keepdims=True)
+        word_vectors = word_vectors / np.where(norms == 0, 1, norms)
+
+        arrays = {'keys': np.array(keys, dtype=str), 'bucket_ids': kept_buckets,
+                  'ngram_params': np.array([wv.min_n, wv.max_n, wv.bucket], dtype=np.int64)}
+        for name, matrix in (('word', word_vectors), ('ngram', ngram_vectors)):
+            arrays[f'{name}_vectors'], arrays[f'{name}_scales'] = QuantizedFastTextModel.quantize(matrix, dtype)
+        if projection is not None:
+            arrays['projection'] = projection
+
+        quantized = QuantizedFastTextModel(path, log_level=self.log_level)
+        quantized.arrays = arrays
+        quantized.save().load()
+        self.logger.info(f'Exported quantized model to {path}: {len(keys)} words, {len(kept_buckets)} buckets, '
+                         f'{dtype}, {word_vectors.shape[1]} dims, {Path(path).stat().st_size / 2 ** 20:.1f} MB')
+        return quantized
+
     def save(self):
         """
-        Saves the current model to disk.
+        Saves the current model to disk. In mmap load mode the inference keyed vectors are exported as well.
         """
+        if not isinstance(self.model, FastText):
+            self.logger.error('Only keyed vectors are loaded, load or retrain the full model before saving')
+            return self
         fname = get_tmpfile(self.model_path)
         self.model.save(fname)
         self.logger.info('Saved model to drive')
+        if self.load_mode == 'mmap':
+            self.export_keyed_vectors()
         return self
 
 
+    def _keyed_vectors(self):
+        """The model's keyed vectors, works for a full model and for keyed vectors loaded on their own."""
+        if self.model is None:
+            self.load()
+        return getattr(self.model, 'wv', self.model)
+
+    def liststr_to_matrix(self, sentences: List[List[str]]) -> np.ndarray:
+        """
+        Converts tokenized sentences to sentence vectors in one vectorized pass.
+
+        Every distinct token is resolved once: vocabulary words are gathered from the vector matrix, out of
+        vocabulary words are built from their n-grams. The token vectors are L2-normalized and every sentence
+        vector is the mean of its token vectors, the same result as wv.get_sentence_vector. Sentences without
+        tokens get a zero vector.
+
+        Args:
+            sentences (List[List[str]]): Tokenized sentences, as returned by SpacyPrep.prep_sentences_to_list_of_lists.
+
+        Returns:
+            np.ndarray: A contiguous float32 array of shape (len(sentences), vector_size).
+        """
+        wv = self._keyed_vectors()
+
+        def resolve_tokens(tokens):
+            token_vectors = np.zeros((len(tokens), wv.vector_size), dtype=np.float32)
+            known = np.ones(len(tokens), dtype=bool)
+            in_vocab = [(i, wv.key_to_index[token]) for i, token in enumerate(tokens) if token in wv.key_to_index]
+            if in_vocab:
+                rows, vocab_rows = map(list, zip(*in_vocab))
+                vectors = wv.vectors[vocab_rows]
+                norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+                token_vectors[rows] = vectors / np.where(norms == 0, 1, norms)
+            for i in set(range(len(tokens))) - {i for i, _ in in_vocab}:
+                if tokens[i] in wv:  # out of vocabulary, composed from n-grams
+                    token_vectors[i] = wv.get_vector(tokens[i], norm=True)
+                else:
+                    known[i] = False
+            return token_vectors, known
+
+        matrix = average_token_vectors(sentences, resolve_tokens)
+        self.logger.debug(f'Converted {len(sentences)} sentences to vectors')
+        return matrix
+
     def liststr_to_listvec(self, sentences: List[str]) -> List[float]:
         """
         Converts a list of sentences to a list of sentence vectors.
@@ -126,8 +421,157 @@ class FastTextModel(AbstractEmbedder):
         Returns:
             List[float]: A list of sentence vectors.
         """
-        if self.model is None:
+        return self.liststr_to_matrix(sentences).tolist()
+
+
+
+class QuantizedFastTextModel(AbstractEmbedder):
+    """
+    Inference-only FastText embedder over a pruned and quantized artifact written by FastTextModel.export_quantized.
+
+    Kept words are looked up directly, other words are composed from their kept n-gram buckets the way FastText
+    builds out of vocabulary vectors. Words none of whose n-grams were kept are left out of the sentence mean.
+    Everything fits in memory: a 50k word, 200k bucket int8 artifact is about 75 MB instead of the 2.4 GB bucket
+    matrix of the full model.
+
+    Attributes:
+        model_path (Path): The path to the .npz artifact.
+        arrays (Dict[str, np.ndarray]): The stored arrays, quantized.
+        source (FastTextModel): The full model the artifact is exported from, used by retrain.
+        quantization (Dict): export_quantized settings (max_vocab, max_buckets, dtype, dims) retrain exports with.
+
+    Methods:
+        load(): Loads the artifact.
+        save(): Writes the artifact.
+        retrain(sentences): Retrains the source model and exports the artifact again.
+        liststr_to_matrix(sentences: List[List[str]]) -> np.ndarray: Converts tokenized sentences to a float32 matrix.
+        liststr_to_listvec(sentences: List[List[str]]) -> List[List[float]]: Converts tokenized sentences to vectors.
+    """
+
+    def __init__(self, model_path: Path, source: 'FastTextModel' = None, quantization: Dict = None,
+                 log_level: str = 'INFO'):
+        """
+        Args:
+            model_path (Path): The path to the .npz artifact.
+            source (FastTextModel): The full model the artifact is exported from. Without it the model can't be
+                retrained.
+            quantization (Dict): Keyword arguments of FastTextModel.export_quantized, defaults to its defaults.
+            log_level (str): logger level, can be 'INFO', 'DEBUG', 'WARNING', 'ERROR'
+        """
+        self.model_path = Path(model_path)
+        self.source = source
+        self.quantization = dict(quantization or {})
+        self.arrays = None
+        self.key_to_index = None
+        self.logger = create_logger(log_level, log_name='QuantizedFastTextModel')
+
+    @staticmethod
+    def quantize(matrix: np.ndarray, dtype: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Quantizes the rows of a float matrix, returns the quantized rows and their per-row scales."""
+        if dtype == 'float16':
+            return matrix.astype(np.float16), np.ones(len(matrix), dtype=np.float32)
+        if dtype == 'int8':
+            scales = np.abs(matrix).max(axis=1) / 127
+            scales[scales == 0] = 1
+            return np.round(matrix / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+        raise ValueError(f'Unsupported quantization dtype {dtype}, use int8 or float16')
+
+    def _rows(self, name: str, rows) -> np.ndarray:
+        """Dequantized rows of the word or ngram matrix."""
+        return self.arrays[f'{name}_vectors'][rows].astype(np.float32) * self.arrays[f'{name}_scales'][rows, None]
+
+    @property
+    def vector_size(self) -> int:
+        return self.arrays['word_vectors'].shape[1]
+
+    def load(self):
+        """
+        Loads the artifact from disk.
+        """
+        with np.load(self.model_path) as artifact:
+            self.arrays = {name: artifact[name] for name in artifact.files}
+        self.key_to_index = {key: i for i, key in enumerate(self.arrays['keys'].tolist())}
+        self.logger.info(f'Loaded quantized fast text model from {self.model_path}')
+        return self
+
+    def save(self):
+        """
+        Writes the artifact to disk, under a temporary name first so readers never see a partial file.
+        """
+        tmp = self.model_path.with_name(f'{self.model_path.name}.tmp{os.getpid()}.npz')
+        np.savez(tmp, **self.arrays)
+        os.replace(tmp, self.model_path)
+        self.logger.info(f'Saved quantized model to {self.model_path}')
+        return self
+
+    def retrain(self, sentences: Iterable[List[str]]):
+        """
+        Quantized vectors can't be trained: retrains the source FastTextModel, saves it and exports the artifact again.
+
+        Args:
+            sentences (Iterable[List[str]]): The sentences to train the model on, see FastTextModel.retrain.
+
+        Raises:
+            EmbeddingConfigurationError: If there is no source model to train.
+        """
+        if self.source is None:
+            self.logger.error('Quantized fasttext model has no source model to retrain')
+            raise EmbeddingConfigurationError(type(self).__name__, 'it has no source FastTextModel to retrain and '
+                                              'export, create it with one or export the artifact with '
+                                              'FastTextModel.export_quantized')
+        self.source.retrain(sentences).save()
+        exported = self.source.export_quantized(self.model_path, **self.quantization)
+        self.arrays, self.key_to_index = exported.arrays, exported.key_to_index
+        return self
+
+    def liststr_to_matrix(self, sentences: List[List[str]]) -> np.ndarray:
+        """
+        Converts tokenized sentences to the mean of their L2-normalized token vectors.
+
+        Args:
+            sentences (List[List[str]]): Tokenized sentences, as returned by SpacyPrep.prep_sentences_to_list_of_lists.
+
+        Returns:
+            np.ndarray: A contiguous float32 array of shape (len(sentences), vector_size).
+        """
+        if self.arrays is None:
             self.load()
-        self.logger.info('Converting strings of text to vectors via fasttext model')
-        return [self.model.wv.get_sentence_vector(sent).tolist() for sent in sentences]
+        min_n, max_n, bucket = self.arrays['ngram_params'].tolist()
+        bucket_ids = self.arrays['bucket_ids']
+
+        def resolve_tokens(tokens):
+            token_vectors = np.zeros((len(tokens), self.vector_size), dtype=np.float32)
+            known = np.zeros(len(tokens), dtype=bool)
+            in_vocab = [(i, self.key_to_index[token]) for i, token in enumerate(tokens) if token in self.key_to_index]
+            if in_vocab:
+                rows, vocab_rows = map(list, zip(*in_vocab))
+                token_vectors[rows] = self._rows('word', vocab_rows)  # stored normalized
+                known[rows] = True
+            out_of_vocab = set(range(len(tokens))) - {i for i, _ in in_vocab} if len(bucket_ids) else set()
+            for i in out_of_vocab:
+                hashes = np.asarray(ft_ngram_hashes(tokens[i], min_n, max_n, bucket), dtype=np.uint32)
+                positions = np.minimum(np.searchsorted(bucket_ids, hashes), len(bucket_ids) - 1)
+                positions = positions[bucket_ids[positions] == hashes]  # repeated n-grams count repeatedly, as in gensim
+                if len(positions):
+                    vector = self._rows('ngram', positions).sum(axis=0)
+                    norm = np.linalg.norm(vector)
+                    if norm > 0:
+                        token_vectors[i], known[i] = vector / norm, True
+            return token_vectors, known
+
+        matrix = average_token_vectors(sentences, resolve_tokens)
+        self.logger.debug(f'Converted {len(sentences)} sentences to vectors')
+        return matrix
+
+    def liststr_to_listvec(self, sentences: List[List[str]]) -> List[List[float]]:
+        """
+        Converts a list of sentences to a list of sentence vectors.
+
+        Args:
+            sentences (List[List[str]]): Tokenized sentences.
+
+        Returns:
+            List[List[float]]: A list of sentence vectors.
+        """
+        return self.liststr_to_matrix(sentences).tolist()
 
@@ -0,0 +1,107 @@
+import json
+import uuid
+from typing import List
+
+import numpy as np
+
+from modeling_clusterization.embedding import AbstractEmbedder
+from utils.logging_utils import create_logger
+from utils.sqlite_cache import SqliteCache
+from utils.tiered_cache import TieredCache
+
+
+class CachedEmbedder(AbstractEmbedder):
+    """
+    Memoizes the sentence vectors of another embedder, keyed by the cleaned token sequence.
+
+    The same application questions come back for every user and form, so most sentences are embedded once and then
+    served from a TieredCache: a bounded in-process LRU cache, with an optional persistent SqliteCache behind it
+    that survives restarts and is shared by the workers of a host. Entries belong to the version of the embedding
+    model they were computed with: loading, retraining or saving the model through the cache switches to the new
+    version, which empties the memory tier and makes the disk entries of older versions unreachable.
+    Any attribute not defined here (model_path, model, ...) is looked up on the wrapped embedder.
+
+    Attributes:
+        embedder (AbstractEmbedder): The wrapped embedder.
+        cache (TieredCache): token tuple -> float32 vector, for the version of the embedding model.
+    """
+
+    def __init__(self, embedder: AbstractEmbedder, max_entries: int = 10000, disk: SqliteCache = None,
+                 log_level: str = 'INFO'):
+        """
+        Args:
+            embedder (AbstractEmbedder): The embedder to put the cache in front of.
+            max_entries (int): Size of the in-process tier, every entry holds one sentence vector.
+            disk (SqliteCache): Persistent tier, None keeps the cache in memory only.
+            log_level (str): logger level, can be 'INFO', 'DEBUG', 'WARNING', 'ERROR'
+        """
+        self.embedder = embedder
+        self.cache = TieredCache(embedder.model_version(), encode=lambda vector: vector.tobytes(),
+                                 decode=lambda value: np.frombuffer(value, dtype=np.float32),
+                                 key_text=lambda key: json.dumps(key, ensure_ascii=False), max_entries=max_entries,
+                                 disk=disk)
+        self.logger = create_logger(log_level, log_name='CachedEmbedder')
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__['embedder'], name)
+
+    def _set_version(self, version: str):
+        previous, entries = self.cache.version, len(self.cache.memory)
+        if self.cache.set_version(version):
+            self.logger.info(f'Embedding model version changed from {previous} to {version}, '
+                             f'dropping {entries} cached vectors')
+
+    def model_version(self) -> str:
+        return self.cache.version
+
+    def load(self):
+        """Loads the wrapped embedder and switches to the version on disk."""
+        self.embedder.load()
+        self._set_version(self.embedder.model_version())
+        return self
+
+    def save(self):
+        """Saves the wrapped embedder, the saved file is a new version."""
+        self.embedder.save()
+        self._set_version(self.embedder.model_version())
+        return self
+
+    def retrain(self, *args, **kwargs):
+        """Retrains the wrapped embedder, vectors of the retrained model are cached under a new unsaved version."""
+        self.embedder.retrain(*args, **kwargs)
+        self._set_version(f'unsaved-{uuid.uuid4().hex[:16]}')
+        return self
+
+    def liststr_to_matrix(self, sentences: List[List[str]]) -> np.ndarray:
+        """
+        Converts tokenized sentences to a float32 matrix of sentence vectors. Only the sentences found in neither tier
+        are sent to the wrapped embedder, each distinct one once.
+
+        Args:
+            sentences (List[List[str]]): Tokenized sentences, as returned by SpacyPrep.prep_sentences_to_list_of_lists.
+
+        Returns:
+            np.ndarray: A float32 array with one sentence vector per row.
+        """
+        keys = [tuple(sent) for sent in sentences]
+        vectors, embedded = self.cache.get_many(
+            keys, lambda missing: self.embedder.liststr_to_matrix([list(key) for key in missing]))
+        self.logger.debug(f'Embedded {len(sentences)} sentences, {embedded} not cached')
+
+        if not keys:
+            return self.embedder.liststr_to_matrix([])
+        return np.stack([vectors[key] for key in keys]).astype(np.float32, copy=False)
+
+    def liststr_to_listvec(self, sentences: List[List[str]]) -> List[List[float]]:
+        """
+        Converts a list of sentences to a list of sentence vectors.
+        """
+        return self.liststr_to_matrix(sentences).tolist()
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: model version, memory tier hits, disk tier hits, misses that were embedded, overall hit rate and
+                the number of entries in memory
+        """
+        return self.cache.stats()
@@ -0,0 +1,138 @@
+import hashlib
+import json
+from typing import List, Dict, Iterator
+
+from modeling_clusterization.gpt_models import abstractGptModel, completion_text
+from utils.logging_utils import create_logger
+from utils.sqlite_cache import SqliteCache
+
+
+class CachedGptModel(abstractGptModel):
+    """
+    Memoizes the completions of another gpt model in a persistent SqliteCache.
+
+    The cache key is a hash of the model string, the prompt messages and the sampling parameters, so the same
+    job description or application question sent again with the same prompt costs no request at all.
+    Failed completions are not cached. Any attribute not defined here (gpt_model_str, warm_up, ...) is looked up on
+    the wrapped model, so the cached model can be used wherever the wrapped one was.
+
+    Attributes:
+        model (abstractGptModel): The wrapped gpt model.
+        cache (SqliteCache): Where completions are stored.
+        bypass (bool): When set, the cache is neither read nor written.
+    """
+
+    def __init__(self, model: abstractGptModel, cache: SqliteCache, bypass: bool = False, log_level: str = 'INFO'):
+        """
+        Args:
+            model (abstractGptModel): The gpt model to put the cache in front of.
+            cache (SqliteCache): Persistent cache for the completions.
+            bypass (bool): Skip the cache, e.g. to force fresh completions.
+            log_level (str) : log level (INFO, DEBUG, etc)
+        """
+        self.model = model
+        self.cache = cache
+        self.bypass = bypass
+        self.logger = create_logger(log_level = log_level, log_name = 'gpt_cache-CachedGptModel_log')
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__['model'], name)
+
+    @property
+    def native_n(self) -> bool:
+        return self.model.native_n
+
+    def cache_key(self, prompt: List[Dict[str, str]], **sampling_params) -> str:
+        """Content hash of everything that determines a completion."""
+        key_source = json.dumps({'model': self.model.gpt_model_str, 'messages': prompt, 'params': sampling_params},
+                                sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+    def _lookup(self, key: str):
+        value = self.cache.get(key)
+        return None if value is None else json.loads(value)
+
+    def _store(self, key: str, out):
+        if out is not None and out.get('choices'):
+            self.cache.set(key, json.dumps(out))
+
+    def gpt_prompt_return(self, prompt: List[Dict[str, str]], **sampling_params):
+        """
+        Returns the cached completion for the prompt, asking the wrapped model only on a cache miss.
+        Sampling parameters are passed on to the wrapped model and are part of the cache key.
+        """
+        if self.bypass:
+            return self.model.gpt_prompt_return(prompt, **sampling_params)
+
+        key = self.cache_key(prompt, **sampling_params)
+        out = self._lookup(key)
+        if out is not None:
+            self.logger.info('returning cached gpt completion')
+            return out
+        out = self.model.gpt_prompt_return(prompt, **sampling_params)
+        self._store(key, out)
+        return out
+
+    def gpt_prompt_return_many(self, prompts: List[List[Dict[str, str]]], **sampling_params) -> List[Dict]:
+        """
+        Returns the completions for several prompts. Only the cache misses are sent to the wrapped model,
+        together, so they still run concurrently.
+        """
+        if self.bypass:
+            return self.model.gpt_prompt_return_many(prompts, **sampling_params)
+
+        keys = [self.cache_key(prompt, **sampling_params) for prompt in prompts]
+        outs = [self._lookup(key) for key in keys]
+        missing = [i for i, out in enumerate(outs) if out is None]
+        self.logger.info(f'{len(prompts) - len(missing)} of {len(prompts)} gpt completions served from cache')
+        if missing:
+            fresh = self.model.gpt_prompt_return_many([prompts[i] for i in missing], **sampling_params)
+            for i, out in zip(missing, fresh):
+                self._store(keys[i], out)
+                outs[i] = out
+        return outs
+
+    def gpt_prompt_return_n(self, prompt: List[Dict[str, str]], n: int, **sampling_params) -> List[str]:
+        """
+        Returns `n` alternative completion texts for the prompt. The alternatives are cached as one entry,
+        keyed by the method, the prompt and `n`, so they stay distinct from each other on a cache hit and don't
+        collide with a single completion requested with the same `n`.
+        """
+        if self.bypass:
+            return self.model.gpt_prompt_return_n(prompt, n, **sampling_params)
+
+        key = self.cache_key(prompt, method='return_n', n=n, **sampling_params)
+        value = self.cache.get(key)
+        if value is not None:
+            self.logger.info('returning cached gpt completions')
+            return json.loads(value)
+        ret_list = self.model.gpt_prompt_return_n(prompt, n, **sampling_params)
+        if all(ret_list):
+            self.cache.set(key, json.dumps(ret_list))
+        return ret_list
+
+    def gpt_prompt_stream(self, prompt: List[Dict[str, str]], **sampling_params) -> Iterator[str]:
+        """
+        Streams the completion from the wrapped model and caches it once complete, under the same key as
+        gpt_prompt_return. A cached completion is yielded at once.
+        """
+        if self.bypass:
+            yield from self.model.gpt_prompt_stream(prompt, **sampling_params)
+            return
+
+        key = self.cache_key(prompt, **sampling_params)
+        out = self._lookup(key)
+        if out is not None:
+            self.logger.info('returning cached gpt completion')
+            yield completion_text(out)
+            return
+        tokens = []
+        for token in self.model.gpt_prompt_stream(prompt, **sampling_params):
+            tokens.append(token)
+            yield token
+        if tokens:
+            self._store(key, {'choices': [{'message': {'role': 'assistant', 'content': ''.join(tokens)}}]})
+
+    def stats(self) -> dict:
+        """Hit/miss counters of the underlying cache."""
+        return self.cache.stats()
@@ -1,69 +1,236 @@
 import gpt4all
 from pathlib import Path
-from typing import List, Dict
+from typing import Callable, List, Dict, Iterable, Tuple, Iterator
 import openai
 from dotenv import load_dotenv
 import os
 import time
+import queue
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import pandas as pd
 from utils.logging_utils import create_logger
+from utils.result_sink import BufferedResultSink
+from utils.rate_limiter import RateLimiter
+from utils.token_utils import count_message_tokens, count_tokens, split_text_by_tokens
+from preprocessing.description_prep import DescriptionPrep
+from ingestion.jp_ingestion import jobPostIingest
 
 
 from abc import ABC, abstractclassmethod
 
+
+def completion_text(out, index: int = 0) -> str:
+    """Returns the text of one choice of a chat completion, or an empty string if there is none."""
+    try:
+        ret = out["choices"][index]["message"]['content']
+    except (KeyError, IndexError, TypeError):
+        return ''
+    return '' if ret is None else str(ret)
+
+
 class abstractGptModel(ABC):
-    
+
+    # whether gpt_prompt_return_n gets its alternatives from one request (the api's `n`), rather than from `n`
+    # identical prompts that a local model may well answer the same way
+    native_n = False
+
     @abstractclassmethod
     def gpt_prompt_return():
         pass
 
+    def gpt_prompt_return_many(self, prompts: List[List[Dict[str, str]]], **sampling_params) -> List[Dict]:
+        """
+        Returns the completions for several prompts, in the same order as the prompts.
+        Models that can serve prompts concurrently override this, the default runs them one after another.
+        """
+        return [self.gpt_prompt_return(prompt, **sampling_params) for prompt in prompts]
+
+    def gpt_prompt_return_n(self, prompt: List[Dict[str, str]], n: int, **sampling_params) -> List[str]:
+        """
+        Returns `n` alternative completion texts for the same prompt. The default sends `n` independent requests
+        through gpt_prompt_return_many, so they run in parallel wherever the model supports it.
+        A completion that could not be generated is returned as an empty string.
+        """
+        outs = self.gpt_prompt_return_many([prompt] * n, **sampling_params)
+        return [completion_text(out) for out in outs]
+
+    def gpt_prompt_stream(self, prompt: List[Dict[str, str]], **sampling_params) -> Iterator[str]:
+        """
+        Yields the completion for a prompt piece by piece as the model produces it.
+        Models without streaming support yield the whole completion at once.
+        """
+        yield completion_text(self.gpt_prompt_return(prompt, **sampling_params))
+
+class Gpt4AllRegistry:
+    """Process-wide registry of loaded gpt4all models.
+
+    Loading gpt4all weights means reading several GB from the /data mount, so each model is loaded once per process
+    and kept resident. Every (model name, model path) pair owns a pool of `pool_size` instances; a caller checks an
+    instance out, runs inference and puts it back. A gpt4all instance is not thread-safe, so with the default pool
+    of one all gunicorn threads are serialized on the same weights, while a larger pool lets them run side by side
+    at the cost of one copy of the weights per instance.
+
+    Methods:
+        warm_up(gpt_model_str, model_path, pool_size): Loads the model pool ahead of the first prompt.
+        acquire(gpt_model_str, model_path, pool_size): Context manager that checks a loaded instance out of the pool.
+        unload(gpt_model_str, model_path): Drops loaded models so their memory can be reclaimed.
+        loaded_models() -> List[Tuple[str, str]]: Lists the currently resident models.
+    """
+
+    def __init__(self, log_level: str = 'INFO') -> None:
+        self._pools: Dict[Tuple[str, str], queue.Queue] = {}
+        self._lock = threading.Lock()
+        self.logger = create_logger(log_level = log_level, log_name = 'gpt_models-gpt4AllRegistry_log')
+
+    def _pool(self, gpt_model_str: str, model_path: Path, pool_size: int) -> queue.Queue:
+        """Returns the instance pool for a model, loading it on first use."""
+        key = (gpt_model_str, str(model_path))
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = queue.Queue()
+                for _ in range(max(1, pool_size)):
+                    start = time.perf_counter()
+                    pool.put(gpt4all.GPT4All(gpt_model_str, model_path=str(model_path)))
+                    self.logger.info(f'Loaded gpt4all model {gpt_model_str} in {time.perf_counter() - start:.1f} s')
+                self._pools[key] = pool
+        return pool
+
+    def warm_up(self, gpt_model_str: str, model_path: Path, pool_size: int = 1) -> None:
+        """Loads the model pool so the first prompt doesn't pay for reading the weights."""
+        self._pool(gpt_model_str, model_path, pool_size)
+
+    @contextmanager
+    def acquire(self, gpt_model_str: str, model_path: Path, pool_size: int = 1):
+        """Checks a resident model instance out of the pool, blocking until one is free."""
+        pool = self._pool(gpt_model_str, model_path, pool_size)
+        gpt_model = pool.get()
+        try:
+            yield gpt_model
+        finally:
+            pool.put(gpt_model)
+
+    def unload(self, gpt_model_str: str = None, model_path: Path = None) -> None:
+        """
+        Drops loaded models from the registry. Without arguments every model is unloaded.
+        Instances that are checked out at the moment are released once their caller is done with them.
+        """
+        with self._lock:
+            keys = [key for key in self._pools
+                    if (gpt_model_str is None or key[0] == gpt_model_str)
+                    and (model_path is None or key[1] == str(model_path))]
+            for key in keys:
+                del self._pools[key]
+                self.logger.info(f'Unloaded gpt4all model {key[0]}')
+
+    def loaded_models(self) -> List[Tuple[str, str]]:
+        """Lists (model name, model path) pairs that are currently resident."""
+        with self._lock:
+            return list(self._pools.keys())
+
+
+gpt4all_registry = Gpt4AllRegistry()
+
+
 class Gpt4All(abstractGptModel):
     """Wrapper class for the GPT-4 All model from gpt4all.
 
+    Model weights are kept resident in the process-wide `gpt4all_registry`, so only the first prompt (or an explicit
+    warm_up()) pays for loading them.
+
     Attributes:
         gpt_model_str (str): The name of the GPT-4 All model to use.
         model_path (Path): The path to the directory containing the model files.
+        pool_size (int): Number of model instances that may serve prompts concurrently.
 
     Methods:
         gpt_prompt_return(message_dict: List[Dict[str, str]]) -> str:
             Given a list of message dictionaries, returns the completion generated by the GPT-4 All model.
             Each message dictionary should have a 'speaker' key indicating which speaker the message is from,
             and a 'text' key containing the text of the message.
+        warm_up(): Loads the model weights ahead of the first prompt.
+        unload(): Releases the model weights.
     """
 
-    def __init__(self, gpt_model_str: str, model_path: Path, log_level:str) -> None:
+    def __init__(self, gpt_model_str: str, model_path: Path, log_level:str, pool_size: int = 1) -> None:
         """Creates a new gpt4All instance.
 
         Args:
             gpt_model_str (str): The name of the GPT-4 All model to use.
             model_path (Path): The path to the directory containing the model files.
             log_level (str) : log level (INFO, DEBUG, etc)
+            pool_size (int): Number of model instances to keep resident. Each instance holds its own copy of the
+                weights, so keep this at 1 unless there is memory for parallel inference.
 
         """
         self.gpt_model_str = gpt_model_str
         self.model_path = model_path
+        self.pool_size = pool_size
         self.logger = create_logger(log_level = log_level, log_name = 'gpt_models-gpt4All_log')
 
+    def warm_up(self):
+        """Loads the model weights into the process-wide registry."""
+        gpt4all_registry.warm_up(self.gpt_model_str, self.model_path, self.pool_size)
+        return self
+
+    def unload(self):
+        """Releases the model weights held by the process-wide registry."""
+        gpt4all_registry.unload(self.gpt_model_str, self.model_path)
+        return self
 
-    def gpt_prompt_return(self, prompt: List[Dict[str, str]]) -> str:
+    def gpt_prompt_return(self, prompt: List[Dict[str, str]], **generate_kwargs) -> str:
         """Given a list of message dictionaries, returns the completion generated by the GPT-4 All model.
 
         Args:
             message_dict (List[Dict[str, str]]): A list of message dictionaries.
                 Each dictionary should have a 'speaker' key indicating which speaker the message is from,
                 and a 'text' key containing the text of the message.
+            generate_kwargs: Extra generation arguments passed on to gpt4all (temp, top_k, n_predict, ...)
 
         Returns:
             str: The completion generated by the GPT-4 All model.
         """
-        gpt_model = gpt4all.GPT4All(self.gpt_model_str, model_path=str(self.model_path))
-        out = gpt_model.chat_completion(default_prompt_footer=False,
-                                         default_prompt_header=False,
-                                         messages=prompt,
-                                         verbose=False,
-                                         streaming=False)
         self.logger.info('attempting to generate gpt4all predictions')
+        with gpt4all_registry.acquire(self.gpt_model_str, self.model_path, self.pool_size) as gpt_model:
+            out = gpt_model.chat_completion(default_prompt_footer=False,
+                                            default_prompt_header=False,
+                                            messages=prompt,
+                                            verbose=False,
+                                            streaming=False,
+                                            **generate_kwargs)
         return out
+
+    def gpt_prompt_return_many(self, prompts: List[List[Dict[str, str]]], **generate_kwargs) -> List[Dict]:
+        """Runs the prompts on all resident model instances at once. See gpt_prompt_return for the arguments."""
+        with ThreadPoolExecutor(max_workers=max(1, self.pool_size)) as executor:
+            return list(executor.map(lambda prompt: self.gpt_prompt_return(prompt, **generate_kwargs), prompts))
+
+    @staticmethod
+    def prompt_text(prompt: List[Dict[str, str]]) -> str:
+        """
+        Joins chat messages into the plain text prompt gpt4all generates from, the way chat_completion does without
+        the default header and footer: the system messages first, then the user and assistant turns.
+        """
+        text = ''.join(message['content'] + '\n' for message in prompt if message['role'] == 'system')
+        for message in prompt:
+            if message['role'] == 'user':
+                text += '\n' + message['content']
+            elif message['role'] == 'assistant':
+                text += '\n### Response: ' + message['content']
+        return text
+
+    def gpt_prompt_stream(self, prompt: List[Dict[str, str]], **generate_kwargs) -> Iterator[str]:
+        """
+        Yields the completion token by token as gpt4all generates it, through the model's generator api (generate
+        only returns once the whole answer exists, even with streaming=True). The model instance stays checked out
+        of the registry until the generator is exhausted or closed.
+        """
+        self.logger.info('attempting to stream gpt4all predictions')
+        with gpt4all_registry.acquire(self.gpt_model_str, self.model_path, self.pool_size) as gpt_model:
+            yield from gpt_model.generator(self.prompt_text(prompt), **generate_kwargs)
     
 
 
@@ -71,77 +238,184 @@ class Gpt4All(abstractGptModel):
 class ChatGpt(abstractGptModel):
     """Wrapper class for the GPT model from chatgpt.
 
+    Requests are spread out by a shared requests-per-minute and tokens-per-minute budget instead of fixed sleeps.
+    Rate limit and server errors are retried with jittered exponential backoff, honouring the `Retry-After` header.
+    gpt_prompt_return_many() keeps up to `max_concurrency` prompts in flight at once.
+    The API endpoint can be pointed at a local fake server through the OPENAI_API_BASE env variable.
+
     Attributes:
         gpt_model_str (str): The name of the GPT model (3/3.5/4) to use.
-        model_path (Path): The path to the directory containing the model files.
+        rate_limiter (RateLimiter): The requests and tokens budget shared by all calls of this instance.
 
     Methods:
         gpt_prompt_return(message_dict: List[Dict[str, str]]) -> str:
             Given a list of message dictionaries, returns the completion generated by the GPT model.
             Each message dictionary should have a 'speaker' key indicating which speaker the message is from,
             and a 'text' key containing the text of the message.
+        gpt_prompt_return_many(prompts: List[List[Dict[str, str]]]) -> List[Dict]:
+            Returns the completions for several prompts, running them concurrently.
     """
 
-    def __init__(self, gpt_model_str: str, model_path: None, chatgpt_api_timing_delay: bool, log_level:str) -> None:
+    # free accounts are limited to 3 requests and 40k tokens per minute
+    FREE_ACCOUNT_REQUESTS_PER_MINUTE = 3
+    FREE_ACCOUNT_TOKENS_PER_MINUTE = 40000
+    native_n = True
+    RETRYABLE_ERRORS = (openai.error.RateLimitError, openai.error.APIError, openai.error.Timeout,
+                        openai.error.ServiceUnavailableError, openai.error.APIConnectionError)
+
+    def __init__(self, gpt_model_str: str, model_path: None, chatgpt_api_timing_delay: bool, log_level:str,
+                 requests_per_minute: int = None, tokens_per_minute: int = None, max_concurrency: int = 8,
+                 max_retries: int = 6, max_backoff: float = 60.0, completion_tokens_estimate: int = 256) -> None:
         """Creates a new chatGpt instance.
 
         Args:
             gpt_model_str (str): The name of the chatgpt model (3/3.5/4) to use.
             model_path (Path): The path to the directory containing the model files.
+            chatgpt_api_timing_delay (bool): Use the free account budget when no explicit budget is given.
             log_level (str) : log level (INFO, DEBUG, etc)
+            requests_per_minute (int): Request budget per minute. None falls back to the free account budget
+                if chatgpt_api_timing_delay is set, otherwise requests are not limited.
+            tokens_per_minute (int): Token budget per minute, same fallback as requests_per_minute.
+            max_concurrency (int): Maximum number of prompts in flight in gpt_prompt_return_many.
+            max_retries (int): How many times a failed request is retried before the error is raised.
+            max_backoff (float): Upper bound in seconds for a single backoff sleep.
+            completion_tokens_estimate (int): Completion length assumed when reserving tokens ahead of a request.
 
         """
         self.gpt_model_str = gpt_model_str
         self.chatgpt_api_timing_delay = chatgpt_api_timing_delay
+        if chatgpt_api_timing_delay:
+            requests_per_minute = requests_per_minute or self.FREE_ACCOUNT_REQUESTS_PER_MINUTE
+            tokens_per_minute = tokens_per_minute or self.FREE_ACCOUNT_TOKENS_PER_MINUTE
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self.completion_tokens_estimate = completion_tokens_estimate
         self.logger = create_logger(log_level = log_level, log_name = 'gpt_models-chatGpt_log')
+        self.get_key_from_env()
 
 
     def get_key_from_env(self) -> None:
         """
         Set api key from .env file. This file should contain an entry OPENAI_API_KEY = 'xxx'
+        An optional OPENAI_API_BASE entry redirects requests, e.g. to a local fake endpoint.
         """
         load_dotenv()
         openai.api_key = os.environ.get('OPENAI_API_KEY')
+        if os.environ.get('OPENAI_API_BASE'):
+            openai.api_base = os.environ.get('OPENAI_API_BASE')
         self.logger.info('recovered openapi key from .env file')
 
+    def _backoff(self, err: Exception, attempt: int) -> float:
+        """Seconds to wait before the next attempt: the server's Retry-After if given, else jittered exponential."""
+        headers = getattr(err, 'headers', None) or {}
+        retry_after = headers.get('retry-after') or headers.get('Retry-After')
+        try:
+            return min(float(retry_after), self.max_backoff) + random.uniform(0, 1)
+        except (TypeError, ValueError):
+            return random.uniform(0, min(self.max_backoff, 2 ** attempt))
 
 
-    def gpt_prompt_return(self, prompt: List[Dict[str, str]]) -> str:
+    def _estimate_tokens(self, prompt_tokens: int, sampling_params: dict) -> int:
+        """Tokens reserved ahead of a request: the prompt, plus the completion length for each of the `n` answers."""
+        return prompt_tokens + sampling_params.get('max_tokens', self.completion_tokens_estimate) * \
+            sampling_params.get('n', 1)
+
+    def gpt_prompt_return(self, prompt: List[Dict[str, str]], **sampling_params) -> str:
         """Given a list of message dictionaries, returns the completion generated by the GPT-4 All model.
 
         Args:
             message_dict (List[Dict[str, str]]): A list of message dictionaries.
                 Each dictionary should have a 'speaker' key indicating which speaker the message is from,
                 and a 'text' key containing the text of the message.
+            sampling_params: Extra arguments passed on to the completion endpoint (temperature, max_tokens, ...)
 
         Returns:
             str: The completion generated by the chatgpt model.
         """
-        try:
-            self.logger.info('attempting to generate chatgpt predictions')
-            self.get_key_from_env()  # set api key
-            out = openai.ChatCompletion.create(
-                model= self.gpt_model_str,
-                messages=prompt
-                )
-            if self.chatgpt_api_timing_delay:
-                time.sleep(25)  # free account has throughput limitations. This spreads throughput out for free key
+        estimated_tokens = self._estimate_tokens(count_message_tokens(prompt, self.gpt_model_str), sampling_params)
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire(estimated_tokens)
+            try:
+                self.logger.info('attempting to generate chatgpt predictions')
+                out = openai.ChatCompletion.create(
+                    model= self.gpt_model_str,
+                    messages=prompt,
+                    **sampling_params
+                    )
+            except self.RETRYABLE_ERRORS as err:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._backoff(err, attempt)
+                if isinstance(err, openai.error.RateLimitError):
+                    self.rate_limiter.pause(delay)  # every thread shares the same limit, hold them all back
+                self.logger.warning(f'chatgpt request failed ({err.__class__.__name__}), retrying in {delay:.1f} s')
+                time.sleep(delay)
+                continue
+            usage = out.get('usage') or {}
+            self.rate_limiter.settle(estimated_tokens, usage.get('total_tokens', estimated_tokens))
             self.logger.info('generated chatgpt predictions')
-            self.logger.info('Sleeping for 25 seconds to avoid chatgpt throughput limitations')
+            return out
 
-        except:
-            if self.chatgpt_api_timing_delay:
-                time.sleep(60*30)   # after n amount of prompts, free account time out to give priority to paid accounts. This will wait untill free accounts can work again 
-            self.logger.warning('Sleeping for 30 min to avoid chatgpt free account time-out limitations. You could also be out of credits')
-
-            out = openai.ChatCompletion.create(
-                model= self.gpt_model_str,
-                messages=prompt
-                )
-            self.logger.info('generated chatgpt predictions')
+    def gpt_prompt_return_many(self, prompts: List[List[Dict[str, str]]], **sampling_params) -> List[Dict]:
+        """
+        Returns the completions for several prompts, in the same order as the prompts, with up to
+        `max_concurrency` requests in flight. A prompt that still fails after all retries yields None.
+        """
+        def prompt_return(prompt):
+            try:
+                return self.gpt_prompt_return(prompt, **sampling_params)
+            except Exception as err:
+                self.logger.error(f'chatgpt request failed after {self.max_retries} retries: {err}')
+                return None
 
-        
-        return out
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            return list(executor.map(prompt_return, prompts))
+
+    def gpt_prompt_return_n(self, prompt: List[Dict[str, str]], n: int, **sampling_params) -> List[str]:
+        """
+        Returns `n` alternative completion texts for the same prompt from a single request, using the api's `n`
+        parameter. The prompt is sent and billed once, no matter how many alternatives are asked for; the completion
+        tokens reserved ahead of the request are scaled by `n`.
+        """
+        out = self.gpt_prompt_return(prompt, n=n, **sampling_params)
+        return [completion_text(out, i) for i in range(n)]
+
+    def gpt_prompt_stream(self, prompt: List[Dict[str, str]], **sampling_params) -> Iterator[str]:
+        """
+        Yields the completion as the api streams it. Opening the stream is retried like gpt_prompt_return,
+        an error after the first token is raised to the caller. Streamed responses carry no usage, so the token budget
+        is settled with the prompt plus the tokens streamed, once the stream ends or the caller stops reading.
+        """
+        prompt_tokens = count_message_tokens(prompt, self.gpt_model_str)
+        estimated_tokens = self._estimate_tokens(prompt_tokens, sampling_params)
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire(estimated_tokens)
+            try:
+                self.logger.info('attempting to stream chatgpt predictions')
+                chunks = openai.ChatCompletion.create(model=self.gpt_model_str, messages=prompt, stream=True,
+                                                      **sampling_params)
+                break
+            except self.RETRYABLE_ERRORS as err:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._backoff(err, attempt)
+                if isinstance(err, openai.error.RateLimitError):
+                    self.rate_limiter.pause(delay)
+                self.logger.warning(f'chatgpt request failed ({err.__class__.__name__}), retrying in {delay:.1f} s')
+                time.sleep(delay)
+
+        streamed = []
+        try:
+            for chunk in chunks:
+                token = chunk['choices'][0]['delta'].get('content')
+                if token:
+                    streamed.append(token)
+                    yield token
+        finally:
+            self.rate_limiter.settle(estimated_tokens,
+                                     prompt_tokens + count_tokens(''.join(streamed), self.gpt_model_str))
     
 
 
@@ -180,12 +454,18 @@ class gptPredict:
         gpt_prompt_save_csv(self, df_row: pd.Series) -> None:
             Generates a text prediction using the GPT language model for a given row of data in the pandas DataFrame and saves the result to the specified CSV file.
 
+        gpt_prompt_many(self, df: pd.DataFrame) -> List[str]:
+            Generates text predictions for all rows of a DataFrame, letting the model run them concurrently.
+
         apply_lambda_save_csv(self):
-            Applies the gpt_prompt_save_csv method to each row of data in the pandas DataFrame and saves the resulting text predictions to the specified CSV file.
+            Generates text predictions for the pandas DataFrame in batches and appends each batch to the specified CSV file.
     """
 
 
-    def __init__(self, df: pd.DataFrame, model: abstractGptModel, system_string: str, user_string: str, gpt_output_path: Path, log_level:str) -> None:
+    def __init__(self, df: pd.DataFrame, model: abstractGptModel, system_string: str, user_string: str, gpt_output_path: Path, log_level:str,
+                 id_column: str = 'posting_hash', flush_interval: float = 30.0, description_prep: DescriptionPrep = None,
+                 max_description_tokens: int = None, chunk_tokens: int = 1500, merge_user_string: str = None,
+                 legacy_ids: Callable[[pd.DataFrame], Iterable[str]] = None) -> None:
         """
         Initializes an instance of the gptPredict class.
 
@@ -196,6 +476,19 @@ class gptPredict:
             user_string (str): A string representing the user input prompt for entering job description in chatgpt model.
             gpt_output_path (Path): A Path object representing the location where the gpt model generated output is to be saved.
             log_level (str) : log level (INFO, DEBUG, etc)
+            id_column (str): Column that identifies a job posting. Ids of summarized postings are checkpointed next to the
+                output file, so an interrupted run resumes without summarizing them again. Postings without the column
+                are identified by their content hash (see jobPostIingest.posting_hash).
+            flush_interval (float): Seconds after which buffered summaries are written out even if the batch isn't full.
+                Checked when the next summaries are handed to the sink, there is no timer.
+            description_prep (DescriptionPrep): Strips boilerplate from job descriptions before they are sent, None sends them as is.
+            max_description_tokens (int): Token budget of a job description. Longer descriptions are split into chunks of
+                `chunk_tokens` tokens that are summarized in parallel and then merged (map-reduce). None disables splitting.
+            chunk_tokens (int): Token budget of one chunk of an oversized job description.
+            merge_user_string (str): User prompt that asks the model to merge the chunk summaries of a job description.
+            legacy_ids (Callable): Ids of the postings of an output csv written before checkpoints existed, see
+                BufferedResultSink, e.g. jobPostIingest.legacy_posting_hash for the default id_column. None summarizes
+                the postings of such a csv again.
         """
 
         self.model = model
@@ -203,6 +496,15 @@ class gptPredict:
         self.user_string = user_string
         self.gpt_output_path = gpt_output_path
         self.df = df
+        self.id_column = id_column
+        self.flush_interval = flush_interval
+        self.log_level = log_level
+        self.sink = None
+        self.description_prep = description_prep
+        self.max_description_tokens = max_description_tokens
+        self.chunk_tokens = chunk_tokens
+        self.merge_user_string = merge_user_string or 'Merge the lists above into a single list without duplicates.'
+        self.legacy_ids = legacy_ids
         self.logger = create_logger(log_level = log_level, log_name = 'gpt_models-gptPredict_log')
 
 
@@ -224,25 +526,34 @@ class gptPredict:
         #         {"role": "user", "content": prompt_str(description, question_string)}]
         # return [{"role": "system", "content": "Act like a researcher. Give me a list of keywords for a job description I will provide you with that I can use to find a candidate for the position. Act like an expert in this field, include additional keywords that may not be in the job description."},
         #         {"role": "user", "content": description}] 
-        self.prompt =  [{"role": "system", "content": self.system_string},
-                        {"role": "user", "content": description + '. ' + self.user_string}] 
+        self.prompt = self.build_prompt(description)
         return self
 
+    def build_prompt(self, description: str) -> List[Dict[str, str]]:
+        """
+        Builds the chatgpt-compatible prompt for a job description without storing it on the instance,
+        so prompts for several job descriptions can be built and sent concurrently.
 
+        Args:
+            description (str): A string representing a job description.
 
-    def gpt_prompt(self, df_row: pd.Series) -> str:
+        Returns:
+            List[Dict[str, str]]: A list of message dictionaries with 'role' and 'content' keys.
         """
-        Generates a GPT model completion for a given DataFrame row containing a job description.
-        In case of an empty string, a period or None it returns an empty string
+        return [{"role": "system", "content": self.system_string},
+                {"role": "user", "content": description + '. ' + self.user_string}]
+
+    def completion_to_str(self, out) -> str:
+        """
+        Extracts the text of a model completion. In case of an empty string, a period or None the model answered but
+        had nothing to say, and it returns an empty string. In case of a failed request it returns None.
 
         Args:
-            df_row (pd.Series): A series representing a single row of a pandas DataFrame containing job descriptions.
+            out: Completion returned by the model's gpt_prompt_return.
 
         Returns:
-            str: The completion generated by the chatgpt model.
+            str: The text of the completion, None if the request failed.
         """
-
-        out = self.message_dict(df_row['description']).model.gpt_prompt_return(self.prompt)
         try:
             ret = str(out["choices"][0]["message"]['content'])
             if ret == '.' or ret == 'None':
@@ -251,32 +562,151 @@ class gptPredict:
                 ret = ''
             return ret
         except:
-            self.logger.warning('gpt model could not generate a prediction. Returning empty string')
-            return ''
+            self.logger.warning('gpt model request failed. Returning None')
+            return None
+
+
+
+    def gpt_prompt(self, df_row: pd.Series) -> str:
+        """
+        Generates a GPT model completion for a given DataFrame row containing a job description.
+        In case of an empty string, a period or None it returns an empty string
+
+        Args:
+            df_row (pd.Series): A series representing a single row of a pandas DataFrame containing job descriptions.
+
+        Returns:
+            str: The completion generated by the chatgpt model, None if the request failed.
+        """
+
+        return self.summarize_descriptions([df_row['description']])[0]
+
+    def gpt_prompt_many(self, df: pd.DataFrame) -> List[str]:
+        """
+        Generates GPT model completions for every row of a DataFrame containing job descriptions.
+        The prompts are handed to the model together, so models that support it run them concurrently.
+
+        Args:
+            df (pd.DataFrame): A pandas DataFrame with a 'description' column.
+
+        Returns:
+            List[str]: The completions, in the order of the DataFrame rows, None where the request failed.
+        """
+        return self.summarize_descriptions(df['description'].tolist())
+
+    def summarize_descriptions(self, descriptions: List[str]) -> List[str]:
+        """
+        Summarizes job descriptions. Boilerplate is stripped first if a DescriptionPrep is set. Descriptions over
+        `max_description_tokens` are split into chunks; the chunks of all descriptions are summarized in one concurrent
+        batch (map), then the chunk summaries of each description are merged with one more prompt (reduce). If a chunk
+        request fails the whole description counts as failed, a summary of the other chunks would be incomplete.
+
+        Args:
+            descriptions (List[str]): Job descriptions, missing ones are treated as empty strings.
+
+        Returns:
+            List[str]: One summary per description, None where a request failed.
+        """
+        descriptions = ['' if pd.isna(description) else str(description) for description in descriptions]
+        if self.description_prep is not None:
+            descriptions = [self.description_prep.strip_boilerplate(description) for description in descriptions]
+
+        chunks_per_description = []
+        for description in descriptions:
+            if self.max_description_tokens is not None and \
+                    count_tokens(description, self.model.gpt_model_str) > self.max_description_tokens:
+                chunks_per_description.append(split_text_by_tokens(description, self.chunk_tokens, self.model.gpt_model_str))
+            else:
+                chunks_per_description.append([description])
+
+        map_prompts = [self.build_prompt(chunk) for chunks in chunks_per_description for chunk in chunks]
+        self.logger.info(f'Summarizing {len(descriptions)} job descriptions with {len(map_prompts)} prompts, '
+                         f'{sum(count_message_tokens(p, self.model.gpt_model_str) for p in map_prompts) / max(1, len(map_prompts)):.0f} '
+                         'prompt tokens on average')
+        partials = [self.completion_to_str(out) for out in self.model.gpt_prompt_return_many(map_prompts)]
+
+        summaries, reduce_index, reduce_prompts, start = [], [], [], 0
+        for i, chunks in enumerate(chunks_per_description):
+            chunk_partials = partials[start:start + len(chunks)]
+            chunk_summaries = [summary for summary in chunk_partials if summary]
+            if len(chunks) == 1:
+                summaries.append(chunk_partials[0])
+            elif any(summary is None for summary in chunk_partials):
+                summaries.append(None)
+            elif len(chunk_summaries) < 2:
+                # the other chunks were answered with nothing, so this is the summary of the whole description
+                summaries.append(chunk_summaries[0] if chunk_summaries else '')
+            else:
+                summaries.append(None)
+                reduce_index.append(i)
+                reduce_prompts.append([{"role": "system", "content": self.system_string},
+                                       {"role": "user", "content": '\n'.join(chunk_summaries) + '\n' + self.merge_user_string}])
+            start += len(chunks)
+        if reduce_prompts:
+            self.logger.info(f'Merging chunk summaries of {len(reduce_prompts)} oversized job descriptions')
+            for i, out in zip(reduce_index, self.model.gpt_prompt_return_many(reduce_prompts)):
+                summaries[i] = self.completion_to_str(out)
+        return summaries
    
 
 
+    def result_sink(self, batch_size: int = 64) -> BufferedResultSink:
+        """
+        Returns the sink that writes summaries to gpt_output_path, opening it (and reading its checkpoint) on first use.
+        """
+        if self.sink is None:
+            self.sink = BufferedResultSink(self.gpt_output_path, self.id_column, batch_size=batch_size,
+                                           flush_interval=self.flush_interval, legacy_ids=self.legacy_ids,
+                                           log_level=self.log_level)
+        return self.sink
+
     def gpt_prompt_save_csv(self, df_row: pd.Series) -> None:
         """
-        Generate a GPT model completion for a given DataFrame row containing a job description and append the result to a specified CSV file.
+        Generate a GPT model completion for a given DataFrame row containing a job description and hand the result to the
+        buffered result sink. Call self.result_sink().close() after the last row to write out what is still buffered.
+        A posting whose request failed is not written, so it is retried on the next run.
 
         Args:
             df_row (pd.Series): A series representing a single row of a pandas DataFrame containing job descriptions.
         """
 
-        df_row[f'hard_skills_{self.model.gpt_model_str}'] = self.gpt_prompt(df_row)
+        summary = self.gpt_prompt(df_row)
+        if summary is None:
+            self.logger.warning('job posting could not be summarized, it will be retried on the next run')
+            return
+        df_row[f'hard_skills_{self.model.gpt_model_str}'] = summary
+        self.result_sink().write(df_row.to_dict())
 
-        header_t_or_f = False if self.gpt_output_path.exists() else True 
-        df_row.to_frame().T.to_csv(path_or_buf=self.gpt_output_path, 
-                                    mode='a',
-                                    header=header_t_or_f,
-                                    index=False)
-        self.logger.info(f'Appending gpt summaries to a csv file at path: {str(self.gpt_output_path)}')
 
-
-    def apply_lambda_save_csv(self) -> None:
+    def apply_lambda_save_csv(self, batch_size: int = 64, df: pd.DataFrame = None) -> None:
         """
-        Apply lambda function on each row of input DataFrame and save the corresponding GPT model completion as a CSV file.
+        Generate GPT model completions for the input DataFrame in batches and write them to the output file through a
+        checkpointed result sink. Postings whose summaries were committed by an earlier (possibly interrupted) run are
+        skipped. Rows within a batch are sent to the model concurrently. Postings whose request failed are not
+        committed, so the next run retries them; postings the model answered with nothing ('.', 'None') are committed
+        with an empty summary, asking again would cost the same and most likely give the same answer.
+
+        Args:
+            batch_size (int): Number of job descriptions sent to the model before the results are written out.
+            df (pd.DataFrame): Job postings to summarize instead of self.df, e.g. the next chunk of an ingestion run.
+                The result sink is kept open between calls, so its checkpoint is only read once.
         """
 
-        ret = self.df.apply(lambda df_row: self.gpt_prompt_save_csv(df_row), axis=1)
+        df_in = self.df if df is None else df
+        if self.id_column not in df_in.columns:
+            self.logger.warning(f'job postings have no {self.id_column} column, identifying them by content hash')
+            df_in = df_in.assign(**{self.id_column: jobPostIingest.posting_hash(df_in)})
+        sink = self.result_sink(batch_size)
+        summary_column = f'hard_skills_{self.model.gpt_model_str}'
+        df = df_in[~df_in[self.id_column].astype(str).isin(sink.processed_ids)]
+        self.logger.info(f'{df_in.shape[0] - df.shape[0]} job postings already summarized, {df.shape[0]} to go')
+
+        for start in range(0, df.shape[0], batch_size):
+            df_batch = df.iloc[start:start + batch_size].copy()
+            df_batch[summary_column] = self.gpt_prompt_many(df_batch)
+            failed = df_batch[summary_column].isna()
+            if failed.any():
+                self.logger.warning(f'{failed.sum()} job postings could not be summarized, they will be retried on the next run')
+            sink.write_many(df_batch[~failed])
+        sink.close()
+        self.logger.info(f'Gpt summaries written to {str(self.gpt_output_path)}')
@@ -0,0 +1,160 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import List, Dict
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from modeling_clusterization.gpt_models import abstractGptModel
+from utils.instruct_pipeline import InstructionTextGenerationPipeline, PROMPT_FOR_GENERATION_FORMAT
+from utils.logging_utils import create_logger
+
+
+class InstructGptModel(abstractGptModel):
+    """Self-hosted instruction-following model (dolly style) served on CPU with dynamic micro-batching.
+
+    Concurrent prompts are queued and a single worker thread collects them into batches of up to `max_batch_size`,
+    waiting at most `max_wait_ms` for a batch to fill. Each batch is left-padded and generated in one forward pass, so
+    several application questions cost roughly one generation instead of one each. Generation settings and the
+    "### End" stop token come from InstructionTextGenerationPipeline.
+
+    Completions are returned in the chat completion format the other gpt models use:
+    {"choices": [{"message": {"role": "assistant", "content": ...}}]}
+
+    Attributes:
+        gpt_model_str (str): Name of the model folder.
+        model_path (Path): The path to the directory containing the model folders.
+        max_batch_size (int): Maximum number of prompts generated together.
+        max_wait_ms (float): How long the first prompt of a batch waits for others to join.
+
+    Methods:
+        gpt_prompt_return(prompt: List[Dict[str, str]]) -> Dict: Generates a completion for one prompt.
+        gpt_prompt_return_many(prompts: List[List[Dict[str, str]]]) -> List[Dict]: Queues several prompts at once.
+        close(): Stops the batching worker.
+    """
+
+    def __init__(self, gpt_model_str: str, model_path: Path, log_level: str, max_batch_size: int = 8,
+                 max_wait_ms: float = 20, num_threads: int = None, max_new_tokens: int = 256,
+                 do_sample: bool = True, top_p: float = 0.92, top_k: int = 0) -> None:
+        """Loads the model from local files and starts the batching worker.
+
+        Args:
+            gpt_model_str (str): Name of the model folder, e.g. 'dolly-v2-3b'.
+            model_path (Path): The path to the directory containing the model folders.
+            log_level (str) : log level (INFO, DEBUG, etc)
+            max_batch_size (int): Maximum number of prompts generated together.
+            max_wait_ms (float): How long the first prompt of a batch waits for others to join.
+            num_threads (int): Torch intra-op threads, defaults to the number of cpus.
+            max_new_tokens (int): Max new tokens after the prompt to generate.
+            do_sample (bool): Whether or not to use sampling.
+            top_p (float): Nucleus sampling probability mass.
+            top_k (int): Number of highest probability tokens to keep, 0 disables top-k filtering.
+        """
+        self.gpt_model_str = gpt_model_str
+        self.model_path = model_path
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.logger = create_logger(log_level = log_level, log_name = 'instruct_models-InstructGptModel_log')
+
+        torch.set_num_threads(num_threads or os.cpu_count())
+        try:
+            torch.set_num_interop_threads(1)  # generate() is sequential, spare threads only add contention
+        except RuntimeError:
+            pass  # can only be set once per process
+
+        local_path = str(Path(model_path) / gpt_model_str)
+        start = time.perf_counter()
+        self.tokenizer = AutoTokenizer.from_pretrained(local_path, padding_side='left', local_files_only=True)
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.model = AutoModelForCausalLM.from_pretrained(local_path, torch_dtype=torch.float32,
+                                                          local_files_only=True).eval()
+        self.pipeline = InstructionTextGenerationPipeline(model=self.model, tokenizer=self.tokenizer,
+                                                          do_sample=do_sample, max_new_tokens=max_new_tokens,
+                                                          top_p=top_p, top_k=top_k)
+        self.generate_kwargs = self.pipeline._forward_params
+        self.end_key_token_id = self.pipeline._postprocess_params['end_key_token_id']
+        self.logger.info(f'Loaded instruct model {gpt_model_str} in {time.perf_counter() - start:.1f} s')
+
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target=self._batch_worker, name='instruct-batcher', daemon=True)
+        self.worker.start()
+
+    @staticmethod
+    def _instruction(prompt: List[Dict[str, str]]) -> str:
+        """Turns chat messages into a single instruction, system message first."""
+        return '\n'.join(message['content'] for message in prompt if message['content'])
+
+    def _batch_worker(self):
+        """Collects queued requests into batches and generates them."""
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            batch = [request]
+            deadline = time.monotonic() + self.max_wait_ms / 1000
+            while len(batch) < self.max_batch_size:
+                try:
+                    request = self.requests.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if request is None:
+                    self.requests.put(None)  # finish this batch, stop on the next loop
+                    break
+                batch.append(request)
+            try:
+                texts = self._generate([instruction for instruction, _ in batch])
+                for (_, future), text in zip(batch, texts):
+                    future.set_result(text)
+            except Exception as err:
+                self.logger.error(f'instruct model generation failed: {err}')
+                for _, future in batch:
+                    future.set_exception(err)
+
+    def _generate(self, instructions: List[str]) -> List[str]:
+        """Generates responses for a batch of instructions in one left-padded forward pass."""
+        prompts = [PROMPT_FOR_GENERATION_FORMAT.format(instruction=instruction) for instruction in instructions]
+        inputs = self.tokenizer(prompts, return_tensors='pt', padding=True)
+        start = time.perf_counter()
+        with torch.inference_mode():
+            generated = self.model.generate(input_ids=inputs['input_ids'], attention_mask=inputs['attention_mask'],
+                                            pad_token_id=self.tokenizer.pad_token_id, **self.generate_kwargs)
+        self.logger.info(f'generated {len(prompts)} instruct responses in {time.perf_counter() - start:.1f} s')
+
+        texts = []
+        for sequence in generated[:, inputs['input_ids'].shape[1]:].tolist():
+            if self.end_key_token_id is not None and self.end_key_token_id in sequence:
+                sequence = sequence[:sequence.index(self.end_key_token_id)]
+            texts.append(self.tokenizer.decode(sequence, skip_special_tokens=True).strip())
+        return texts
+
+    def _submit(self, prompt: List[Dict[str, str]]) -> Future:
+        future = Future()
+        self.requests.put((self._instruction(prompt), future))
+        return future
+
+    def gpt_prompt_return(self, prompt: List[Dict[str, str]], **sampling_params) -> Dict:
+        """Given a list of message dictionaries, returns the completion generated by the instruct model.
+
+        Args:
+            prompt (List[Dict[str, str]]): A list of message dictionaries with 'role' and 'content' keys.
+
+        Returns:
+            Dict: The completion in chat completion format.
+        """
+        text = self._submit(prompt).result()
+        return {'choices': [{'message': {'role': 'assistant', 'content': text}}]}
+
+    def gpt_prompt_return_many(self, prompts: List[List[Dict[str, str]]], **sampling_params) -> List[Dict]:
+        """Queues all prompts at once so they are generated in as few batches as possible."""
+        futures = [self._submit(prompt) for prompt in prompts]
+        return [{'choices': [{'message': {'role': 'assistant', 'content': future.result()}}]} for future in futures]
+
+    def close(self):
+        """Stops the batching worker once the queued requests are done."""
+        self.requests.put(None)
+        self.worker.join()
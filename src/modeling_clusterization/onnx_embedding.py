@@ -0,0 +1,192 @@
+import os
+import time
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import onnxruntime as ort
+from tokenizers import Tokenizer
+
+from exceptions.embedding_exceptions import EmbeddingConfigurationError
+from modeling_clusterization.embedding import AbstractEmbedder
+from utils.logging_utils import create_logger
+
+
+class OnnxSentenceEmbedder(AbstractEmbedder):
+    """
+    Sentence-transformer embedder run with ONNX Runtime on CPU, from local files only.
+
+    The model folder holds the exported encoder (model.onnx) and its fast tokenizer (tokenizer.json), see
+    OnnxSentenceEmbedder.export. Sentences are sorted by token length and encoded in batches of `batch_size`, each
+    padded only to its own longest sentence, so short questions don't pay for long ones. Token embeddings are mean
+    pooled over the attention mask and L2-normalized, as sentence-transformers does for its mean pooling models.
+    ONNX Runtime uses `num_threads` threads for each batch and no inter-op parallelism, so several workers on one
+    host don't oversubscribe the cpus.
+
+    Attributes:
+        model_path (Path): The path to model.onnx, the tokenizer is read from the same folder.
+        batch_size (int): Number of sentences encoded per forward pass.
+        max_seq_length (int): Sentences are truncated to this many tokens.
+
+    Methods:
+        load(): Creates the inference session and loads the tokenizer.
+        export(source_path: Path, output_dir: Path) -> Path: Exports a local sentence-transformer to ONNX.
+        liststr_to_matrix(sentences: List[List[str]]) -> np.ndarray: Converts tokenized sentences to a float32 matrix.
+        liststr_to_listvec(sentences: List[List[str]]) -> List[List[float]]: Converts tokenized sentences to vectors.
+    """
+
+    def __init__(self, model_path: Path, batch_size: int = 32, max_seq_length: int = 128, num_threads: int = None,
+                 log_level: str = 'INFO'):
+        """
+        Args:
+            model_path (Path): The path to model.onnx, with tokenizer.json in the same folder.
+            batch_size (int): Number of sentences encoded per forward pass. Larger batches give more throughput
+                and a higher latency per call, see src/validation/benchmark_onnx_embedder.py
+            max_seq_length (int): Sentences are truncated to this many tokens.
+            num_threads (int): ONNX Runtime intra-op threads, defaults to the number of cpus.
+            log_level (str): logger level, can be 'INFO', 'DEBUG', 'WARNING', 'ERROR'
+        """
+        self.model_path = Path(model_path)
+        self.batch_size = batch_size
+        self.max_seq_length = max_seq_length
+        self.num_threads = num_threads
+        self.session = None
+        self.tokenizer = None
+        self.pad_id = 0
+        self.logger = create_logger(log_level, log_name='OnnxSentenceEmbedder')
+
+    @property
+    def vector_size(self) -> int:
+        return self.session.get_outputs()[0].shape[-1]
+
+    def load(self):
+        """
+        Creates the ONNX Runtime session and loads the tokenizer from the model folder.
+        """
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.num_threads or os.cpu_count()
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        start = time.perf_counter()
+        self.session = ort.InferenceSession(str(self.model_path), sess_options=options,
+                                            providers=['CPUExecutionProvider'])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(str(self.model_path.parent / 'tokenizer.json'))
+        self.pad_id = (self.tokenizer.padding or {}).get('pad_id', 0)
+        self.tokenizer.no_padding()  # batches are padded to their own longest sentence in _encode_batch
+        self.tokenizer.enable_truncation(max_length=self.max_seq_length)
+        self.logger.info(f'Loaded onnx sentence embedder from {self.model_path} in '
+                         f'{time.perf_counter() - start:.2f}s with {options.intra_op_num_threads} threads')
+        return self
+
+    def save(self):
+        """
+        The exported files are the model, there is nothing to save.
+        """
+        return self
+
+    def retrain(self, sentences: List[List[str]]):
+        """
+        Sentence-transformers are used as exported: fine-tune the source model and export it again.
+
+        Raises:
+            EmbeddingConfigurationError: Always, the exported model can not be trained.
+        """
+        self.logger.error(f'Onnx sentence embedder can not be trained, {self.model_path} has to be exported')
+        raise EmbeddingConfigurationError(type(self).__name__, f'{self.model_path} is not exported and the onnx model '
+                                          f'is inference only, fine-tune the sentence-transformer and run '
+                                          f'OnnxSentenceEmbedder.export')
+
+    def _encode_batch(self, encodings: List) -> np.ndarray:
+        """Mean pooled, normalized embeddings of one batch of tokenizer encodings, padded to the longest one."""
+        length = max(len(encoding.ids) for encoding in encodings)
+        inputs = {name: np.zeros((len(encodings), length), dtype=np.int64)
+                  for name in ('input_ids', 'attention_mask', 'token_type_ids')}
+        inputs['input_ids'][:] = self.pad_id
+        for row, encoding in enumerate(encodings):
+            inputs['input_ids'][row, :len(encoding.ids)] = encoding.ids
+            inputs['attention_mask'][row, :len(encoding.ids)] = 1
+            inputs['token_type_ids'][row, :len(encoding.ids)] = encoding.type_ids
+        attention_mask = inputs['attention_mask']
+        output = self.session.run(None, {name: value for name, value in inputs.items() if name in self.input_names})[0]
+        if output.ndim == 3:  # token embeddings, pool them. Exports that include the pooling return sentences
+            mask = attention_mask[:, :, None].astype(np.float32)
+            output = (output * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        norms = np.linalg.norm(output, axis=1, keepdims=True)
+        return (output / np.maximum(norms, 1e-12)).astype(np.float32)
+
+    def liststr_to_matrix(self, sentences: List[List[str]]) -> np.ndarray:
+        """
+        Converts tokenized sentences to normalized sentence embeddings, batched by sorted token length.
+
+        Args:
+            sentences (List[List[str]]): Tokenized sentences, as returned by SpacyPrep.prep_sentences_to_list_of_lists.
+                The tokens are joined back into text for the model's own tokenizer.
+
+        Returns:
+            np.ndarray: A contiguous float32 array of shape (len(sentences), vector_size). Sentences without tokens
+                get a zero vector, as with FastTextModel.
+        """
+        if self.session is None:
+            self.load()
+        matrix = np.zeros((len(sentences), self.vector_size), dtype=np.float32)
+        texts = [' '.join(token for token in sentence if isinstance(token, str)) for sentence in sentences]
+        non_empty = [i for i, text in enumerate(texts) if text.strip()]
+        encodings = dict(zip(non_empty, self.tokenizer.encode_batch([texts[i] for i in non_empty])))
+        order = sorted(non_empty, key=lambda i: len(encodings[i].ids))
+
+        start = time.perf_counter()
+        for batch_start in range(0, len(order), self.batch_size):
+            rows = order[batch_start:batch_start + self.batch_size]
+            matrix[rows] = self._encode_batch([encodings[i] for i in rows])
+        self.logger.debug(f'Embedded {len(order)} sentences in {-(-len(order) // self.batch_size)} batches in '
+                          f'{(time.perf_counter() - start) * 1000:.1f} ms')
+        return matrix
+
+    def liststr_to_listvec(self, sentences: List[List[str]]) -> List[List[float]]:
+        """
+        Converts a list of sentences to a list of sentence vectors.
+
+        Args:
+            sentences (List[List[str]]): Tokenized sentences.
+
+        Returns:
+            List[List[float]]: A list of sentence vectors.
+        """
+        return self.liststr_to_matrix(sentences).tolist()
+
+    @staticmethod
+    def export(source_path: Path, output_dir: Path, opset: int = 14) -> Path:
+        """
+        Exports a sentence-transformer saved on disk (e.g. a download of all-MiniLM-L6-v2) to model.onnx and
+        tokenizer.json. Needs torch and transformers, which the onnx embedder itself doesn't.
+
+        Args:
+            source_path (Path): Folder of the sentence-transformer, or of its transformer module.
+            output_dir (Path): Folder the onnx model and the tokenizer are written to.
+            opset (int): ONNX opset version.
+
+        Returns:
+            Path: The path to model.onnx.
+        """
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        tokenizer = AutoTokenizer.from_pretrained(str(source_path), local_files_only=True)
+        model = AutoModel.from_pretrained(str(source_path), local_files_only=True).eval()
+        tokenizer.backend_tokenizer.save(str(output_dir / 'tokenizer.json'))
+
+        dummy = tokenizer(['an example question'], return_tensors='pt')
+        input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in dummy]
+        dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+        dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+        onnx_path = output_dir / 'model.onnx'
+        with torch.no_grad():
+            torch.onnx.export(model, tuple(dummy[name] for name in input_names), str(onnx_path),
+                              input_names=input_names, output_names=['last_hidden_state'],
+                              dynamic_axes=dynamic_axes, opset_version=opset)
+        return onnx_path
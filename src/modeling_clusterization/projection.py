@@ -0,0 +1,215 @@
+import hashlib
+import os
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, List
+
+import numpy as np
+
+from modeling_clusterization.embedding import AbstractEmbedder
+from utils.logging_utils import create_logger
+
+
+class VectorProjection:
+    """
+    Fitted linear map of sentence vectors to fewer dimensions, saved as an .npz next to the embedding model.
+
+    'pca' keeps the top right singular vectors of a sample of normalized sentence vectors. The sample is not centered,
+    as in FastTextModel.export_quantized, so the map preserves cosine similarities rather than distances from the
+    mean. 'random' is a Gaussian random projection, which needs no representative sample but more dimensions for the
+    same recall. Projected vectors are L2-normalized, zero vectors (sentences without known tokens) stay zero.
+
+    Attributes:
+        path (Path): The path to the .npz file.
+        method (str): 'pca' or 'random'.
+        dims (int): Number of dimensions kept.
+        components (np.ndarray): float32 matrix of shape (dims, source dimensions), None until fitted or loaded.
+    """
+
+    def __init__(self, path: Path, method: str = 'pca', dims: int = 64, log_level: str = 'INFO'):
+        """
+        Args:
+            path (Path): The path to the .npz file.
+            method (str): 'pca' or 'random'.
+            dims (int): Number of dimensions kept.
+            log_level (str): logger level, can be 'INFO', 'DEBUG', 'WARNING', 'ERROR'
+        """
+        if method not in ('pca', 'random'):
+            raise ValueError(f'Unsupported projection method {method}, use pca or random')
+        self.path = Path(path)
+        self.method = method
+        self.dims = dims
+        self.components = None
+        self.explained_variance = None
+        self.logger = create_logger(log_level, log_name='VectorProjection')
+
+    def fit(self, matrix: np.ndarray, seed: int = 0):
+        """
+        Fits the projection on a sample of sentence vectors.
+
+        Args:
+            matrix (np.ndarray): Sentence vectors, one per row.
+            seed (int): Random seed of the random projection.
+        """
+        matrix = np.asarray(matrix, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        sample = matrix[norms[:, 0] > 0] / norms[norms[:, 0] > 0]
+        if self.dims > matrix.shape[1]:
+            raise ValueError(f'Can not project {matrix.shape[1]} dimensions to {self.dims}')
+        if self.method == 'pca':
+            if len(sample) < self.dims:
+                raise ValueError(f'Fitting {self.dims} pca dimensions needs at least as many non-zero vectors, '
+                                 f'got {len(sample)}')
+            _, singular_values, components = np.linalg.svd(sample, full_matrices=False)
+            self.components = components[:self.dims].astype(np.float32)
+            self.explained_variance = float((singular_values[:self.dims] ** 2).sum() / (singular_values ** 2).sum())
+        else:
+            rng = np.random.default_rng(seed)
+            self.components = (rng.standard_normal((self.dims, matrix.shape[1])) / np.sqrt(self.dims)).astype(np.float32)
+            self.explained_variance = None
+        self.logger.info(f'Fitted {self.method} projection from {matrix.shape[1]} to {self.dims} dimensions on '
+                         f'{len(sample)} vectors' + (f', explained variance {self.explained_variance:.3f}'
+                                                      if self.explained_variance is not None else ''))
+        return self
+
+    def transform(self, matrix: np.ndarray) -> np.ndarray:
+        """
+        Projects sentence vectors.
+
+        Args:
+            matrix (np.ndarray): Sentence vectors, one per row.
+
+        Returns:
+            np.ndarray: A contiguous float32 array of shape (len(matrix), dims) with L2-normalized rows.
+        """
+        projected = np.asarray(matrix, dtype=np.float32) @ self.components.T
+        norms = np.linalg.norm(projected, axis=1, keepdims=True)
+        return np.ascontiguousarray(projected / np.where(norms == 0, 1, norms), dtype=np.float32)
+
+    def load(self):
+        """
+        Loads the fitted projection from disk.
+        """
+        with np.load(self.path) as artifact:
+            self.method, self.components = str(artifact['method']), artifact['components']
+            self.explained_variance = float(artifact['explained_variance']) if artifact['explained_variance'] >= 0 \
+                else None
+        self.dims = self.components.shape[0]
+        self.logger.info(f'Loaded {self.method} projection to {self.dims} dimensions from {self.path}')
+        return self
+
+    def save(self):
+        """
+        Writes the projection to disk, under a temporary name first so readers never see a partial file.
+        """
+        tmp = self.path.with_name(f'{self.path.name}.tmp{os.getpid()}.npz')
+        np.savez(tmp, method=self.method, components=self.components,
+                 explained_variance=-1.0 if self.explained_variance is None else self.explained_variance)
+        os.replace(tmp, self.path)
+        self.logger.info(f'Saved projection to {self.path}')
+        return self
+
+
+class ProjectedEmbedder(AbstractEmbedder):
+    """
+    Applies a VectorProjection to the vectors of another embedder, so that the same reduced vectors are upserted into
+    and searched in qdrant.
+
+    The projection is stored next to the wrapped model (<model>.projection.npz), loaded and saved with it, and fitted
+    again on a sample of the corpus whenever the model is retrained, since a projection only fits the model it was
+    fitted on. Any attribute not defined here (model_path, model, ...) is looked up on the wrapped embedder.
+
+    Attributes:
+        embedder (AbstractEmbedder): The wrapped embedder.
+        projection (VectorProjection): The projection applied to its vectors.
+        fit_sample (int): Number of training sentences the projection is fitted on after retraining.
+    """
+
+    def __init__(self, embedder: AbstractEmbedder, method: str = 'pca', dims: int = 64, fit_sample: int = 20000,
+                 log_level: str = 'INFO'):
+        """
+        Args:
+            embedder (AbstractEmbedder): The embedder whose vectors are projected.
+            method (str): 'pca' or 'random'.
+            dims (int): Number of dimensions kept.
+            fit_sample (int): Number of training sentences the projection is fitted on after retraining.
+            log_level (str): logger level, can be 'INFO', 'DEBUG', 'WARNING', 'ERROR'
+        """
+        self.embedder = embedder
+        self.projection = VectorProjection(Path(embedder.model_path).with_suffix('.projection.npz'), method=method,
+                                           dims=dims, log_level=log_level)
+        self.fit_sample = fit_sample
+        self.logger = create_logger(log_level, log_name='ProjectedEmbedder')
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__['embedder'], name)
+
+    @property
+    def vector_size(self) -> int:
+        return self.projection.dims
+
+    def model_version(self) -> str:
+        """The wrapped model's version combined with the saved projection's."""
+        stat = self.projection.path.stat() if self.projection.path.exists() else None
+        version_source = (f'{self.embedder.model_version()}:{self.projection.path}:'
+                          f'{stat.st_size if stat else None}:{stat.st_mtime_ns if stat else None}')
+        return hashlib.sha256(version_source.encode('utf-8')).hexdigest()[:16]
+
+    def load(self):
+        """
+        Loads the wrapped embedder and its projection.
+        """
+        self.embedder.load()
+        if not self.projection.path.exists():
+            raise FileNotFoundError(f'No projection fitted for {self.embedder.model_path}, retrain the model or run '
+                                    f'src/validation/projection_report.py with --save')
+        self.projection.load()
+        return self
+
+    def save(self):
+        """
+        Saves the wrapped embedder and its projection.
+        """
+        self.embedder.save()
+        self.projection.save()
+        return self
+
+    def fit(self, sentences: Iterable[List[str]]):
+        """
+        Fits the projection on the first `fit_sample` sentences.
+
+        Args:
+            sentences (Iterable[List[str]]): Tokenized sentences, a list or a restartable corpus.
+        """
+        self.projection.fit(self.embedder.liststr_to_matrix(list(islice(iter(sentences), self.fit_sample))))
+        return self
+
+    def retrain(self, sentences: Iterable[List[str]]):
+        """
+        Retrains the wrapped embedder and fits the projection to the retrained model.
+
+        Args:
+            sentences (Iterable[List[str]]): Tokenized sentences, a list or a restartable corpus.
+        """
+        self.embedder.retrain(sentences)
+        return self.fit(sentences)
+
+    def liststr_to_matrix(self, sentences: List[List[str]]) -> np.ndarray:
+        """
+        Converts tokenized sentences to projected sentence vectors.
+
+        Args:
+            sentences (List[List[str]]): Tokenized sentences, as returned by SpacyPrep.prep_sentences_to_list_of_lists.
+
+        Returns:
+            np.ndarray: A contiguous float32 array of shape (len(sentences), dims).
+        """
+        if self.projection.components is None:
+            self.projection.load()
+        return self.projection.transform(self.embedder.liststr_to_matrix(sentences))
+
+    def liststr_to_listvec(self, sentences: List[List[str]]) -> List[List[float]]:
+        """
+        Converts a list of sentences to a list of sentence vectors.
+        """
+        return self.liststr_to_matrix(sentences).tolist()
@@ -0,0 +1,185 @@
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from ingestion.database import PostgresDatabase, VectorDataBase
+from ingestion.embedding_pipeline import QuestionEmbeddingPipeline
+from modeling_clusterization.embedding import AbstractEmbedder, FastTextModel
+from modeling_clusterization.projection import ProjectedEmbedder
+from preprocessing.abstract_prep import AbstractPrep
+from utils.artifact_store import ArtifactStore
+from utils.logging_utils import create_logger
+
+MODEL_FILENAME = 'fasttext.model'
+TRAINING_LOCK = 'training'
+
+
+def versioned_collection(collection_prefix: str, version: str) -> str:
+    """Name of the qdrant collection that holds the question vectors of an embedding model version."""
+    return f'{collection_prefix}_{version}'
+
+
+class EmbeddingRetrainJob:
+    """
+    Retrains FastText off the request path and publishes it as a new version.
+
+    A run continues training from the published version (or starts a new model if there is none), saves the result
+    in a new version folder of the ArtifactStore, re-embeds every stored question into a new qdrant collection for
+    that version, and only then publishes the version. Sessions following the store (see sessions.hot_swap) switch
+    to the new model and its collection together, so queries never mix vectors of two versions and there is no
+    downtime. Old versions and their collections are pruned.
+
+    Runs hold the store's training lock, so processes sharing a store (the workers of one deployment) never train
+    at the same time.
+
+    Attributes:
+        store (ArtifactStore): Where the versions are written.
+        collection_prefix (str): Prefix of the versioned qdrant collections.
+    """
+
+    def __init__(self, store: ArtifactStore, postgres_db: PostgresDatabase, spc: AbstractPrep,
+                 collection_prefix: str, vec_size: int = 300, epochs: int = 5, min_count: int = 5, workers: int = 3,
+                 load_mode: str = 'mmap', quantization: Dict = None, projection: Dict = None, keep_versions: int = 3,
+                 pipeline_settings: Dict = None, log_level: str = 'INFO'):
+        """
+        Args:
+            store (ArtifactStore): Where the versions are written.
+            postgres_db (PostgresDatabase): Source of the questions to re-embed, connected by the caller.
+            spc (AbstractPrep): Cleans the questions before they are embedded.
+            collection_prefix (str): Prefix of the versioned qdrant collections, e.g. QDRANT_QUESTIONS_TABLE_NAME.
+            vec_size (int): Size of the vectors.
+            epochs (int): FastText training epochs.
+            min_count (int): FastText minimum word count.
+            workers (int): FastText training threads.
+            load_mode (str): Embedding load mode of the sessions. 'mmap' also exports the keyed vectors, 'quantized'
+                exports the quantized artifact and embeds the stored questions with it.
+            quantization (Dict): Keyword arguments of FastTextModel.export_quantized, for the 'quantized' mode.
+            projection (Dict): Keyword arguments of ProjectedEmbedder (method, dims, fit_sample) if the sessions
+                store projected vectors, None otherwise. The projection is fitted to every version.
+            keep_versions (int): Number of versions (and collections) kept when pruning.
+            pipeline_settings (Dict): chunk_size of the questions streamed from Postgres, and the keyword arguments
+                of QuestionEmbeddingPipeline (queue_size, embed_workers, upsert_workers) that re-embeds them.
+            log_level (str): logger level, can be 'INFO', 'DEBUG', 'WARNING', 'ERROR'
+        """
+        self.store = store
+        self.postgres_db = postgres_db
+        self.spc = spc
+        self.collection_prefix = collection_prefix
+        self.vec_size = vec_size
+        self.epochs = epochs
+        self.min_count = min_count
+        self.workers = workers
+        self.load_mode = load_mode
+        self.quantization = quantization or {}
+        self.projection = projection
+        self.keep_versions = keep_versions
+        self.pipeline_settings = dict(pipeline_settings or {})
+        self.chunk_size = self.pipeline_settings.pop('chunk_size', 1000)
+        self.log_level = log_level
+        self.thread = None
+        self.logger = create_logger(log_level, log_name='EmbeddingRetrainJob')
+
+    def train(self, sentences: Iterable[List[str]]) -> FastTextModel:
+        """Trains the next version in a new version folder, continuing from the published version if there is one."""
+        version = self.store.new_version()
+        model = FastTextModel(self.store.version_path(version) / MODEL_FILENAME, epochs=self.epochs,
+                              min_count=self.min_count, workers=self.workers, load_mode='mmap' if self.load_mode == 'mmap' else 'full',
+                              log_level=self.log_level)
+        base_version = self.store.current_version()
+        if base_version is not None:
+            model.model = FastTextModel(self.store.version_path(base_version) / MODEL_FILENAME,
+                                        log_level=self.log_level).load().model
+        start = time.perf_counter()
+        model.retrain(sentences).save()
+        self.store.write_manifest(version, {'base_version': base_version,
+                                            'collection': versioned_collection(self.collection_prefix, version),
+                                            'train_seconds': round(time.perf_counter() - start, 1)})
+        self.logger.info(f'Trained version {version} from {base_version or "scratch"}')
+        return model
+
+    def serving_embedder(self, model: FastTextModel, sentences: Iterable[List[str]]) -> AbstractEmbedder:
+        """
+        The embedder sessions will use for the trained model. Artifacts it needs besides the model (the quantized
+        model, the fitted projection) are written next to the model.
+        """
+        embedder = model
+        if self.load_mode == 'quantized':
+            embedder = model.export_quantized(model.model_path.with_suffix('.q.npz'), **self.quantization)
+        if self.projection is not None:
+            embedder = ProjectedEmbedder(embedder, log_level=self.log_level, **self.projection).fit(sentences)
+            embedder.projection.save()
+        return embedder
+
+    def reembed(self, model: AbstractEmbedder, version: str) -> int:
+        """Embeds every stored question with the new model into the version's collection, streamed in chunks."""
+        qdrant_db = VectorDataBase(versioned_collection(self.collection_prefix, version), self.vec_size,
+                                   log_level=self.log_level)
+        qdrant_db.connect()
+        qdrant_db.create_table()
+        pipeline = QuestionEmbeddingPipeline(self.spc, model, qdrant_db, log_level=self.log_level,
+                                             **self.pipeline_settings)
+        stats = pipeline.run(self.postgres_db.iter_questions(chunksize=self.chunk_size))
+        self.logger.info(f'Re-embedded {stats["questions"]} questions into {qdrant_db.table_name}')
+        return stats['questions']
+
+    def prune(self):
+        """Deletes the oldest versions and their collections."""
+        for version in self.store.prune(self.keep_versions):
+            qdrant_db = VectorDataBase(versioned_collection(self.collection_prefix, version), self.vec_size,
+                                       log_level=self.log_level)
+            qdrant_db.connect()
+            try:
+                qdrant_db.drop_table()
+            except Exception as err:
+                self.logger.warning(f'Could not drop collection of pruned version {version}: {err}')
+
+    def run(self, sentences: Iterable[List[str]], only_if_unpublished: bool = False) -> Optional[str]:
+        """
+        Trains, re-embeds and publishes a new version, holding the store's training lock.
+
+        Args:
+            sentences (Iterable[List[str]]): Tokenized training sentences, a list or a restartable SentenceCorpus.
+            only_if_unpublished (bool): Only train the first version: skip the run if a version has been published
+                or another process is training, instead of waiting for it. Used by sessions that start without a
+                model, so one worker trains and the others pick the version up once it is published.
+
+        Returns:
+            Optional[str]: The published version, None if the run was skipped.
+        """
+        with self.store.lock(TRAINING_LOCK, blocking=not only_if_unpublished) as locked:
+            if not locked:
+                self.logger.info('Another process is training the first version, waiting for it to be published')
+                return None
+            if only_if_unpublished and self.store.current_version() is not None:
+                self.logger.info(f'Version {self.store.current_version()} has been published, not training')
+                return None
+            model = self.train(sentences)
+            version = model.model_path.parent.name
+            questions = self.reembed(self.serving_embedder(model, sentences), version)
+            self.store.write_manifest(version, {**self.store.manifest(version), 'questions': questions})
+            self.store.publish(version)
+            self.prune()
+        return version
+
+    def start_background(self, sentences: Iterable[List[str]],
+                         only_if_unpublished: bool = False) -> Optional[threading.Thread]:
+        """
+        Runs the job in a daemon thread, unless a run is already in progress in this process. Runs of other
+        processes are handled by the training lock, see run().
+
+        Returns:
+            Optional[threading.Thread]: The thread, None if a run was already in progress.
+        """
+        if self.thread is not None and self.thread.is_alive():
+            self.logger.warning('A retraining run is already in progress')
+            return None
+
+        def run():
+            try:
+                self.run(sentences, only_if_unpublished=only_if_unpublished)
+            except Exception as err:
+                self.logger.error(f'Background retraining failed: {err}')
+
+        self.thread = threading.Thread(target=run, name='fasttext-retrain', daemon=True)
+        self.thread.start()
+        return self.thread
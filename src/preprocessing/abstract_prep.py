@@ -0,0 +1,30 @@
+from abc import ABC, abstractclassmethod
+
+
+class AbstractPrep(ABC):
+    """
+    A preprocessing backend, turning raw text into clean lemmatized tokens.
+
+    Kept apart from the implementations so that code which only needs the interface (the caches, the sessions) does
+    not import spaCy.
+    """
+
+    @abstractclassmethod
+    def prep_words_to_list():
+        pass
+
+    @abstractclassmethod
+    def prep_sentences_to_list_of_lists():
+        pass
+
+    @abstractclassmethod
+    def iter_prep_sentences():
+        pass
+
+    @abstractclassmethod
+    def model_version():
+        pass
+
+    @abstractclassmethod
+    def warm_up():
+        pass
@@ -0,0 +1,68 @@
+import re
+from typing import List
+
+from utils.logging_utils import create_logger
+
+# sentences that carry no information about the job itself: equal opportunity statements, accommodation and
+# privacy notices, application instructions. They are common to most postings and only cost prompt tokens.
+BOILERPLATE_PATTERNS = [
+    r'\bequal (employment )?opportunity\b',
+    r'\baffirmative action\b',
+    r'\bwithout regard to (race|age|color|religion|sex|gender|national origin)\b',
+    # a list of protected classes: at least two whole words of them, each followed by a separator
+    r'(?:\b(?:race|colou?r|creed|religion|sex|sexual orientation|gender|gender identity|gender expression|'
+    r'national origin|ancestry|age|marital status|pregnancy|genetic information|citizenship|veteran status|'
+    r'protected veteran status|disability)(?:,? (?:or|and) |, )){2,}',
+    r'\breasonable accommodations?\b',
+    r'\be-?verify\b',
+    r'\bprivacy (policy|policies|notices?)\b',
+    r'\b(click|tap) (on )?(the )?apply\b',
+    r'\bapply (now|today)\b',
+    r'\bwe (do not|don\'t) accept unsolicited\b',
+    r'\brecruitment agenc(y|ies)\b',
+    r'\bpay transparency\b',
+    r'\bbackground (check|screening)s? (is|are|will be) required\b',
+]
+
+
+class DescriptionPrep:
+    """
+    Cleans job descriptions before they are sent to a gpt model.
+
+    Drops sentences that match boilerplate patterns (equal opportunity statements, accommodation and privacy notices,
+    application instructions), removes repeated lines and collapses whitespace.
+    """
+
+    def __init__(self, boilerplate_patterns: List[str] = None, log_level: str = 'INFO'):
+        """
+        Args:
+            boilerplate_patterns (List[str]): Regular expressions of sentences to drop, case-insensitive.
+                Defaults to BOILERPLATE_PATTERNS.
+            log_level (str): logger level, can be 'INFO', 'DEBUG', 'WARNING', 'ERROR'
+        """
+        patterns = BOILERPLATE_PATTERNS if boilerplate_patterns is None else boilerplate_patterns
+        self.boilerplate = re.compile('|'.join(f'(?:{p})' for p in patterns), flags=re.IGNORECASE) if patterns else None
+        self.logger = create_logger(log_level, log_name='DescriptionPrep')
+
+    def strip_boilerplate(self, description: str) -> str:
+        """
+        Removes boilerplate sentences and repeated lines from a job description.
+
+        Args:
+            description (str): Raw job description.
+
+        Returns:
+            str: The cleaned description, paragraphs are kept on separate lines.
+        """
+        lines, seen = [], set()
+        for line in description.splitlines():
+            line = re.sub(r'\s+', ' ', line).strip()
+            if not line or line.lower() in seen:
+                continue
+            seen.add(line.lower())
+            if self.boilerplate is not None:
+                line = ' '.join(sentence for sentence in re.split(r'(?<=[.!?])\s+', line)
+                                if not self.boilerplate.search(sentence))
+            if line:
+                lines.append(line)
+        return '\n'.join(lines)
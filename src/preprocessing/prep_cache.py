@@ -0,0 +1,106 @@
+import json
+from typing import Iterable, Iterator, List
+
+from preprocessing.abstract_prep import AbstractPrep
+from utils.logging_utils import create_logger
+from utils.sqlite_cache import SqliteCache
+from utils.tiered_cache import TieredCache
+
+
+class CachedPrep(AbstractPrep):
+    """
+    Memoizes the cleaned tokens of a preprocessing backend (SpacyPrep or RulePrep), keyed by the text.
+
+    Application questions repeat across users and employers, so most texts are cleaned once and then served from a
+    TieredCache: a bounded in-process LRU cache, with an optional persistent SqliteCache behind it that survives
+    restarts and is shared by the workers of a host. Entries belong to the version of the spaCy model (or lookup
+    table) and cleaning rules (model_version of the wrapped prep), so upgrading either makes old entries unreachable.
+    Callers use it like the wrapped prep: any attribute not defined here is looked up on it.
+
+    Attributes:
+        prep (AbstractPrep): The wrapped prep.
+        cache (TieredCache): text -> tokens, for the version of the wrapped prep.
+    """
+
+    def __init__(self, prep: AbstractPrep, max_entries: int = 50000, disk: SqliteCache = None,
+                 log_level: str = 'INFO'):
+        """
+        Args:
+            prep (AbstractPrep): The prep to put the cache in front of.
+            max_entries (int): Size of the in-process tier, every entry holds the tokens of one text.
+            disk (SqliteCache): Persistent tier, None keeps the cache in memory only.
+            log_level (str): logger level, can be 'INFO', 'DEBUG', 'WARNING', 'ERROR'
+        """
+        self.prep = prep
+        self.cache = TieredCache(prep.model_version(), encode=lambda tokens: json.dumps(tokens, ensure_ascii=False)
+                                 .encode('utf-8'), decode=json.loads, max_entries=max_entries, disk=disk)
+        self.logger = create_logger(log_level, log_name='CachedPrep')
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__['prep'], name)
+
+    def model_version(self) -> str:
+        return self.cache.version
+
+    def warm_up(self):
+        """Loads the wrapped prep's model now instead of on first use."""
+        self.prep.warm_up()
+        return self
+
+    def prep_sentences_to_list_of_lists(self, text: List[str]) -> List[List[str]]:
+        """
+        Pre-process input text into a list of lists of clean lemmatized tokens representing sentences. Only the texts
+        found in neither tier are sent to the wrapped prep, each distinct one once.
+
+        Parameters:
+            text (List of strings/sentences): The input sentences to pre-process.
+
+        Returns:
+            list of list of str: List of lists of clean lemmatized tokens representing sentences.
+        """
+        tokens, cleaned = self.cache.get_many(text, self.prep.prep_sentences_to_list_of_lists)
+        self.logger.debug(f'Cleaned {len(text)} sentences, {cleaned} not cached')
+        return [list(tokens[sentence]) for sentence in text]  # copies, so callers can't alter cached entries
+
+    def prep_words_to_list(self, text: str) -> List[str]:
+        """
+        Pre-process input text into a list of clean lemmatized tokens.
+
+        Parameters:
+            text (str): The input text to pre-process.
+
+        Returns:
+            list of str: List of clean lemmatized tokens.
+        """
+        return self.prep_sentences_to_list_of_lists([text])[0]
+
+    def iter_prep_sentences(self, text: Iterable[str], batch_size: int = None,
+                            n_process: int = None) -> Iterator[List[str]]:
+        """
+        Pre-process input sentences lazily, looking up and cleaning them a batch at a time.
+
+        Parameters:
+            text (Iterable of strings/sentences): The input sentences to pre-process, e.g. a generator.
+            batch_size (int): Number of texts looked up together, defaults to the wrapped prep's batch size.
+            n_process (int): Unused, the wrapped prep's setting applies to the texts that aren't cached.
+
+        Returns:
+            generator: Yields a list of clean lemmatized tokens per sentence, in input order.
+        """
+        batch_size = batch_size or self.prep.batch_size
+        batch = []
+        for sentence in text:
+            batch.append(sentence)
+            if len(batch) == batch_size:
+                yield from self.prep_sentences_to_list_of_lists(batch)
+                batch = []
+        if batch:
+            yield from self.prep_sentences_to_list_of_lists(batch)
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: model and rules version, memory tier hits, disk tier hits, misses that were cleaned, overall hit
+                rate and the number of entries in memory
+        """
+        return self.cache.stats()
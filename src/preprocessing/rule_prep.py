@@ -0,0 +1,316 @@
+import string
+import re
+import json
+import os
+import hashlib
+import threading
+import time
+from collections import Counter, defaultdict
+from functools import lru_cache
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, Iterator, List, Tuple
+
+from preprocessing.abstract_prep import AbstractPrep
+from utils.logging_utils import create_logger
+
+
+# tokens spaCy's English tokenizer keeps whole although the rules below would split them
+TOKENIZER_EXCEPTIONS = {
+    'Mr.', 'Mrs.', 'Ms.', 'Dr.', 'Jr.', 'St.', 'Co.', 'Corp.', 'Inc.', 'Ltd.', 'vs.', 'a.m.', 'p.m.', 'Jan.', 'Feb.',
+    'Mar.', 'Apr.', 'Aug.', 'Sep.', 'Sept.', 'Oct.', 'Nov.', 'Dec.', 'and/or', 'C++', '.NET', ':)', ':(', ':-)', ';)',
+}
+PREFIXES = set('"\'([{<$£€¥#*~¿¡«“‘`')
+SUFFIXES = set('.,;:!?)]}>"\'%»”’*#')
+CONTRACTION_SUFFIX = re.compile(r"(?<=[A-Za-z])(?:n['’]t|['’](?:s|m|re|ve|ll|d))$", re.IGNORECASE)
+UNIT_SUFFIX = re.compile(r'(?<=[0-9])(?:am|pm|kg|km|lb|mb|gb|tb|\+)$', re.IGNORECASE)
+ABBREVIATION = re.compile(r'^(?:[A-Za-z]\.)+$')
+URL = re.compile(r'^(?:https?://|www\.)\S+$|^[\w.+-]+@[\w-]+(?:\.[\w-]+)+$')
+INFIXES = re.compile(r'((?<=[A-Za-z0-9])(?:--|-|–|—|\.\.\.)(?=[A-Za-z])'
+                     r'|(?<=[0-9])[-+*^](?=[0-9-])'
+                     r'|(?<=[A-Za-z0-9])[:<>=/](?=[A-Za-z])'
+                     r'|(?<=[A-Za-z]),(?=[A-Za-z]))')
+WHITESPACE_OR_WORD = re.compile(r'\s+|\S+')
+
+
+@lru_cache(maxsize=100000)
+def _split_word(word: str) -> Tuple[str, ...]:
+    """
+    Splits a whitespace delimited word into tokens the way spaCy's English tokenizer does for the common cases:
+    prefix punctuation, suffix punctuation, contractions and units off the end, then hyphens, slashes and commas
+    inside the rest. Memoized, the vocabulary of questions is small.
+    """
+    prefixes, suffixes = [], []
+    while word:
+        if word in TOKENIZER_EXCEPTIONS or ABBREVIATION.match(word) or URL.match(word):
+            break
+        if word[0] in PREFIXES and len(word) > 1:
+            prefixes.append(word[0])
+            word = word[1:]
+            continue
+        match = CONTRACTION_SUFFIX.search(word) or UNIT_SUFFIX.search(word)
+        if match and match.start() > 0:
+            suffixes.append(match.group())
+            word = word[:match.start()]
+            continue
+        if word.endswith('...') and len(word) > 3:
+            suffixes.append('...')
+            word = word[:-3]
+            continue
+        if word[-1] in SUFFIXES and len(word) > 1:
+            suffixes.append(word[-1])
+            word = word[:-1]
+            continue
+        break
+    if word in TOKENIZER_EXCEPTIONS or URL.match(word):
+        infixed = [word]
+    else:
+        infixed = [token for token in INFIXES.split(word) if token]
+    return tuple(prefixes + infixed + suffixes[::-1])
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits text into tokens like spaCy's English tokenizer: a single space after a word separates it from the next,
+    any other whitespace run becomes a token of its own.
+
+    Args:
+        text (str): The input text.
+
+    Returns:
+        list of str: The tokens.
+    """
+    tokens = []
+    after_word = False
+    for match in WHITESPACE_OR_WORD.finditer(text):
+        chunk = match.group()
+        if chunk[0].isspace():
+            if after_word and chunk[0] == ' ':
+                chunk = chunk[1:]
+            if chunk:
+                tokens.append(chunk)
+            after_word = False
+        else:
+            tokens.extend(_split_word(chunk))
+            after_word = True
+    return tokens
+
+
+class RulePrep(AbstractPrep):
+    """
+    A class to clean a string of text without spaCy: a regex tokenizer and a lemma lookup table.
+
+    For questions made of words the table knows it gives the tokens SpacyPrep gives, in a fraction of the time and
+    memory and without loading a model. The lemma of a token depends on its context in spaCy; the lookup table holds
+    the lemma SpacyPrep gave each token most often on a corpus of questions, and is built from it with build_lookup.
+    Words missing from the table can't be lemmatized by lookup, they would be kept as they are (lowercased, if the
+    spaCy model lowercased most lemmas), which differs from spaCy for most inflected words: on held-out questions
+    only about half are cleaned like spaCy would. So with a `fallback` prep (a SpacyPrep) questions with a word
+    missing from the table are cleaned by the fallback instead, which loads spaCy on the first such question. The
+    more of the stored questions the table is built from, the rarer that is; see
+    src/validation/prep_parity_benchmark.py for the parity and the share of questions that fall back.
+
+    The table also holds spaCy's English stop words. SpacyPrep keeps stop words, so by default they are kept here
+    too: cleaning differently from the model the vectors were trained with would shift the vectors.
+    """
+
+    # bump when the tokenizer or the cleaning rules change, so that cached tokens cleaned by older rules are not used
+    RULES_VERSION = 1
+
+    def __init__(self, lookup_path: Path, log_level: str = 'INFO', batch_size: int = 256,
+                 remove_stop_words: bool = False, fallback: AbstractPrep = None):
+        """
+        Initializes the RulePrep object.
+
+        Parameters:
+            lookup_path (Path): The lemma lookup table written by build_lookup.
+            log_level (str): logger level, can be 'INFO', 'DEBUG', 'WARNING', 'ERROR'
+            batch_size (int): Number of texts iter_prep_sentences cleans together, for the caches in front of it.
+            remove_stop_words (bool): Drop stop words, which SpacyPrep does not.
+            fallback (AbstractPrep): Cleans the questions with words missing from the table, None keeps those words
+                as they are. Its stop word setting should match.
+        """
+        self.lookup_path = Path(lookup_path)
+        self.batch_size = batch_size
+        self.remove_stop_words = remove_stop_words
+        self.fallback = fallback
+        self.cleaned = 0
+        self.fallbacks = 0
+        self._lookup = None
+        self._lookup_lock = threading.Lock()
+        self.load_seconds = None
+        self.logger = create_logger(log_level, log_name='RulePrep')
+
+    @property
+    def lookup(self) -> dict:
+        """The lemma lookup table, loaded on first use."""
+        if self._lookup is None:
+            with self._lookup_lock:
+                if self._lookup is None:
+                    self._lookup = self._load_lookup()
+        return self._lookup
+
+    def _load_lookup(self) -> dict:
+        """
+        Internal method to load the lookup table.
+
+        Raises:
+            FileNotFoundError: If the table was not built.
+        """
+        start = time.perf_counter()
+        if not self.lookup_path.exists():
+            raise FileNotFoundError(f'No lemma lookup table at {self.lookup_path}, build it with '
+                                    f'src/validation/prep_parity_benchmark.py --save')
+        lookup = json.loads(self.lookup_path.read_text(encoding='utf-8'))
+        lookup['stop_words'] = set(lookup['stop_words'])
+        self.load_seconds = time.perf_counter() - start
+        self.logger.info(f'Loaded {len(lookup["lemmas"])} lemmas from {self.lookup_path} in {self.load_seconds:.3f}s')
+        return lookup
+
+    @staticmethod
+    def build_lookup(spacy_prep, text: Iterable[str], lookup_path: Path) -> dict:
+        """
+        Builds the lookup table from the lemmas a SpacyPrep gives a corpus of questions, and writes it, under a
+        temporary name first so readers never see a partial file.
+
+        Parameters:
+            spacy_prep (SpacyPrep): The prep whose output is reproduced.
+            text (Iterable of strings/sentences): The corpus, ideally the stored application questions.
+            lookup_path (Path): Where the table is written.
+
+        Returns:
+            dict: The table, with the source model version, lemmas, stop words and lowercase fallback.
+        """
+        counts = defaultdict(Counter)
+        for doc in spacy_prep.nlp.pipe(text, batch_size=spacy_prep.batch_size):
+            for t in doc:
+                counts[t.text][t.lemma_] += 1
+        lemmas = {token: lemma_counts.most_common(1)[0][0] for token, lemma_counts in counts.items()}
+        cased = [lemma for token, lemma in lemmas.items() if token[:1].isupper()]
+        lookup = {'source_version': spacy_prep.model_version(), 'lemmas': lemmas,
+                  'stop_words': sorted(spacy_prep.nlp.Defaults.stop_words),
+                  'lowercase_unknown': sum(lemma == lemma.lower() for lemma in cased) > len(cased) / 2}
+        lookup_path = Path(lookup_path)
+        tmp = lookup_path.with_name(f'{lookup_path.name}.tmp{os.getpid()}')
+        tmp.write_text(json.dumps(lookup, ensure_ascii=False, sort_keys=True), encoding='utf-8')
+        os.replace(tmp, lookup_path)
+        return lookup
+
+    def model_version(self) -> str:
+        """
+        Identifies the lookup table and the rules without loading the table. Cached tokens are only valid for the
+        version they were cleaned with.
+        """
+        stat = self.lookup_path.stat() if self.lookup_path.exists() else None
+        version_source = (f'{self.lookup_path}:{stat.st_size if stat else None}:{stat.st_mtime_ns if stat else None}'
+                          f':rules-{self.RULES_VERSION}:stop-words-{self.remove_stop_words}'
+                          f':fallback-{self.fallback.model_version() if self.fallback is not None else None}')
+        return hashlib.sha256(version_source.encode('utf-8')).hexdigest()[:16]
+
+    def warm_up(self):
+        """
+        Loads the lookup table now instead of on first use.
+        """
+        self.lookup  # loads the table
+        return self
+
+    def _lemma(self, token: str) -> str:
+        """
+        Internal method to look up the lemma of a token.
+        """
+        lemma = self.lookup['lemmas'].get(token)
+        if lemma is None:
+            lemma = self.lookup['lemmas'].get(token.lower(), token)
+            if self.lookup['lowercase_unknown']:
+                lemma = lemma.lower()
+        return lemma
+
+    def _clean_text(self, text: str) -> List[str]:
+        """
+        Internal method to turn a text into clean lemmatized tokens, with the punctuation check of SpacyPrep.
+
+        Parameters:
+            text (str): The input text.
+
+        Returns:
+            list of str: List of clean lemmatized tokens.
+        """
+        tokens = (t for t in tokenize(text) if t not in string.punctuation)
+        if self.remove_stop_words:
+            tokens = (t for t in tokens if t.lower() not in self.lookup['stop_words'])
+        return [self._lemma(t) for t in tokens]
+
+    def _known(self, text: str) -> bool:
+        """
+        Internal method to check whether the table knows every word of a text, in its case or lowercased.
+        """
+        lemmas = self.lookup['lemmas']
+        return all(t in lemmas or t.lower() in lemmas for t in tokenize(text) if t not in string.punctuation)
+
+    def _clean_texts(self, text: List[str]) -> List[List[str]]:
+        """
+        Internal method to clean several texts, the ones with words missing from the table by the fallback together.
+
+        Parameters:
+            text (List of strings/sentences): The input texts.
+
+        Returns:
+            list of list of str: List of lists of clean lemmatized tokens, in input order.
+        """
+        if self.fallback is None:
+            cleaned = [self._clean_text(sentence) for sentence in text]
+        else:
+            cleaned = [self._clean_text(sentence) if self._known(sentence) else None for sentence in text]
+            unknown = [i for i, tokens in enumerate(cleaned) if tokens is None]
+            if unknown:
+                for i, tokens in zip(unknown, self.fallback.prep_sentences_to_list_of_lists([text[i] for i in unknown])):
+                    cleaned[i] = tokens
+                self.fallbacks += len(unknown)
+        self.cleaned += len(text)
+        return cleaned
+
+    def fallback_rate(self) -> float:
+        """Share of the texts cleaned so far that were cleaned by the fallback."""
+        return self.fallbacks / self.cleaned if self.cleaned else 0.0
+
+    def prep_words_to_list(self, text: str) -> List[str]:
+        """
+        Pre-process input text into a list of clean lemmatized tokens.
+
+        Parameters:
+            text (str): The input text to pre-process.
+
+        Returns:
+            list of str: List of clean lemmatized tokens.
+        """
+        return self._clean_texts([text])[0]
+
+    def iter_prep_sentences(self, text: Iterable[str], batch_size: int = None,
+                            n_process: int = None) -> Iterator[List[str]]:
+        """
+        Pre-process input sentences lazily, for streams that shouldn't be held in memory.
+
+        Parameters:
+            text (Iterable of strings/sentences): The input sentences to pre-process, e.g. a generator.
+            batch_size (int): Number of sentences cleaned together, so the fallback gets them in batches. Defaults to
+                the batch_size of the prep.
+            n_process (int): Unused, cleaning is cheap enough for one process.
+
+        Returns:
+            generator: Yields a list of clean lemmatized tokens per sentence, in input order.
+        """
+        sentences = iter(text)
+        while batch := list(islice(sentences, batch_size or self.batch_size)):
+            yield from self._clean_texts(batch)
+
+    def prep_sentences_to_list_of_lists(self, text: List[str]) -> List[List[str]]:
+        """
+        Pre-process input text into a list of lists of clean lemmatized tokens representing sentences.
+
+        Parameters:
+            text (List of strings/sentences): The input sentences to pre-process.
+
+        Returns:
+            list of list of str: List of lists of clean lemmatized tokens representing sentences.
+        """
+        return self._clean_texts(list(text))
@@ -1,36 +1,114 @@
 import string
 import spacy 
-from typing import List
+from typing import Iterable, Iterator, List
 from pathlib import Path
 import pandas as pd
 import json
 import numpy as np
+import hashlib
+import importlib.metadata
+import threading
 import time
 import os
+from exceptions.preprocessing_exceptions import SpacyModelNotFoundError
+from preprocessing.abstract_prep import AbstractPrep
 from utils.logging_utils import create_logger
 
 
 
 
-class SpacyPrep:
+class SpacyPrep(AbstractPrep):
     """
     A class to clean a string of text using spaCy NLP library.
+
+    Every text goes through the pipeline once. The dependency parser and the named entity recognizer are not loaded:
+    the cleaning only reads lemmas, stop words and punctuation, which come from the tagger, attribute ruler and
+    lemmatizer. Large batches can be spread over several processes with `n_process`.
+
+    The model is loaded on first use (or by warm_up()), from a vendored model folder or the installed package, and
+    never downloaded: the environment has to provide it. How long loading took is kept in `load_seconds`.
     """
 
-    def __init__(self, log_level: str = 'INFO'):
+    UNUSED_COMPONENTS = ['parser', 'ner']
+    # bump when the cleaning rules below change, so that cached tokens cleaned by older rules are not used
+    RULES_VERSION = 1
+
+    def __init__(self, log_level: str = 'INFO', batch_size: int = 256, n_process: int = 1,
+                 model_name: str = 'en_core_web_sm', model_path: Path = None):
         """
         Initializes the SpacyPrep object.
 
         Parameters:
-            nlp (spacy.lang): The spaCy language model to use for text processing.
+            log_level (str): logger level, can be 'INFO', 'DEBUG', 'WARNING', 'ERROR'
+            batch_size (int): Number of texts spaCy processes together.
+            n_process (int): Number of processes used for lists of more than `batch_size` texts, and by default in
+                iter_prep_sentences. Each process loads its own copy of the model.
+            model_name (str): Name of the installed spaCy model package.
+            model_path (Path, optional): Folder of a vendored copy of the model, used instead of the package.
         """
-        # load spacy dict in case it was not installed automatically
-        os.system("python -m spacy download en_core_web_sm")
-
-        self.nlp = spacy.load("en_core_web_sm")
+        self.model_name = model_name
+        self.model_path = model_path
+        self._nlp = None
+        self._nlp_lock = threading.Lock()
+        self.load_seconds = None
         self.excpetion_list = ['\n']
+        self.batch_size = batch_size
+        self.n_process = n_process
         self.logger = create_logger(log_level, log_name='SpacyPrep')
 
+    @property
+    def nlp(self):
+        """The spaCy pipeline, loaded on first use."""
+        if self._nlp is None:
+            with self._nlp_lock:
+                if self._nlp is None:
+                    self._nlp = self._load_model()
+        return self._nlp
+
+    def _load_model(self):
+        """
+        Internal method to load the model from the vendored folder or the installed package.
+
+        Raises:
+            SpacyModelNotFoundError: If the model is in neither place.
+        """
+        start = time.perf_counter()
+        if self.model_path is not None:
+            if not Path(self.model_path).exists():
+                raise SpacyModelNotFoundError(self.model_name, self.model_path)
+            nlp = spacy.load(self.model_path, exclude=self.UNUSED_COMPONENTS)
+        elif spacy.util.is_package(self.model_name):
+            nlp = spacy.load(self.model_name, exclude=self.UNUSED_COMPONENTS)
+        else:
+            raise SpacyModelNotFoundError(self.model_name)
+        self.load_seconds = time.perf_counter() - start
+        self.logger.info(f'Loaded spacy model {self.model_path or self.model_name} in {self.load_seconds:.2f}s')
+        return nlp
+
+    def model_version(self) -> str:
+        """
+        Identifies the spaCy model and the cleaning rules without loading the model. Cached tokens are only valid for
+        the version they were cleaned with.
+        """
+        if self.model_path is not None:
+            meta_path = Path(self.model_path) / 'meta.json'
+            meta = json.loads(meta_path.read_text()) if meta_path.exists() else {}
+            model = f"{self.model_path}:{meta.get('name')}:{meta.get('version')}"
+        else:
+            try:
+                model = f'{self.model_name}:{importlib.metadata.version(self.model_name)}'
+            except importlib.metadata.PackageNotFoundError:
+                model = f'{self.model_name}:not-installed'
+        version_source = f'{model}:spacy-{spacy.__version__}:rules-{self.RULES_VERSION}:{self.excpetion_list}'
+        return hashlib.sha256(version_source.encode('utf-8')).hexdigest()[:16]
+
+    def warm_up(self):
+        """
+        Loads the model now instead of on first use.
+        """
+        self.nlp  # loads the model
+        return self
+
     def _remove_punct(self, doc):
         """
         Internal method to remove punctuation tokens from a spaCy document.
@@ -70,6 +148,20 @@ class SpacyPrep:
 
         return [t.lemma_ for t in doc]
 
+    def _clean_doc(self, doc) -> List[str]:
+        """
+        Internal method to turn a processed spaCy document into clean lemmatized tokens.
+
+        Parameters:
+            doc (spacy.tokens.Doc): The input spaCy document.
+
+        Returns:
+            list of str: List of clean lemmatized tokens.
+        """
+        removed_punct = self._remove_punct(doc)
+        removed_stop_words = self._remove_stop_words(removed_punct)
+        return self._lemmatize(removed_stop_words)
+
     def prep_words_to_list(self, text:str) -> List[str]:
         """
         Pre-process input text into a list of clean lemmatized tokens.
@@ -81,10 +173,25 @@ class SpacyPrep:
             list of str: List of clean lemmatized tokens.
         """
         doc = self.nlp(text)
-        removed_punct = self._remove_punct(doc)
-        removed_stop_words = self._remove_stop_words(removed_punct)
         self.logger.info('cleaning words to a list words')
-        return self._lemmatize(removed_stop_words)
+        return self._clean_doc(doc)
+
+    def iter_prep_sentences(self, text: Iterable[str], batch_size: int = None,
+                            n_process: int = None) -> Iterator[List[str]]:
+        """
+        Pre-process input sentences lazily, for streams that shouldn't be held in memory.
+
+        Parameters:
+            text (Iterable of strings/sentences): The input sentences to pre-process, e.g. a generator.
+            batch_size (int): Number of texts spaCy processes together, defaults to self.batch_size.
+            n_process (int): Number of processes, defaults to self.n_process.
+
+        Returns:
+            generator: Yields a list of clean lemmatized tokens per sentence, in input order.
+        """
+        for doc in self.nlp.pipe(text, batch_size=batch_size or self.batch_size,
+                                 n_process=n_process or self.n_process):
+            yield self._clean_doc(doc)
 
     def prep_sentences_to_list_of_lists(self, text: List[str]) -> List[List[str]]:
         """
@@ -96,10 +203,8 @@ class SpacyPrep:
         Returns:
             list of list of str: List of lists of clean lemmatized tokens representing sentences.
         """
-
-        doclist = list(self.nlp.pipe(text))
-        lemm_docs = []
-        for doc in doclist:
-            lemm_docs.append(self.prep_words_to_list(doc))
+        # starting processes costs more than it saves on the few questions of a request
+        n_process = self.n_process if len(text) > self.batch_size else 1
+        lemm_docs = list(self.iter_prep_sentences(text, n_process=n_process))
         self.logger.info('cleaning list of sentences to a list of lists of words')
-        return lemm_docs
\ No newline at end of file
+        return lemm_docs
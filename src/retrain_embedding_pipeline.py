@@ -0,0 +1,34 @@
+from utils.logging_utils import create_logger
+from yaml import safe_load
+from pathlib import Path
+import os
+
+from ingestion.database import PostgresDatabase
+from ingestion.sentence_corpus import SentenceCorpus
+from sessions.session_factory import create_embedding_retrain_job, create_prep
+
+if __name__ == "__main__":
+
+    with open('src/universal_config.yaml', 'r') as file:
+        cf = safe_load(file)
+
+    with open('src/application_questions_config.yaml', 'r') as file:
+        cf_appq = safe_load(file)
+
+    # logging constants and pipeline logger
+    log_level = cf['utils']['log_level']
+    rep_logger = create_logger(log_level, log_name='retrain_embedding_pipeline_log')
+    rep_logger.info('running retrain_embedding_pipeline.py')
+
+    fasttext_training_it_dataset_path = (Path(os.getenv('PARENT_FOLDER_PATH')) / 'data' / 'app_questions' /
+                                         'prep_data' / 'prep_sentences_50K.csv')
+
+    # trains a new FastText version, re-embeds all questions into its own qdrant collection and publishes it.
+    # running application sessions pick the new version up on their next poll, without a restart
+    postgres_db = PostgresDatabase(log_level=log_level)
+    postgres_db.connect()
+    spc = create_prep(cf_appq, Path(os.getenv('PARENT_FOLDER_PATH')) / 'data', log_level)
+    retrain_job = create_embedding_retrain_job(cf, cf_appq, postgres_db, spc, log_level)
+    sentences = SentenceCorpus(fasttext_training_it_dataset_path, log_level=log_level)  # streamed, not loaded
+    version = retrain_job.run(sentences)
+    rep_logger.info(f'published embedding version {version}')
@@ -1,30 +1,41 @@
 from utils.logging_utils import create_logger
 from pathlib import Path
 from ingestion.database import VectorDataBase, PostgresDatabase
-from preprocessing.spacy_prep import SpacyPrep
+from ingestion.sentence_corpus import SentenceCorpus
+from ingestion.embedding_pipeline import QuestionEmbeddingPipeline
+from preprocessing.abstract_prep import AbstractPrep
 from modeling_clusterization.embedding import AbstractEmbedder
-from modeling_clusterization.gpt_models import abstractGptModel
-import pandas as pd
+from modeling_clusterization.gpt_models import abstractGptModel, completion_text
+from typing import Dict, Iterator, List, Tuple
+import threading
+import time
 
 
 class ApplicationSession:
     """An application session to manage interactions between the user and the chatbot."""
 
-    def __init__(self, postgres_db: PostgresDatabase, spc: SpacyPrep, embed_model: AbstractEmbedder,
+    def __init__(self, postgres_db: PostgresDatabase, spc: AbstractPrep, embed_model: AbstractEmbedder,
                  qdrant_db: VectorDataBase, gpt_model: abstractGptModel,
-                 fasttext_training_it_dataset_path: Path = None, log_level: str = 'INFO') -> None:
+                 fasttext_training_it_dataset_path: Path = None, log_level: str = 'INFO',
+                 retrain_job=None, hot_swap=None, pipeline_settings: Dict = None) -> None:
         """
         Initialize the ApplicationSession.
 
         Parameters:
             postgres_db (PostgresDatabase): The PostgreSQL database connection.
-            spc (SpacyPrep): An instance of SpacyPrep for text preprocessing.
+            spc (AbstractPrep): A preprocessing backend (SpacyPrep or RulePrep) for text preprocessing.
             embed_model (AbstractEmbedder): An embedding model for vectorizing sentences.
             qdrant_db (VectorDataBase): The Qdrant vector database connection.
             gpt_model (abstractGptModel): The GPT model for generating responses.
             fasttext_training_it_dataset_path (Path, optional): Path to the FastText training dataset (IT dataset). 
             log_level (str, optional): The log level for the logger (default is 'INFO').
+            retrain_job (EmbeddingRetrainJob, optional): Trains the first embedding model in the background when
+                there is none, instead of blocking initialize_session.
+            hot_swap (EmbeddingHotSwap, optional): Keeps the session on the published embedding model version.
+            pipeline_settings (Dict, optional): chunk_size of the questions streamed from Postgres, and the keyword
+                arguments of QuestionEmbeddingPipeline (queue_size, embed_workers, upsert_workers) that upserts them.
         """
+        self.log_level = log_level
         self.logger = create_logger(log_level, log_name='application_session.py')
         self.postgres_db = postgres_db
         self.spc = spc
@@ -32,43 +43,110 @@ class ApplicationSession:
         self.qdrant_db = qdrant_db
         self.gpt_model = gpt_model
         self.fasttext_training_it_dataset_path = fasttext_training_it_dataset_path
+        self.retrain_job = retrain_job
+        self.hot_swap = hot_swap
+        self.pipeline_settings = dict(pipeline_settings or {})
+        self.chunk_size = self.pipeline_settings.pop('chunk_size', 1000)
+        self.pipeline_stats = None
+        self.embedding_version = None
+        self.initialize_seconds = None
+        self.prompt_lock = threading.Lock()
 
     def initialize_session(self):
         """
         Initialize the application session by connecting to the databases and loading the embedding model (if available).
+        With a hot swap the published model version is used and followed. Without any model, a retrain job trains
+        one in the background (in one process only, the others wait for it to be published); without a job the
+        model is trained here, which blocks.
+        The spaCy model is loaded on first use, see startup_metrics().
         """
+        start = time.perf_counter()
         self.postgres_db.connect()
         self.qdrant_db.connect()
 
-        if self.embed_model.model_path.exists():
+        training_data_exists = (self.fasttext_training_it_dataset_path is not None
+                                and self.fasttext_training_it_dataset_path.exists())
+        if self.hot_swap is not None and self.hot_swap.start(self):
+            pass  # the published version has been loaded
+        elif self.embed_model.model_path.exists():
             self.embed_model.load()
-        elif self.fasttext_training_it_dataset_path is not None and self.fasttext_training_it_dataset_path.exists():
-            df_sentences = pd.read_csv(self.fasttext_training_it_dataset_path)
-            sentences = df_sentences.values.tolist()
+        elif training_data_exists and self.retrain_job is not None:
+            sentences = SentenceCorpus(self.fasttext_training_it_dataset_path, log_level=self.log_level)
+            # every worker gets here, the training lock lets only one of them train
+            self.retrain_job.start_background(sentences, only_if_unpublished=True)
+            self.logger.warning('No embedding model yet, training one in the background. Questions can be '
+                                'answered once it has been published')
+        elif training_data_exists:
+            # streamed from disk for the vocabulary and every epoch, the corpus is never held in memory
+            sentences = SentenceCorpus(self.fasttext_training_it_dataset_path, log_level=self.log_level)
             self.embed_model.retrain(sentences)
             self.embed_model.save()
 
-        self.logger.info('Application session initialized')
+        self.initialize_seconds = time.perf_counter() - start
+        self.logger.info(f'Application session initialized in {self.initialize_seconds:.2f}s')
         return self
 
-    def upsert_q_to_vec(self, user_id: str = 'b5f5f813-dafe-4cce-8f15-089bee4efacb'):
+    def startup_metrics(self) -> Dict:
+        """
+        Returns:
+            Dict: Seconds initialize_session took, seconds loading the spaCy model or lemma lookup table took (None
+                until it is first used) and the embedding model version in use (None if no versioned model has been
+                swapped in).
+        """
+        return {'initialize_seconds': self.initialize_seconds, 'prep_load_seconds': self.spc.load_seconds,
+                'embedding_version': self.embedding_version}
+
+    def cache_stats(self) -> Dict:
+        """
+        Returns:
+            Dict: Hit and miss statistics of the caches in front of the preprocessing, the embedding model and the gpt
+                model, for the ones that are cached.
         """
-        Vectorize the user's questions and upsert them into the Qdrant vector database.
+        components = {'preprocessing': self.spc, 'embedding': self.embed_model, 'gpt': self.gpt_model}
+        return {name: component.stats() for name, component in components.items() if hasattr(component, 'stats')}
+
+    def swap_embedding(self, embed_model: AbstractEmbedder, qdrant_db: VectorDataBase, version: str = None):
+        """
+        Replace the embedding model and the qdrant collection holding its vectors, together, so that a query is
+        never embedded with one model version and searched among vectors of another.
 
         Parameters:
-            user_id (str, optional): The user's ID (default is 'b5f5f813-dafe-4cce-8f15-089bee4efacb').
+            embed_model (AbstractEmbedder): The new, loaded embedding model.
+            qdrant_db (VectorDataBase): The connected vector database with the new model's vectors.
+            version (str, optional): Version name of the new model, for logging.
         """
-        self.df_questions = self.postgres_db.query_questions_user(table_name_forms='forms_auto_fill',
-                                                                  table_name_questions='questions',
-                                                                  user_id=user_id)
-        self.raw_q_list, self.raw_q_id_list = self.df_questions.name.tolist(), self.df_questions.question_id.tolist()
-        self.clean_q_list = self.spc.prep_sentences_to_list_of_lists(self.raw_q_list)
-        self.clean_qvec_list = self.embed_model.liststr_to_listvec(self.clean_q_list)
+        with self.prompt_lock:
+            self.embed_model, self.qdrant_db = embed_model, qdrant_db
+            previous, self.embedding_version = self.embedding_version, version
+        self.logger.info(f'Swapped embedding model version {previous} for {version} '
+                         f'(qdrant table {qdrant_db.table_name})')
+        return self
 
-        self.qdrant_db.insert_rows(vectors=self.clean_qvec_list, id_list=self.raw_q_id_list, key=None, key_value=None)
-        self.logger.info(f'Questions for user id {user_id} have been vectorized and added to the qdrant table')
+    def upsert_q_to_vec(self, user_id: str = 'b5f5f813-dafe-4cce-8f15-089bee4efacb'):
+        """
+        Vectorize the user's questions and upsert them into the Qdrant vector database. The questions are streamed
+        from Postgres in chunks through a QuestionEmbeddingPipeline, its statistics are kept in self.pipeline_stats.
+
+        Parameters:
+            user_id (str, optional): The user's ID (default is 'b5f5f813-dafe-4cce-8f15-089bee4efacb'). None upserts
+                the questions of all users, see backfill_q_to_vec.
+        """
+        with self.prompt_lock:  # embed and insert with the same model version, even if it is swapped meanwhile
+            embed_model, qdrant_db = self.embed_model, self.qdrant_db
+        pipeline = QuestionEmbeddingPipeline(self.spc, embed_model, qdrant_db, log_level=self.log_level,
+                                             **self.pipeline_settings)
+        self.pipeline_stats = pipeline.run(self.postgres_db.iter_questions(user_id=user_id,
+                                                                           chunksize=self.chunk_size))
+        self.logger.info(f'Questions for {"user id " + user_id if user_id else "all users"} have been vectorized '
+                         f'and added to the qdrant table')
 
         return self
+
+    def backfill_q_to_vec(self):
+        """
+        Vectorize the questions of all users and upsert them into the Qdrant vector database, at steady memory.
+        """
+        return self.upsert_q_to_vec(user_id=None)
     
     def substring_replacement(self, substring_to_replace:str, hist_question:str, hist_answer: str):
         """
@@ -86,36 +164,108 @@ class ApplicationSession:
                             .replace('hist_answer', f'{hist_answer}'))
                             # .replace('new_question', f'{new_question}')
 
-    def prompt_modification(self, append_string):
+    def prompt_modification(self, system_string: str, user_string: str, append_string: str) -> str:
         """
-        Modify gpt prompts to generate multiple different answers
+        Ask the gpt model for one more answer, to generate multiple different answers one at a time
         Parameters:
+            system_string (str): The system's input string.
+            user_string (str): The prompt's user string, with the answers generated so far appended.
             append_string (str): String to append. Should contain a call to generate a difefrent answer
 
 
         Returns:
-            self: Contains self.ret_list that should contain appended answers 
+            str: The answer, an empty string if the gpt model could not generate one
         """
-        prompt = [{"role": "system", "content": self.system_string}, 
-            {"role": "user", "content": self.user_string + append_string}]
+        prompt = [{"role": "system", "content": system_string},
+            {"role": "user", "content": user_string + append_string}]
 
-        out = self.gpt_model.gpt_prompt_return(prompt)
-        ret = str(out["choices"][0]["message"]['content'])
-        
-        if ret != '' or ret is not None:
+        ret = completion_text(self.gpt_model.gpt_prompt_return(prompt))
+
+        if ret != '':
             self.logger.info('GPT model generated a tuned answer')
             self.logger.info(f'Answer: {ret}')
-            self.ret_list.append(ret)
-            self.user_string = self.user_string + ' ' + ret
         else:
             self.logger.warning('GPT model could not generate a prediction. Returning an empty string')
-            self.ret_list.append('')
 
-        return self
+        return ret
     
+    def build_tuned_prompt(self, user_string: str, system_string: str, substring_to_replace: str,
+                           new_question: str, hist_qa_return_limit: int = 1) -> Tuple[Dict[str, str], List[Dict[str, str]]]:
+        """
+        Find the historical qa pairs closest to a new question and build the gpt prompt that tunes them into an answer.
+        Safe to call from concurrent requests: everything is built in local variables, the lock is only held to
+        take the embedding model and qdrant collection of the same version.
+
+        Parameters:
+            user_string (str): The user's input string.
+            system_string (str): The system's input string.
+            substring_to_replace (str): Substring that will be inserted into the prompt. Has hist_answer and hist_question strings that will be replaced by historical qa pair
+            new_question (str): The new question to consider.
+            hist_qa_return_limit (int): How many historical qa pairs to return
+
+        Returns:
+            Tuple[Dict[str, str], List[Dict[str, str]]]: The historical answer-question pairs and the prompt.
+        """
+        with self.prompt_lock:  # embed and search with the same model version, even if it is swapped meanwhile
+            embed_model, qdrant_db = self.embed_model, self.qdrant_db
+
+        clean_q = self.spc.prep_sentences_to_list_of_lists([new_question])
+        clean_qvec = embed_model.liststr_to_listvec(clean_q)
+        hist_question_id_score_dict = qdrant_db.query_app_q(query_vector=clean_qvec[0], limit=hist_qa_return_limit)
+
+        hist_answer_question_dict = dict({self.postgres_db.query_answers_question_id(table_name_forms='forms_auto_fill', table_name_answers='answers', question_id= question_id)
+         for question_id in list(hist_question_id_score_dict.keys())})
+
+        self.logger.info('Found and retrieved a matching historical question-answer pair(s)')
+        self.logger.info(f'Question(s): {hist_answer_question_dict.values()}')
+        self.logger.info(f'Answer(s): {hist_answer_question_dict.keys()}')
+        self.logger.info(f'New question: {new_question}')
+        
+        substring_to_replace = ''.join(self.substring_replacement(substring_to_replace, hist_answer, hist_question)
+         for hist_question, hist_answer in hist_answer_question_dict.items())
+        
+        user_string = user_string.replace('substring_to_replace', substring_to_replace).replace('new_question', new_question)
+        prompt = [{"role": "system", "content": system_string},
+                  {"role": "user", "content": user_string}]
+        
+        return hist_answer_question_dict, prompt
+
+    def stream_tune_answer(self, user_string: str, system_string: str, substring_to_replace: str,
+                           new_question: str, hist_qa_return_limit: int = 1) -> Iterator[str]:
+        """
+        Generate one tuned answer and yield it piece by piece as the GPT model produces it, so the first words reach
+        the user before the whole answer is generated.
+
+        Parameters:
+            See build_tuned_prompt.
+
+        Returns:
+            Iterator[str]: Tokens of the tuned answer.
+        """
+        _, prompt = self.build_tuned_prompt(user_string, system_string, substring_to_replace, new_question,
+                                            hist_qa_return_limit)
+        yield from self.gpt_model.gpt_prompt_stream(prompt)
+
+    @staticmethod
+    def variant_prompt(prompt: List[Dict[str, str]], different_answer_user_string: str,
+                       answer_variant_strings: List[str], i: int) -> List[Dict[str, str]]:
+        """
+        The i-th of the independent prompts of the 'parallel' answer mode: the prompt itself for the first answer,
+        then the prompt with one of the answer variants in turn, asking for a different answer.
+
+        Returns:
+            List[Dict[str, str]]: The prompt messages.
+        """
+        if i == 0:
+            return prompt
+        variant = answer_variant_strings[(i - 1) % len(answer_variant_strings)] if answer_variant_strings else ''
+        user_string = ' '.join(part for part in (prompt[1]['content'], variant, different_answer_user_string) if part)
+        return [prompt[0], {"role": "user", "content": user_string}]
+
     def query_tune_answer(self, user_string: str, system_string: str, substring_to_replace:str,
                           different_answer_user_string, new_question: str = 'Do you have experience in customer service?',
-                          hist_qa_return_limit:int = 1, gpt_answer_return_limit: int = 3):
+                          hist_qa_return_limit:int = 1, gpt_answer_return_limit: int = 3,
+                          answer_mode: str = 'single_call', answer_variant_strings: List[str] = None):
         """
         Generate a tuned answer using the GPT model based on user and system input.
 
@@ -127,48 +277,43 @@ class ApplicationSession:
             new_question (str, optional): The new question to consider (default is 'Do you have experience in customer service?').
             hist_qa_return_hist_qa_return_limit (int): How many historical qa pairs to return
             gpt_answer_return_limit (int): How many different answer tuning should gpt return
+            answer_mode (str): 'single_call' asks the gpt model for all alternative answers with one prompt, so latency
+                stays flat as gpt_answer_return_limit grows. Models that can't return alternatives from one request
+                (gpt4all, the instruct model) would answer the same prompt sent n times the same way, for them
+                'single_call' works like 'parallel'. 'parallel' sends gpt_answer_return_limit independent prompts
+                at once (to the gpt4all pool, or one batch of the instruct model), each but the first asking for a
+                different answer with another of answer_variant_strings. 'sequential' asks for one answer at a time
+                and feeds every answer back into the prompt to request a different one, its prompt grows each time.
+            answer_variant_strings (List[str]): Instructions that make the prompts of the 'parallel' mode differ, e.g.
+                in length or tone, used in turn. Without them the prompts after the second are the same.
 
         Returns:
             str: The generated tuned answer.
         """
-        self.different_answer_user_string = different_answer_user_string
-        self.hist_qa_return_limit = hist_qa_return_limit
-        self.gpt_answer_return_limit = gpt_answer_return_limit
-
-        self.clean_q = self.spc.prep_sentences_to_list_of_lists([new_question])
-        self.clean_qvec = self.embed_model.liststr_to_listvec(self.clean_q)
-        self.hist_question_id_score_dict = self.qdrant_db.query_app_q(query_vector=self.clean_qvec[0], limit=self.hist_qa_return_limit)
+        hist_answer_question_dict, prompt = self.build_tuned_prompt(user_string, system_string, substring_to_replace,
+                                                                    new_question, hist_qa_return_limit)
 
+        if answer_mode == 'single_call' and self.gpt_model.native_n:
+            ret_list = self.gpt_model.gpt_prompt_return_n(prompt, n=gpt_answer_return_limit)
+            self.logger.info(f'GPT model generated {len(ret_list)} tuned answers')
+            self.logger.info(f'Answers: {ret_list}')
+            return hist_answer_question_dict, ret_list
 
-        
-        self.hist_answer_question_dict = dict({self.postgres_db.query_answers_question_id(table_name_forms='forms_auto_fill', table_name_answers='answers', question_id= question_id)                                  
-         for question_id in list(self.hist_question_id_score_dict.keys())})
-        self.user_string = user_string
-        self.substring_to_replace = substring_to_replace
-        self.system_string = system_string
-        self.new_question = new_question
-
-        self.logger.info('Found and retrieved a matching historical question-answer pair(s)')
-        self.logger.info(f'Question(s): {self.hist_answer_question_dict.values()}')
-        self.logger.info(f'Answer(s): {self.hist_answer_question_dict.keys()}')
-        self.logger.info(f'New question: {self.new_question}')
-        
-        self.substring_to_replace = ''.join(self.substring_replacement(self.substring_to_replace, hist_answer, hist_question) 
-         for hist_question, hist_answer in self.hist_answer_question_dict.items())
-        
-        self.user_string = self.user_string.replace('substring_to_replace', self.substring_to_replace).replace('new_question', self.new_question)
-        self.prompt = [{"role": "system", "content": self.system_string},
-                       {"role": "user", "content": self.user_string}]
-        
-        self.out = self.gpt_model.gpt_prompt_return(self.prompt)
-        self.ret = str(self.out["choices"][0]["message"]['content'])
-
-        self.ret_list = []
-        for _ in range(self.gpt_answer_return_limit):
-            if gpt_answer_return_limit == 1:
-                self.prompt_modification(append_string = '')
-            else:
-                self.prompt_modification(append_string = self.different_answer_user_string) 
+        if answer_mode in ('single_call', 'parallel'):
+            prompts = [self.variant_prompt(prompt, different_answer_user_string, answer_variant_strings, i)
+                       for i in range(gpt_answer_return_limit)]
+            ret_list = [completion_text(out) for out in self.gpt_model.gpt_prompt_return_many(prompts)]
+            self.logger.info(f'GPT model generated {sum(ret != "" for ret in ret_list)} tuned answers in parallel')
+            self.logger.info(f'Answers: {ret_list}')
+            return hist_answer_question_dict, ret_list
 
-        return self.hist_answer_question_dict, self.ret_list
+        system_string, user_string = prompt[0]['content'], prompt[1]['content']
+        append_string = '' if gpt_answer_return_limit == 1 else different_answer_user_string
+        ret_list = []
+        for _ in range(gpt_answer_return_limit):
+            ret = self.prompt_modification(system_string, user_string, append_string)
+            ret_list.append(ret)
+            if ret != '':
+                user_string = user_string + ' ' + ret
 
+        return hist_answer_question_dict, ret_list
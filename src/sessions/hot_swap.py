@@ -0,0 +1,86 @@
+import threading
+from pathlib import Path
+from typing import Callable, Optional
+
+from ingestion.database import VectorDataBase
+from modeling_clusterization.embedding import AbstractEmbedder
+from modeling_clusterization.retraining import MODEL_FILENAME, versioned_collection
+from utils.artifact_store import ArtifactStore
+from utils.logging_utils import create_logger
+
+
+class EmbeddingHotSwap:
+    """
+    Keeps an ApplicationSession on the published embedding model version.
+
+    A daemon thread polls the ArtifactStore pointer. When a new version is published, the new model is loaded and
+    its qdrant collection connected next to the running ones, then both are swapped into the session at once.
+    Requests in flight finish on the old pair, later ones use the new pair; there is no restart and no downtime.
+    """
+
+    def __init__(self, store: ArtifactStore, make_embedder: Callable[[Path], AbstractEmbedder],
+                 make_vector_db: Callable[[str], VectorDataBase], collection_prefix: str,
+                 poll_seconds: float = 30.0, log_level: str = 'INFO'):
+        """
+        Args:
+            store (ArtifactStore): The store the retraining job publishes to.
+            make_embedder (Callable[[Path], AbstractEmbedder]): Builds an (unloaded) embedder for a model path.
+            make_vector_db (Callable[[str], VectorDataBase]): Builds an (unconnected) vector database for a collection.
+            collection_prefix (str): Prefix of the versioned qdrant collections.
+            poll_seconds (float): How often the published version is checked.
+            log_level (str): logger level, can be 'INFO', 'DEBUG', 'WARNING', 'ERROR'
+        """
+        self.store = store
+        self.make_embedder = make_embedder
+        self.make_vector_db = make_vector_db
+        self.collection_prefix = collection_prefix
+        self.poll_seconds = poll_seconds
+        self.version = None
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.logger = create_logger(log_level, log_name='EmbeddingHotSwap')
+
+    def check_now(self, session) -> bool:
+        """
+        Swaps the published version into the session if it isn't in use yet.
+
+        Returns:
+            bool: Whether a version was swapped in.
+        """
+        version = self.store.current_version()
+        if version is None or version == self.version:
+            return False
+        embed_model = self.make_embedder(self.store.version_path(version) / MODEL_FILENAME)
+        embed_model.load()
+        qdrant_db = self.make_vector_db(versioned_collection(self.collection_prefix, version))
+        qdrant_db.connect()
+        session.swap_embedding(embed_model, qdrant_db, version)
+        self.version = version
+        return True
+
+    def _poll(self, session):
+        while not self.stop_event.wait(self.poll_seconds):
+            try:
+                self.check_now(session)
+            except Exception as err:  # keep serving the current version, try again on the next poll
+                self.logger.error(f'Could not swap to the published embedding version: {err}')
+
+    def start(self, session) -> bool:
+        """
+        Swaps in the published version right away, then keeps following the store in a daemon thread.
+
+        Returns:
+            bool: Whether a published version was swapped in.
+        """
+        swapped = self.check_now(session)
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._poll, args=(session,), name='embedding-hot-swap',
+                                           daemon=True)
+            self.thread.start()
+        return swapped
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stops following the store."""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
@@ -0,0 +1,238 @@
+from utils.logging_utils import create_logger
+from utils.sqlite_cache import SqliteCache
+from yaml import safe_load
+from pathlib import Path
+from typing import Dict, Tuple
+from ingestion.database import VectorDataBase, PostgresDatabase
+from preprocessing.abstract_prep import AbstractPrep
+from preprocessing.prep_cache import CachedPrep
+from preprocessing.rule_prep import RulePrep
+from modeling_clusterization.embedding import FastTextModel, QuantizedFastTextModel
+from modeling_clusterization.embedding_cache import CachedEmbedder
+from modeling_clusterization.projection import ProjectedEmbedder
+from modeling_clusterization.gpt_models import ChatGpt, Gpt4All
+from modeling_clusterization.gpt_cache import CachedGptModel
+from modeling_clusterization.retraining import EmbeddingRetrainJob
+from sessions.application_session import ApplicationSession
+from sessions.hot_swap import EmbeddingHotSwap
+from utils.artifact_store import ArtifactStore
+import os
+
+
+def create_application_session(universal_config_path: Path = Path('src/universal_config.yaml'),
+                               app_questions_config_path: Path = Path('src/application_questions_config.yaml')
+                               ) -> Tuple[ApplicationSession, Dict]:
+    """
+    Builds an ApplicationSession from the yaml configs and the .env variables, the way the application questions
+    pipeline and the flask api both need it.
+
+    Args:
+        universal_config_path (Path): Path to universal_config.yaml
+        app_questions_config_path (Path): Path to application_questions_config.yaml
+
+    Returns:
+        Tuple[ApplicationSession, Dict]: The session (not yet initialized) and the keyword arguments for
+            ApplicationSession.query_tune_answer (prompt strings, return limits and answer mode).
+    """
+    with open(universal_config_path, 'r') as file:
+        cf = safe_load(file)
+
+    with open(app_questions_config_path, 'r') as file:
+        cf_appq = safe_load(file)
+
+    cf_db_q = cf['database']['qdrant']
+
+    # general paths
+    parent_folder_path = Path(os.getenv('PARENT_FOLDER_PATH'))
+    data_path = parent_folder_path / 'data'
+    app_questions_data_path = data_path / 'app_questions'
+    embed_model_path = app_questions_data_path / 'artifacts' / 'fasttext.model'
+    fasttext_training_it_dataset_path = app_questions_data_path / 'prep_data' / 'prep_sentences_50K.csv'
+
+    # paths to gpt binaries
+    cf_gpt_model_to_use = os.getenv('GPT_MODEL_TO_USE')  # chatgpt, gpt4all or instruct
+    model_path = data_path / cf['gpt_model_constants']['model_path']
+    gpt_model_str = cf['gpt_model_constants'][cf_gpt_model_to_use]['gpt_model_str']
+
+    # strings to generate prompts and other gpt constants - use .env variables, so that these can be altered easily
+    cf_prompts = cf_appq['gpt_model_constants']['default_prompt_strings']
+    query_settings = {
+        'system_string': cf_prompts['system_string'],
+        'user_string': cf_prompts['user_string'],
+        'substring_to_replace': cf_prompts['substring_to_replace'],
+        'different_answer_user_string': cf_prompts['different_answer_user_string'],
+        'hist_qa_return_limit': int(os.getenv('HIST_QA_RETURN_LIMIT')),
+        'gpt_answer_return_limit': int(os.getenv('GPT_ANSWER_RETURN_LIMIT')),
+        'answer_mode': cf_appq['gpt_model_constants']['answer_mode'],
+        'answer_variant_strings': cf_prompts['answer_variant_strings'],
+    }
+
+    log_level = cf['utils']['log_level']
+    logger = create_logger(log_level, log_name='session_factory')
+
+    postgres_db = PostgresDatabase()
+    spc = create_prep(cf_appq, data_path, log_level)
+    cf_prep_cache = cf_appq['preprocessing']['cache']
+    if cf_prep_cache['enabled']:
+        prep_cache = None
+        if cf_prep_cache['disk_enabled']:
+            prep_cache = SqliteCache(data_path / cf_prep_cache['cache_path'],
+                                     max_entries=cf_prep_cache['disk_max_entries'], log_level=log_level)
+        spc = CachedPrep(spc, max_entries=cf_prep_cache['max_entries'], disk=prep_cache, log_level=log_level)
+    cf_fasttext = cf_appq['embedding']['fasttext']
+    cf_embed_cache = cf_appq['embedding']['cache']
+    embedding_cache = None
+    if cf_embed_cache['enabled'] and cf_embed_cache['disk_enabled']:
+        embedding_cache = SqliteCache(data_path / cf_embed_cache['cache_path'],
+                                      max_entries=cf_embed_cache['disk_max_entries'], log_level=log_level)
+
+    cf_onnx = cf_appq['embedding']['onnx']
+    use_onnx = cf_appq['embedding']['model'] == 'onnx'
+    cf_projection = cf_appq['embedding']['projection']
+
+    def make_embedder(model_path: Path):
+        if use_onnx:
+            # onnxruntime is only needed for this model
+            from modeling_clusterization.onnx_embedding import OnnxSentenceEmbedder
+            embedder = OnnxSentenceEmbedder(data_path / cf_onnx['model_path'], batch_size=cf_onnx['batch_size'],
+                                            max_seq_length=cf_onnx['max_seq_length'],
+                                            num_threads=cf_onnx['num_threads'], log_level=log_level)
+        elif cf_fasttext['load_mode'] == 'quantized':
+            # the full model is only trained when there is no artifact yet, exporting it again afterwards
+            embedder = QuantizedFastTextModel(model_path.with_suffix('.q.npz'),
+                                              source=FastTextModel(model_path, workers=cf_fasttext['workers'],
+                                                                   log_level=log_level),
+                                              quantization=cf_fasttext['quantization'], log_level=log_level)
+        else:
+            embedder = FastTextModel(model_path, load_mode=cf_fasttext['load_mode'], workers=cf_fasttext['workers'],
+                                     log_level=log_level)
+        if cf_projection['enabled']:
+            embedder = ProjectedEmbedder(embedder, method=cf_projection['method'], dims=cf_projection['dims'],
+                                         fit_sample=cf_projection['fit_sample'], log_level=log_level)
+        if cf_embed_cache['enabled']:  # cache keys include the model version, so versions can share the disk tier
+            embedder = CachedEmbedder(embedder, max_entries=cf_embed_cache['max_entries'], disk=embedding_cache,
+                                      log_level=log_level)
+        return embedder
+
+    vec_size = cf_onnx['vec_size'] if use_onnx else cf_db_q['vec_size']
+    if cf_projection['enabled']:
+        vec_size = cf_projection['dims']
+
+    def make_vector_db(table_name: str):
+        return VectorDataBase(table_name, vec_size, log_level=log_level)
+
+    embed_model = make_embedder(embed_model_path)
+    # sentence-transformer and projected vectors have their own size and can't be compared with fasttext ones,
+    # keep them apart
+    table_name = os.getenv('QDRANT_QUESTIONS_TABLE_NAME') + ('_onnx' if use_onnx else '')
+    if cf_projection['enabled']:
+        table_name += f'_{cf_projection["method"]}{cf_projection["dims"]}'
+    # questions cleaned by the rules may get other tokens than with spacy, queries must not be compared with them
+    if cf_appq['preprocessing']['backend'] == 'rules':
+        table_name += '_rules'
+    qdrant_db = make_vector_db(table_name)
+
+    retrain_job, hot_swap = None, None
+    cf_versioning = cf_appq['embedding']['versioning']
+    if cf_versioning['enabled'] and not use_onnx:
+        retrain_job = create_embedding_retrain_job(cf, cf_appq, postgres_db, spc, log_level)
+        hot_swap = EmbeddingHotSwap(retrain_job.store, make_embedder, make_vector_db, retrain_job.collection_prefix,
+                                    poll_seconds=cf_versioning['poll_seconds'], log_level=log_level)
+
+    if cf_gpt_model_to_use == 'chatgpt':
+        chatgpt_api_timing_delay = cf_appq['gpt_model_constants'][cf_gpt_model_to_use]['chatgpt_api_timing_delay']
+        gpt_model = ChatGpt(gpt_model_str, model_path, chatgpt_api_timing_delay, log_level)
+    elif cf_gpt_model_to_use == 'instruct':
+        from modeling_clusterization.instruct_models import InstructGptModel  # torch is only needed for this model
+        cf_instruct = cf['gpt_model_constants']['instruct']
+        gpt_model = InstructGptModel(gpt_model_str, model_path, log_level,
+                                     max_batch_size=cf_instruct['max_batch_size'],
+                                     max_wait_ms=cf_instruct['max_wait_ms'],
+                                     num_threads=cf_instruct['num_threads'],
+                                     max_new_tokens=cf_instruct['max_new_tokens'])
+    else:
+        gpt_model = Gpt4All(gpt_model_str, model_path, log_level,
+                            pool_size=cf['gpt_model_constants']['gpt4all']['pool_size']).warm_up()
+
+    cf_cache = cf['gpt_model_constants']['completion_cache']
+    if cf_cache['enabled']:
+        completion_cache = SqliteCache(data_path / cf_cache['cache_path'],
+                                       ttl_seconds=cf_cache['ttl_days'] * 24 * 3600,
+                                       max_entries=cf_cache['max_entries'], log_level=log_level)
+        gpt_model = CachedGptModel(gpt_model, completion_cache, bypass=cf_cache['bypass'], log_level=log_level)
+
+    app_session = ApplicationSession(postgres_db, spc,
+                                     embed_model, qdrant_db,
+                                     gpt_model, fasttext_training_it_dataset_path,
+                                     log_level, retrain_job=retrain_job, hot_swap=hot_swap,
+                                     pipeline_settings=cf_appq['ingestion']['pipeline'])
+    logger.info(f'Application session created with {cf_gpt_model_to_use} model {gpt_model_str}')
+    return app_session, query_settings
+
+
+def create_prep(cf_appq: Dict, data_path: Path, log_level: str) -> AbstractPrep:
+    """
+    Builds the configured preprocessing backend, without a cache in front of it.
+
+    Args:
+        cf_appq (Dict): application_questions_config.yaml
+        data_path (Path): The data folder the model and lookup table paths are relative to.
+        log_level (str): logger level, can be 'INFO', 'DEBUG', 'WARNING', 'ERROR'
+
+    Returns:
+        AbstractPrep: A RulePrep if preprocessing.backend is 'rules' (with a SpacyPrep for questions with words
+            missing from its table, if preprocessing.rules.unseen_fallback), a SpacyPrep otherwise. Neither loads its
+            model before first use.
+    """
+    cf_spacy = cf_appq['preprocessing']['spacy']
+    cf_rules = cf_appq['preprocessing']['rules']
+    if cf_appq['preprocessing']['backend'] == 'rules' and not cf_rules['unseen_fallback']:
+        return RulePrep(data_path / cf_rules['lookup_path'], log_level, batch_size=cf_spacy['batch_size'],
+                        remove_stop_words=cf_rules['remove_stop_words'])
+    # spacy is only imported for this backend, or as the fallback of the rules
+    from preprocessing.spacy_prep import SpacyPrep
+    spacy_prep = SpacyPrep(log_level, batch_size=cf_spacy['batch_size'], n_process=cf_spacy['n_process'],
+                           model_name=cf_spacy['model'],
+                           model_path=data_path / cf_spacy['model_path'] if cf_spacy['model_path'] else None)
+    if cf_appq['preprocessing']['backend'] == 'rules':
+        return RulePrep(data_path / cf_rules['lookup_path'], log_level, batch_size=cf_spacy['batch_size'],
+                        remove_stop_words=cf_rules['remove_stop_words'], fallback=spacy_prep)
+    return spacy_prep
+
+
+def create_embedding_retrain_job(cf: Dict, cf_appq: Dict, postgres_db: PostgresDatabase, spc: AbstractPrep,
+                                 log_level: str) -> EmbeddingRetrainJob:
+    """
+    Builds the EmbeddingRetrainJob that publishes FastText versions to the store sessions follow.
+
+    Args:
+        cf (Dict): universal_config.yaml
+        cf_appq (Dict): application_questions_config.yaml
+        postgres_db (PostgresDatabase): Source of the questions to re-embed, connected by the caller.
+        spc (AbstractPrep): Cleans the questions before they are embedded.
+        log_level (str): logger level, can be 'INFO', 'DEBUG', 'WARNING', 'ERROR'
+
+    Returns:
+        EmbeddingRetrainJob: The job, not started.
+    """
+    cf_embedding = cf_appq['embedding']
+    cf_versioning = cf_embedding['versioning']
+    store = ArtifactStore(Path(os.getenv('PARENT_FOLDER_PATH')) / 'data' / cf_versioning['store_path'],
+                          log_level=log_level)
+    cf_projection = cf_embedding['projection']
+    collection_prefix, vec_size = os.getenv('QDRANT_QUESTIONS_TABLE_NAME'), cf['database']['qdrant']['vec_size']
+    projection = None
+    if cf_projection['enabled']:
+        collection_prefix += f'_{cf_projection["method"]}{cf_projection["dims"]}'
+        vec_size = cf_projection['dims']
+        projection = {'method': cf_projection['method'], 'dims': cf_projection['dims'],
+                      'fit_sample': cf_projection['fit_sample']}
+    if cf_appq['preprocessing']['backend'] == 'rules':
+        collection_prefix += '_rules'
+    return EmbeddingRetrainJob(store, postgres_db, spc, collection_prefix, vec_size=vec_size,
+                               epochs=cf_versioning['epochs'], min_count=cf_versioning['min_count'],
+                               workers=cf_embedding['fasttext']['workers'],
+                               load_mode=cf_embedding['fasttext']['load_mode'],
+                               quantization=cf_embedding['fasttext']['quantization'], projection=projection,
+                               keep_versions=cf_versioning['keep_versions'],
+                               pipeline_settings=cf_appq['ingestion']['pipeline'], log_level=log_level)
@@ -0,0 +1,122 @@
+import fcntl
+import json
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from utils.logging_utils import create_logger
+
+
+class ArtifactStore:
+    """
+    Versioned model artifacts on disk with an atomically updated pointer to the version in use.
+
+    Layout:
+        root/versions/<version>/...        one folder per trained version, never modified once published
+        root/versions/<version>/manifest.json
+        root/CURRENT                       name of the published version
+        root/<name>.lock                   lock files, see lock()
+
+    A version is built in its own folder and published by replacing CURRENT with os.replace, so readers see either
+    the old or the new version and never a partially written one. Processes that serve the model poll
+    current_version() and switch when it changes.
+    """
+
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, root: Path, log_level: str = 'INFO'):
+        """
+        Args:
+            root (Path): Folder of the store, created if needed.
+            log_level (str): logger level, can be 'INFO', 'DEBUG', 'WARNING', 'ERROR'
+        """
+        self.root = Path(root)
+        self.versions_path = self.root / 'versions'
+        self.current_path = self.root / 'CURRENT'
+        self.logger = create_logger(log_level, log_name='ArtifactStore')
+        self.versions_path.mkdir(parents=True, exist_ok=True)
+
+    def new_version(self) -> str:
+        """Creates the folder of a new, unpublished version and returns its name. Names sort by creation time."""
+        version = f'{time.strftime("%Y%m%dT%H%M%S")}-{uuid.uuid4().hex[:6]}'
+        self.version_path(version).mkdir(parents=True)
+        return version
+
+    def version_path(self, version: str) -> Path:
+        return self.versions_path / version
+
+    def current_version(self) -> Optional[str]:
+        """The published version, None if nothing has been published yet."""
+        try:
+            return self.current_path.read_text().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def current_path_of(self, filename: str) -> Optional[Path]:
+        """Path of a file of the published version, None if nothing has been published yet."""
+        version = self.current_version()
+        return None if version is None else self.version_path(version) / filename
+
+    def write_manifest(self, version: str, manifest: Dict):
+        path = self.version_path(version) / self.MANIFEST
+        path.write_text(json.dumps({'version': version, **manifest}, indent=2))
+
+    def manifest(self, version: str) -> Dict:
+        path = self.version_path(version) / self.MANIFEST
+        return json.loads(path.read_text()) if path.exists() else {'version': version}
+
+    def publish(self, version: str):
+        """Points CURRENT at `version`."""
+        if not self.version_path(version).is_dir():
+            raise FileNotFoundError(f'Version {version} does not exist in {self.versions_path}')
+        tmp = self.root / f'CURRENT.tmp{os.getpid()}'
+        tmp.write_text(version)
+        os.replace(tmp, self.current_path)
+        self.logger.info(f'Published version {version}')
+
+    @contextmanager
+    def lock(self, name: str, blocking: bool = True) -> Iterator[bool]:
+        """
+        Exclusive lock shared by every process using the store, e.g. all gunicorn workers. It is an flock on
+        root/<name>.lock, released when the block exits or the process dies.
+
+        Args:
+            name (str): Name of the lock.
+            blocking (bool): Wait for the lock if another process holds it, otherwise give up at once.
+
+        Yields:
+            bool: True if the lock is held, False if blocking is False and another process holds it.
+        """
+        with open(self.root / f'{name}.lock', 'a') as file:
+            try:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+    def versions(self) -> List[str]:
+        """All versions, oldest first."""
+        return sorted(path.name for path in self.versions_path.iterdir() if path.is_dir())
+
+    def prune(self, keep: int = 3) -> List[str]:
+        """
+        Deletes the oldest versions, keeping the newest `keep` ones and always the published one.
+
+        Returns:
+            List[str]: The deleted versions.
+        """
+        current = self.current_version()
+        deleted = [version for version in self.versions()[:-keep] if version != current] if keep else []
+        for version in deleted:
+            shutil.rmtree(self.version_path(version), ignore_errors=True)
+        if deleted:
+            self.logger.info(f'Pruned versions {deleted}')
+        return deleted
@@ -0,0 +1,93 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+
+    The bucket holds up to `capacity` tokens and refills continuously at `refill_per_second`. Callers block in
+    acquire() until enough tokens are available. The level may go negative through consume(), which is used to
+    settle the difference between an estimated and an actual cost after the fact.
+    """
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        """
+        Args:
+            capacity (float): Maximum number of tokens the bucket can hold (burst size).
+            refill_per_second (float): Number of tokens added to the bucket per second.
+        """
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+        self.level = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.refill_per_second)
+        self.updated = now
+
+    def acquire(self, amount: float = 1.0):
+        """
+        Blocks until `amount` tokens are available and takes them. Requests larger than the capacity are capped
+        at the capacity, so a single oversized request waits for a full bucket instead of forever.
+        """
+        amount = min(float(amount), self.capacity)
+        while True:
+            with self.lock:
+                self._refill()
+                if self.level >= amount:
+                    self.level -= amount
+                    return
+                wait = (amount - self.level) / self.refill_per_second
+            time.sleep(wait)
+
+    def consume(self, amount: float):
+        """Takes (or with a negative amount returns) tokens without waiting."""
+        with self.lock:
+            self._refill()
+            self.level = min(self.capacity, self.level - float(amount))
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute budget shared by every thread that calls an API.
+
+    Either budget can be None, in which case it is not enforced. pause() stops all callers for a while, which is
+    how a server-side `Retry-After` is applied to every request in flight rather than only to the one that got it.
+    """
+
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None):
+        """
+        Args:
+            requests_per_minute (float): Request budget per minute, None for unlimited.
+            tokens_per_minute (float): Token budget per minute, None for unlimited.
+        """
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60) if tokens_per_minute else None
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def pause(self, seconds: float):
+        """Holds back every caller of acquire() for at least `seconds`."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def acquire(self, tokens: float = 0):
+        """Blocks until one request and `tokens` tokens fit into the budget."""
+        while True:
+            with self.lock:
+                wait = self.paused_until - time.monotonic()
+            if wait <= 0:
+                break
+            time.sleep(wait)
+        if self.requests is not None:
+            self.requests.acquire(1)
+        if self.tokens is not None and tokens:
+            self.tokens.acquire(tokens)
+
+    def settle(self, estimated_tokens: float, actual_tokens: float):
+        """Corrects the token budget once the real usage of a request is known."""
+        if self.tokens is not None:
+            self.tokens.consume(actual_tokens - estimated_tokens)
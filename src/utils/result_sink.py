@@ -0,0 +1,232 @@
+import json
+import os
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Set
+
+import pandas as pd
+
+from utils.logging_utils import create_logger
+
+
+class BufferedResultSink:
+    """
+    Streaming writer for pipeline results with a checkpoint of the processed ids.
+
+    Rows are buffered in memory and flushed when `batch_size` rows are waiting or `flush_interval` seconds have
+    passed since the last flush. Every flush is committed in two steps: the data is written and fsynced, then a line
+    with the ids of the flushed rows is appended to the checkpoint file. On start-up the sink reads the checkpoint
+    back and throws away data that was written after the last committed line, so a crashed or killed run resumes
+    exactly where it stopped and `processed_ids` tells the caller which rows not to pay for again. If committed data
+    is missing from the output (the csv was deleted or replaced by a shorter one, a part file was removed), the sink
+    raises instead of treating those rows as processed; restore the output or delete the checkpoint to start over.
+
+    Output formats:
+        csv: a single csv file, every flush appends to it. The checkpoint records the committed file size.
+        parquet: a folder of part files, every flush writes a new part file atomically (temp file + rename).
+            The checkpoint records the committed part names. Needs pyarrow.
+
+    Attributes:
+        output_path (Path): Csv file or parquet folder the results are written to.
+        checkpoint_path (Path): Checkpoint file, defaults to the output path with a '.checkpoint' suffix.
+        id_column (str): Column that uniquely identifies a row.
+        processed_ids (Set[str]): Ids of every row committed so far, including previous runs.
+    """
+
+    def __init__(self, output_path: Path, id_column: str, checkpoint_path: Path = None, batch_size: int = 64,
+                 flush_interval: float = 30.0, file_format: str = None,
+                 legacy_ids: Callable[[pd.DataFrame], Iterable[str]] = None, log_level: str = 'INFO'):
+        """
+        Args:
+            output_path (Path): Csv file or parquet folder the results are written to.
+            id_column (str): Column that uniquely identifies a row.
+            checkpoint_path (Path): Checkpoint file, defaults to the output path with a '.checkpoint' suffix.
+            batch_size (int): Number of buffered rows that triggers a flush.
+            flush_interval (float): Seconds after which buffered rows are flushed on the next write. There is no timer:
+                rows wait in the buffer until the next write, flush or close.
+            file_format (str): 'csv' or 'parquet', inferred from the output path suffix if not given.
+            legacy_ids (Callable): Derives the ids of the rows of a csv written before checkpoints existed that has no
+                id column, from the csv read with dtype=str. The csv is moved aside (to a '.legacy' file) and those ids
+                are committed, so its rows are not processed again. Without it they are processed again.
+            log_level (str): logger level, can be 'INFO', 'DEBUG', 'WARNING', 'ERROR'
+        """
+        self.output_path = Path(output_path)
+        self.id_column = id_column
+        self.checkpoint_path = Path(checkpoint_path) if checkpoint_path else \
+            self.output_path.with_name(self.output_path.name + '.checkpoint')
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.file_format = file_format or ('parquet' if self.output_path.suffix == '.parquet' else 'csv')
+        self.legacy_ids = legacy_ids
+        self.logger = create_logger(log_level, log_name='BufferedResultSink')
+
+        self.buffer: List[Dict] = []
+        self.columns: List[str] = None
+        self.processed_ids: Set[str] = set()
+        self.committed = 0 if self.file_format == 'csv' else []
+        self.last_flush = time.monotonic()
+        self._recover()
+
+    def _recover(self):
+        """Reads the checkpoint and rolls the output back to the last committed flush."""
+        if self.checkpoint_path.exists():
+            good_size = 0
+            with open(self.checkpoint_path, 'rb') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # torn last line of a killed run
+                    good_size += len(line)
+                    self.processed_ids.update(record['ids'])
+                    if self.file_format == 'csv':
+                        self.committed = record['committed']
+                    else:
+                        self.committed.append(record['committed'])
+            with open(self.checkpoint_path, 'r+b') as file:
+                file.truncate(good_size)
+        elif self.file_format == 'csv':
+            legacy_path = self.output_path.with_name(self.output_path.name + '.legacy')
+            if self.output_path.exists() and self.output_path.stat().st_size > 0:
+                # results written before checkpoints existed: adopt them as committed if they carry ids
+                if self.id_column in pd.read_csv(self.output_path, nrows=0).columns:
+                    self.processed_ids.update(pd.read_csv(self.output_path, usecols=[self.id_column])[self.id_column]
+                                              .astype(str))
+                    self.committed = self.output_path.stat().st_size
+                    self._append_checkpoint(self.committed, sorted(self.processed_ids))
+                else:
+                    self.logger.warning(f'{self.output_path} has no {self.id_column} column, moving it to {legacy_path}')
+                    os.replace(self.output_path, legacy_path)
+            if not self.checkpoint_path.exists() and self.legacy_ids is not None and legacy_path.exists():
+                # seeded after the move, so a run killed in between seeds on its next start instead of truncating
+                legacy_ids = sorted(set(str(i) for i in self.legacy_ids(
+                    pd.read_csv(legacy_path, dtype=str, keep_default_na=False))))
+                self._append_checkpoint(0, legacy_ids)
+                self.processed_ids.update(legacy_ids)
+                self.logger.warning(f'Committed the ids of the {len(legacy_ids)} rows of {legacy_path}, '
+                                    f'they are not processed again')
+
+        self._check_output()
+        if self.file_format == 'csv':
+            if self.output_path.exists() and self.output_path.stat().st_size > self.committed:
+                self.logger.warning(f'Discarding uncommitted rows at the end of {self.output_path}')
+                with open(self.output_path, 'r+b') as file:
+                    file.truncate(self.committed)
+            if self.output_path.exists() and self.committed > 0:
+                self.columns = pd.read_csv(self.output_path, nrows=0).columns.tolist()
+        elif self.output_path.exists():
+            for part in self.output_path.iterdir():
+                if part.name not in self.committed:
+                    self.logger.warning(f'Discarding uncommitted part file {part}')
+                    part.unlink()
+        self.logger.info(f'{len(self.processed_ids)} rows already committed to {self.output_path}')
+
+    def _check_output(self):
+        """
+        Fails if committed data is gone from the output, i.e. it was deleted or replaced behind the checkpoint's back.
+        Rolling back or appending would then lose rows, or add rows without a header, while their ids stay committed.
+        """
+        if self.file_format == 'csv':
+            if not self.committed:
+                return
+            if not self.output_path.exists():
+                raise FileNotFoundError(f'{self.checkpoint_path} commits {self.committed} bytes of {self.output_path}, '
+                                        f'which does not exist. Restore it, or delete the checkpoint to start over')
+            size = self.output_path.stat().st_size
+            if size < self.committed:
+                raise ValueError(f'{self.checkpoint_path} commits {self.committed} bytes of {self.output_path}, which '
+                                 f'has {size}. Restore it, or delete the checkpoint to start over')
+            if self.id_column not in pd.read_csv(self.output_path, nrows=0).columns:
+                raise ValueError(f'{self.output_path} has no {self.id_column} column, it is not the output '
+                                 f'{self.checkpoint_path} commits to. Restore it, or delete the checkpoint to start over')
+        else:
+            lost = [part for part in self.committed if not (self.output_path / part).exists()]
+            if lost:
+                raise FileNotFoundError(f'{self.checkpoint_path} commits {len(lost)} part files that are missing from '
+                                        f'{self.output_path}, e.g. {lost[0]}. Restore them, or delete the checkpoint '
+                                        f'to start over')
+
+    @staticmethod
+    def read_checkpoint_ids(checkpoint_path: Path) -> Set[str]:
+        """
+        Reads the ids committed to a checkpoint file without touching the output, e.g. to skip finished work upstream.
+
+        Args:
+            checkpoint_path (Path): Checkpoint file written by a BufferedResultSink.
+
+        Returns:
+            Set[str]: The committed ids, empty if there is no checkpoint yet.
+        """
+        ids = set()
+        if Path(checkpoint_path).exists():
+            with open(checkpoint_path, 'rb') as file:
+                for line in file:
+                    try:
+                        ids.update(json.loads(line)['ids'])
+                    except ValueError:
+                        break
+        return ids
+
+    def _append_checkpoint(self, committed, ids: List[str]):
+        """Appends one commit record: the csv size or parquet part name that the ids were written to."""
+        with open(self.checkpoint_path, 'a') as file:
+            file.write(json.dumps({'committed': committed, 'ids': ids}) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+
+    def write(self, row: Dict):
+        """Buffers one result row, flushing if the batch is full or the flush interval has passed."""
+        self.buffer.append(row)
+        if len(self.buffer) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def write_many(self, rows: Iterable[Dict]):
+        """Buffers several result rows. A DataFrame is accepted as well."""
+        if isinstance(rows, pd.DataFrame):
+            rows = rows.to_dict('records')
+        for row in rows:
+            self.write(row)
+
+    def flush(self):
+        """Writes the buffered rows and commits their ids to the checkpoint."""
+        self.last_flush = time.monotonic()
+        if not self.buffer:
+            return
+        df = pd.DataFrame(self.buffer)
+        if self.columns is None:
+            self.columns = df.columns.tolist()
+        df = df.reindex(columns=self.columns)
+        ids = df[self.id_column].astype(str).tolist()
+
+        self._check_output()
+        if self.file_format == 'csv':
+            self.output_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.output_path, 'a', newline='', encoding='utf-8') as file:
+                df.to_csv(file, header=self.committed == 0, index=False)
+                file.flush()
+                os.fsync(file.fileno())
+                self.committed = file.tell()
+            commit_record = self.committed
+        else:
+            self.output_path.mkdir(parents=True, exist_ok=True)
+            part_name = f'part-{len(self.committed):05d}.parquet'
+            tmp_path = self.output_path / f'.{part_name}.tmp'
+            df.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, self.output_path / part_name)
+            self.committed.append(part_name)
+            commit_record = part_name
+
+        self._append_checkpoint(commit_record, ids)
+        self.processed_ids.update(ids)
+        self.buffer = []
+        self.logger.info(f'Committed {len(ids)} rows to {self.output_path}')
+
+    def close(self):
+        """Flushes whatever is still buffered."""
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
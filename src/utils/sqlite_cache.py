@@ -0,0 +1,187 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from utils.logging_utils import create_logger
+
+
+class SqliteCache:
+    """
+    Persistent key-value cache stored in a single SQLite file.
+
+    Entries expire `ttl_seconds` after they were written; expired entries are never returned. Eviction is amortized
+    rather than run on every write: every `evict_every` writes, or as soon as the cache grows past `max_entries` or
+    `max_bytes`, expired entries are deleted and then the least recently read ones, down to `evict_to` of the limits
+    so that the next writes don't trigger it again. Read times are not written on every hit either, they are
+    buffered and written `access_flush_size` at a time (and before every eviction), so a hit is a single indexed
+    read. Hits and misses are counted per instance.
+    One connection is shared by all threads of the process and guarded by a lock.
+    """
+
+    def __init__(self, path: Path, ttl_seconds: float = None, max_entries: int = None, max_bytes: int = None,
+                 evict_every: int = 1000, evict_to: float = 0.9, access_flush_size: int = 256,
+                 log_level: str = 'INFO'):
+        """
+        Args:
+            path (Path): Location of the SQLite file, parent folders are created if needed.
+            ttl_seconds (float): Lifetime of an entry, None keeps entries until they are evicted.
+            max_entries (int): Maximum number of entries, None for unbounded.
+            max_bytes (int): Maximum total size of the stored values, None for unbounded.
+            evict_every (int): Writes between two evictions when the limits are not crossed.
+            evict_to (float): Share of max_entries and max_bytes an eviction brings the cache down to.
+            access_flush_size (int): Buffered read times written together.
+            log_level (str): logger level, can be 'INFO', 'DEBUG', 'WARNING', 'ERROR'
+        """
+        self.path = Path(path)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.evict_every = evict_every
+        self.evict_to = evict_to
+        self.access_flush_size = access_flush_size
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self._accessed = {}  # key -> read time not written yet
+        self._writes = 0  # writes since the last eviction
+        self.logger = create_logger(log_level, log_name='SqliteCache')
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS cache (
+            key TEXT PRIMARY KEY,
+            value BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            accessed_at REAL NOT NULL)""")
+        self.conn.execute('CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS cache_created_at ON cache (created_at)')
+        self.conn.commit()
+        # upper bounds of the size of the cache between evictions, other processes may write to it too
+        self._entries, self._bytes = self.conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache').fetchone()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Returns the value stored under `key`, or None if it is missing or expired.
+        """
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute('SELECT value, created_at FROM cache WHERE key = ?', (key,)).fetchone()
+            if row is None or (self.ttl_seconds is not None and now - row[1] > self.ttl_seconds):
+                self.misses += 1  # expired entries are deleted by the next eviction
+                return None
+            self._touch([key], now)
+            self.hits += 1
+            return row[0]
+
+    def get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        """
+        Returns the values of the keys that are cached and not expired, in one transaction.
+        """
+        now = time.time()
+        found = {}
+        with self.lock:
+            for start in range(0, len(keys), 500):  # stay below sqlite's limit on query parameters
+                chunk = keys[start:start + 500]
+                rows = self.conn.execute(f'SELECT key, value, created_at FROM cache WHERE key IN '
+                                         f'({",".join("?" * len(chunk))})', chunk).fetchall()
+                found.update({key: value for key, value, created_at in rows
+                              if self.ttl_seconds is None or now - created_at <= self.ttl_seconds})
+            self._touch(found, now)
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, items: Dict[str, bytes]):
+        """
+        Stores several values in one transaction, then evicts as in `set`.
+        """
+        now = time.time()
+        rows = [(key, value.encode('utf-8') if isinstance(value, str) else value) for key, value in items.items()]
+        with self.lock:
+            self.conn.executemany('INSERT OR REPLACE INTO cache (key, value, size, created_at, accessed_at) '
+                                  'VALUES (?, ?, ?, ?, ?)', [(key, value, len(value), now, now) for key, value in rows])
+            self._written(len(rows), sum(len(value) for key, value in rows))
+            self.conn.commit()
+
+    def set(self, key: str, value: bytes):
+        """
+        Stores `value` under `key`, evicting expired and least recently read entries every `evict_every` writes or
+        when the cache is over its limits.
+        """
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        now = time.time()
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO cache (key, value, size, created_at, accessed_at) '
+                              'VALUES (?, ?, ?, ?, ?)', (key, value, len(value), now, now))
+            self._written(1, len(value))
+            self.conn.commit()
+
+    def _touch(self, keys, now: float):
+        """Buffers the read time of the keys, and writes the buffer when it is full. Called with the lock held."""
+        self._accessed.update((key, now) for key in keys)
+        if len(self._accessed) >= self.access_flush_size:
+            self._flush_accessed()
+            self.conn.commit()
+
+    def _flush_accessed(self):
+        """Writes the buffered read times. Called with the lock held."""
+        if self._accessed:
+            self.conn.executemany('UPDATE cache SET accessed_at = ? WHERE key = ?',
+                                  [(accessed, key) for key, accessed in self._accessed.items()])
+            self._accessed = {}
+
+    def _written(self, entries: int, size: int):
+        """Counts a write and evicts when it is due. Called with the lock held."""
+        self._writes += entries
+        self._entries += entries
+        self._bytes += size
+        if (self._writes >= self.evict_every or (self.max_entries is not None and self._entries > self.max_entries)
+                or (self.max_bytes is not None and self._bytes > self.max_bytes)):
+            self._evict()
+
+    def _evict(self):
+        """Deletes expired entries and then the least recently read ones down to evict_to of the limits."""
+        self._flush_accessed()
+        if self.ttl_seconds is not None:
+            self.conn.execute('DELETE FROM cache WHERE created_at < ?', (time.time() - self.ttl_seconds,))
+        if self.max_entries is not None:
+            self.conn.execute('DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at DESC '
+                              'LIMIT -1 OFFSET ?)', (int(self.max_entries * self.evict_to),))
+        self._entries, self._bytes = self.conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache').fetchone()
+        if self.max_bytes is not None and self._bytes > self.max_bytes:
+            target = self.max_bytes * self.evict_to
+            keys = []
+            for key, size in self.conn.execute('SELECT key, size FROM cache ORDER BY accessed_at'):
+                if self._bytes <= target:
+                    break
+                keys.append((key,))
+                self._bytes -= size
+            self.conn.executemany('DELETE FROM cache WHERE key = ?', keys)
+            self._entries -= len(keys)
+        self._writes = 0
+
+    def clear(self):
+        """Deletes every entry."""
+        with self.lock:
+            self.conn.execute('DELETE FROM cache')
+            self.conn.commit()
+            self._accessed = {}
+            self._entries, self._bytes, self._writes = 0, 0, 0
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: hits, misses, hit_rate, number of entries and their total size in bytes
+        """
+        with self.lock:
+            self._flush_accessed()
+            self.conn.commit()
+            entries, size = self.conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache').fetchone()
+        requests = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / requests if requests else 0.0,
+                'entries': entries, 'bytes': size}
@@ -0,0 +1,105 @@
+import hashlib
+from typing import Any, Callable, Dict, Hashable, List, Sequence, Tuple
+
+from utils.lru_cache import LRUCache
+from utils.sqlite_cache import SqliteCache
+
+
+class TieredCache:
+    """
+    Memoizes a batch computation in two tiers: a bounded in-process LRUCache, with an optional persistent SqliteCache
+    behind it that survives restarts and is shared by the workers of a host.
+
+    Entries belong to a version of whatever computes them (a model, a lookup table, cleaning rules). Disk entries are
+    keyed by the version and a hash of the key, so switching to another version makes the entries of the old one
+    unreachable (they age out by eviction); the memory tier is emptied. Used by CachedPrep and CachedEmbedder.
+
+    Attributes:
+        memory (LRUCache): In-process tier, key -> value.
+        disk (SqliteCache): Optional persistent tier, version and key hash -> encoded value.
+        version (str): Version the cached values belong to.
+    """
+
+    def __init__(self, version: str, encode: Callable[[Any], bytes], decode: Callable[[bytes], Any],
+                 key_text: Callable[[Hashable], str] = str, max_entries: int = 10000, disk: SqliteCache = None):
+        """
+        Args:
+            version (str): Version the cached values belong to.
+            encode (Callable): Turns a value into the bytes stored on disk.
+            decode (Callable): Turns the bytes stored on disk back into a value.
+            key_text (Callable): Turns a key into the text that is hashed for the disk key.
+            max_entries (int): Size of the in-process tier.
+            disk (SqliteCache): Persistent tier, None keeps the cache in memory only.
+        """
+        self.version = version
+        self.encode = encode
+        self.decode = decode
+        self.key_text = key_text
+        self.memory = LRUCache(max_entries)
+        self.disk = disk
+        self.disk_hits = 0
+
+    def set_version(self, version: str) -> bool:
+        """
+        Switches to another version, dropping the memory tier.
+
+        Returns:
+            bool: True if the version changed.
+        """
+        if version == self.version:
+            return False
+        self.version = version
+        self.memory.clear()
+        return True
+
+    def disk_key(self, key: Hashable) -> str:
+        return f'{self.version}:{hashlib.sha256(self.key_text(key).encode("utf-8")).hexdigest()}'
+
+    def get_many(self, keys: Sequence[Hashable],
+                 compute: Callable[[List[Hashable]], Sequence[Any]]) -> Tuple[Dict[Hashable, Any], int]:
+        """
+        Values of the keys, looked up in memory, then on disk, and computed for the keys found in neither, each
+        distinct one once. Computed values are stored in both tiers.
+
+        Args:
+            keys (Sequence[Hashable]): The keys, duplicates are allowed.
+            compute (Callable): Computes the values of a list of keys, in the same order.
+
+        Returns:
+            Tuple[Dict, int]: The value of every distinct key, and the number of keys that were computed.
+        """
+        values = {}
+        for key in dict.fromkeys(keys):
+            value = self.memory.get(key)
+            if value is not None:
+                values[key] = value
+        missing = [key for key in dict.fromkeys(keys) if key not in values]
+
+        if missing and self.disk is not None:
+            disk_keys = {self.disk_key(key): key for key in missing}
+            for disk_key, encoded in self.disk.get_many(list(disk_keys)).items():
+                values[disk_keys[disk_key]] = self.decode(encoded)
+                self.memory.set(disk_keys[disk_key], values[disk_keys[disk_key]])
+                self.disk_hits += 1
+            missing = [key for key in missing if key not in values]
+
+        if missing:
+            computed = compute(missing)
+            for key, value in zip(missing, computed):
+                values[key] = value
+                self.memory.set(key, value)
+            if self.disk is not None:
+                self.disk.set_many({self.disk_key(key): self.encode(value) for key, value in zip(missing, computed)})
+        return values, len(missing)
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: version, memory tier hits, disk tier hits, misses that were computed, overall hit rate and the
+                number of entries in memory
+        """
+        lookups = self.memory.hits + self.memory.misses
+        misses = self.memory.misses - self.disk_hits
+        return {'version': self.version, 'memory_hits': self.memory.hits, 'disk_hits': self.disk_hits,
+                'misses': misses, 'hit_rate': (lookups - misses) / lookups if lookups else 0.0,
+                'memory_entries': len(self.memory)}
@@ -0,0 +1,102 @@
+import re
+from typing import List, Dict
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional, fall back to a character based estimate
+    tiktoken = None
+
+# rough average for English text with OpenAI tokenizers, used when tiktoken isn't installed
+CHARS_PER_TOKEN = 4
+# per-message overhead of the chat format (role, separators)
+TOKENS_PER_MESSAGE = 4
+
+_encodings = {}
+
+
+def _encoding(model_str: str):
+    """Returns a cached tiktoken encoding for the model, or None if tiktoken is unavailable."""
+    if tiktoken is None:
+        return None
+    if model_str not in _encodings:
+        try:
+            _encodings[model_str] = tiktoken.encoding_for_model(model_str)
+        except KeyError:
+            _encodings[model_str] = tiktoken.get_encoding('cl100k_base')
+    return _encodings[model_str]
+
+
+def count_tokens(text: str, model_str: str = 'gpt-3.5-turbo') -> int:
+    """
+    Counts the tokens in a piece of text.
+
+    Args:
+        text (str): Text to measure.
+        model_str (str): Model whose tokenizer should be used.
+
+    Returns:
+        int: Exact token count when tiktoken is installed, otherwise an estimate.
+    """
+    encoding = _encoding(model_str)
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN + 1
+    return len(encoding.encode(text))
+
+
+def count_message_tokens(messages: List[Dict[str, str]], model_str: str = 'gpt-3.5-turbo') -> int:
+    """
+    Counts the prompt tokens of a list of chat messages.
+
+    Args:
+        messages (List[Dict[str, str]]): Chat messages with 'role' and 'content' keys.
+        model_str (str): Model whose tokenizer should be used.
+
+    Returns:
+        int: Number of prompt tokens, including the chat format overhead.
+    """
+    return sum(count_tokens(message['content'], model_str) + TOKENS_PER_MESSAGE for message in messages) + 3
+
+
+def split_text_by_tokens(text: str, max_tokens: int, model_str: str = 'gpt-3.5-turbo') -> List[str]:
+    """
+    Splits text into chunks of at most `max_tokens` tokens. Chunks are cut at paragraph and sentence boundaries
+    where possible; a single sentence longer than the budget is cut between words.
+
+    Args:
+        text (str): Text to split.
+        max_tokens (int): Token budget per chunk.
+        model_str (str): Model whose tokenizer should be used.
+
+    Returns:
+        List[str]: The chunks, in the order of the text.
+    """
+    pieces = []
+    for paragraph in re.split(r'\n\s*\n|\n', text):
+        for sentence in re.split(r'(?<=[.!?;])\s+', paragraph.strip()):
+            if not sentence:
+                continue
+            if count_tokens(sentence, model_str) <= max_tokens:
+                pieces.append(sentence)
+                continue
+            part, part_tokens = [], 0
+            for word in sentence.split():
+                word_tokens = count_tokens(' ' + word, model_str)
+                if part and part_tokens + word_tokens > max_tokens:
+                    pieces.append(' '.join(part))
+                    part, part_tokens = [], 0
+                part.append(word)
+                part_tokens += word_tokens
+            if part:
+                pieces.append(' '.join(part))
+
+    chunks, chunk, chunk_tokens = [], [], 0
+    for piece in pieces:
+        piece_tokens = count_tokens(piece, model_str) + 1
+        if chunk and chunk_tokens + piece_tokens > max_tokens:
+            chunks.append(' '.join(chunk))
+            chunk, chunk_tokens = [], 0
+        chunk.append(piece)
+        chunk_tokens += piece_tokens
+    if chunk:
+        chunks.append(' '.join(chunk))
+    return chunks
@@ -0,0 +1,376 @@
+"""
+Offline latency benchmark for ApplicationSession.
+
+Drives upsert_q_to_vec and query_tune_answer with a synthetic question corpus against in-process stand-ins for
+Postgres, Qdrant and the gpt backends. spaCy and FastText are the real components, so their timings are meaningful;
+the databases are brute force numpy and dicts, and generation is a fixed sleep.
+
+Run it from the repo root with
+    PYTHONPATH=src python src/validation/benchmark_application_session.py --questions 2000 --queries 200 \
+        --output benchmark_results/application_session.json
+and compare two runs with
+    PYTHONPATH=src python src/validation/benchmark_application_session.py --compare old.json new.json
+"""
+import argparse
+import json
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+from yaml import safe_load
+
+from modeling_clusterization.embedding import FastTextModel
+from modeling_clusterization.gpt_models import abstractGptModel
+from preprocessing.spacy_prep import SpacyPrep
+from sessions.application_session import ApplicationSession
+
+SKILLS = ['customer service', 'python', 'sql', 'project management', 'sales', 'accounting', 'java', 'marketing',
+          'data analysis', 'excel', 'team leadership', 'cloud infrastructure', 'machine learning', 'logistics',
+          'technical support', 'recruiting', 'copywriting', 'quality assurance', 'budgeting', 'negotiation']
+QUESTION_TEMPLATES = ['Do you have experience in {skill}?',
+                      'How many years of {skill} experience do you have?',
+                      'Describe a project where you used {skill}.',
+                      'Are you comfortable working with {skill} on a daily basis?',
+                      'What is your proficiency level in {skill}?',
+                      'Have you ever trained others in {skill}?',
+                      'Why are you interested in a role that requires {skill}?']
+ANSWER_TEMPLATES = ['Yes, I have {years} years of experience with {skill}.',
+                    'I used {skill} daily in my last position for {years} years.',
+                    'I would rate myself as advanced in {skill}, with {years} years of practice.']
+
+# method name -> stage name, per component. The upsert streams questions through iter_questions and
+# iter_prep_sentences in the pipeline's threads, its fetch and prep stages are taken from the pipeline statistics
+# (UPSERT_STAGES), so spacy_prep and qa_lookup are the query side only
+STAGES = {
+    'spc': {'prep_sentences_to_list_of_lists': 'spacy_prep'},
+    'embed_model': {'liststr_to_listvec': 'fasttext_embed', 'liststr_to_matrix': 'fasttext_embed'},
+    'qdrant_db': {'insert_rows': 'vector_upsert', 'bulk_insert': 'vector_upsert', 'query_app_q': 'vector_search'},
+    'postgres_db': {'query_answers_question_id': 'qa_lookup'},
+    'gpt_model': {'gpt_prompt_return': 'generation', 'gpt_prompt_return_n': 'generation',
+                  'gpt_prompt_return_many': 'generation'},
+}
+# pipeline stage -> stage name, the busy seconds of every stage of the upsert pipeline
+UPSERT_STAGES = {'fetch': 'upsert_fetch', 'prep': 'upsert_prep', 'embed': 'upsert_embed', 'upsert': 'upsert_write'}
+
+
+def make_question_corpus(n_questions: int, seed: int = 0) -> List[Tuple[str, str]]:
+    """
+    Generates synthetic application questions with matching answers.
+
+    Args:
+        n_questions (int): Number of question-answer pairs.
+        seed (int): Random seed, the same seed gives the same corpus.
+
+    Returns:
+        List[Tuple[str, str]]: (question, answer) pairs.
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(n_questions):
+        skill = rng.choice(SKILLS)
+        question = rng.choice(QUESTION_TEMPLATES).format(skill=skill)
+        if i >= len(SKILLS) * len(QUESTION_TEMPLATES):  # past the distinct templates, vary the wording
+            question = f'{question} Please mention {rng.choice(SKILLS)} if relevant.'
+        corpus.append((question, rng.choice(ANSWER_TEMPLATES).format(skill=skill, years=rng.randint(1, 15))))
+    return corpus
+
+
+class StageTimer:
+    """Collects wall clock durations per stage."""
+
+    def __init__(self):
+        self.durations = defaultdict(list)
+
+    def record(self, stage: str, seconds: float):
+        self.durations[stage].append(seconds)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Count, total and latency percentiles in milliseconds for every stage."""
+        summary = {}
+        for stage, durations in sorted(self.durations.items()):
+            ms = np.array(durations) * 1000
+            summary[stage] = {'count': len(ms), 'total_ms': float(ms.sum()), 'mean_ms': float(ms.mean()),
+                              'p50_ms': float(np.percentile(ms, 50)), 'p95_ms': float(np.percentile(ms, 95)),
+                              'max_ms': float(ms.max())}
+        return summary
+
+
+class TimedProxy:
+    """Wraps a component and times the calls of the given methods, everything else is passed through."""
+
+    def __init__(self, component, stage_by_method: Dict[str, str], timer: StageTimer):
+        self._component = component
+        self._stage_by_method = stage_by_method
+        self._timer = timer
+
+    def __getattr__(self, name):
+        attribute = getattr(self._component, name)
+        stage = self._stage_by_method.get(name)
+        if stage is None or not callable(attribute):
+            return attribute
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return attribute(*args, **kwargs)
+            finally:
+                self._timer.record(stage, time.perf_counter() - start)
+        return timed
+
+
+class InMemoryPostgres:
+    """Stand-in for PostgresDatabase that serves the synthetic corpus from memory."""
+
+    def __init__(self, corpus: List[Tuple[str, str]]):
+        self.question_ids = [str(uuid.UUID(int=i + 1)) for i in range(len(corpus))]
+        self.qa_by_id = dict(zip(self.question_ids, corpus))
+
+    def connect(self):
+        return self
+
+    def iter_questions(self, user_id: str = None, chunksize: int = 1000, table_name_forms: str = 'forms_auto_fill',
+                       table_name_questions: str = 'questions'):
+        for i in range(0, len(self.question_ids), chunksize):
+            question_ids = self.question_ids[i:i + chunksize]
+            yield question_ids, [self.qa_by_id[question_id][0] for question_id in question_ids]
+
+    def query_answers_question_id(self, table_name_forms: str = 'forms_auto_fill', table_name_answers: str = 'answers',
+                                  table_name_questions: str = 'questions', question_id: str = None):
+        question, answer = self.qa_by_id[question_id]
+        return answer, question
+
+
+class InMemoryVectorDataBase:
+    """Stand-in for VectorDataBase, exact cosine search over a numpy matrix."""
+
+    def __init__(self, table_name: str = 'benchmark_questions', vec_size: int = 300):
+        self.table_name = table_name
+        self.vec_size = vec_size
+        self.ids = []
+        self.matrix = np.empty((0, vec_size), dtype=np.float32)
+        self.lock = threading.Lock()  # the upsert workers of the pipeline insert concurrently
+
+    def connect(self):
+        return self
+
+    def insert_rows(self, vectors: List[List[float]], id_list: List, key: str = None, key_value=None):
+        self.bulk_insert(vectors, id_list)
+
+    def bulk_insert(self, vectors: np.ndarray, id_list: List, payloads: List[Dict] = None, batch_size: int = 256,
+                    parallel: int = 2, max_retries: int = 3) -> Dict:
+        start = time.perf_counter()
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.vec_size)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        with self.lock:
+            self.matrix = np.vstack([self.matrix, vectors / np.where(norms == 0, 1, norms)])
+            self.ids.extend(id_list)
+        seconds = time.perf_counter() - start
+        return {'points': len(id_list), 'batches': 1, 'retries': 0, 'seconds': seconds,
+                'points_per_second': len(id_list) / seconds if seconds else None}
+
+    def query_app_q(self, query_vector: List[float], key: str = None, key_value: str = None,
+                    limit: int = 1) -> Dict:
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1)
+        scores = self.matrix @ query
+        top = np.argsort(-scores)[:limit]
+        return {self.ids[i]: float(scores[i]) for i in top}
+
+
+class FakeGptModel(abstractGptModel):
+    """Stand-in for the gpt backends, every call sleeps for a fixed latency, alternatives are returned in one call."""
+
+    native_n = True
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.gpt_model_str = 'fake-gpt'
+
+    def gpt_prompt_return(self, prompt: List[Dict[str, str]], **sampling_params) -> Dict:
+        return {'choices': self._choices(1)}
+
+    def gpt_prompt_return_n(self, prompt: List[Dict[str, str]], n: int, **sampling_params) -> List[str]:
+        return [choice['message']['content'] for choice in self._choices(n)]
+
+    def _choices(self, n: int) -> List[Dict]:
+        time.sleep(self.latency)
+        return [{'message': {'role': 'assistant', 'content': f'benchmark answer {i}'}} for i in range(n)]
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_benchmark(n_questions: int = 1000, n_queries: int = 100, gpt_latency: float = 0.0,
+                  answers_per_query: int = 3, train_epochs: int = 5, seed: int = 0,
+                  app_questions_config_path: Path = Path('src/application_questions_config.yaml'),
+                  fasttext_model_path: Path = None, track_allocations: bool = True,
+                  log_level: str = 'WARNING') -> Dict:
+    """
+    Runs the benchmark and returns the results.
+
+    Args:
+        n_questions (int): Size of the synthetic question corpus that is upserted.
+        n_queries (int): Number of query_tune_answer calls.
+        gpt_latency (float): Seconds every fake gpt call takes.
+        answers_per_query (int): gpt_answer_return_limit of every query.
+        train_epochs (int): FastText epochs on the synthetic corpus.
+        seed (int): Random seed for the corpus and the queries.
+        app_questions_config_path (Path): Config with the prompt strings.
+        fasttext_model_path (Path): Use this trained model instead of training one on the synthetic corpus.
+        track_allocations (bool): Trace python allocations with tracemalloc, slows the run down somewhat.
+        log_level (str): Log level of the components.
+
+    Returns:
+        Dict: Configuration, per-stage timings, throughput and peak memory.
+    """
+    with open(app_questions_config_path, 'r') as file:
+        cf_prompts = safe_load(file)['gpt_model_constants']['default_prompt_strings']
+
+    corpus = make_question_corpus(n_questions, seed)
+    rng = random.Random(seed + 1)
+    new_questions = [q for q, _ in make_question_corpus(n_queries, seed + 2)]
+    timer = StageTimer()
+    if track_allocations:
+        tracemalloc.start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        spc = SpacyPrep(log_level=log_level).warm_up()
+        timer.record('spacy_load', time.perf_counter() - start)
+
+        if fasttext_model_path is None:
+            fasttext_model_path = Path(tmp) / 'fasttext.model'
+            start = time.perf_counter()
+            train_sentences = spc.prep_sentences_to_list_of_lists([text for pair in corpus for text in pair])
+            trainer = FastTextModel(fasttext_model_path, epochs=train_epochs, min_count=1, log_level=log_level)
+            trainer.retrain(train_sentences)
+            trainer.save()
+            timer.record('fasttext_train', time.perf_counter() - start)
+            del trainer
+
+        # memory of the serving phases only, training the model above is setup
+        setup_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        if track_allocations:
+            tracemalloc.reset_peak()
+
+        session = ApplicationSession(
+            TimedProxy(InMemoryPostgres(corpus), STAGES['postgres_db'], timer),
+            TimedProxy(spc, STAGES['spc'], timer),
+            TimedProxy(FastTextModel(fasttext_model_path, log_level=log_level), STAGES['embed_model'], timer),
+            TimedProxy(InMemoryVectorDataBase(), STAGES['qdrant_db'], timer),
+            TimedProxy(FakeGptModel(gpt_latency), STAGES['gpt_model'], timer),
+            log_level=log_level)
+
+        start = time.perf_counter()
+        session.initialize_session()
+        timer.record('session_init', time.perf_counter() - start)
+
+        start = time.perf_counter()
+        session.upsert_q_to_vec()
+        upsert_seconds = time.perf_counter() - start
+        timer.record('upsert_total', upsert_seconds)
+        for stage, busy_seconds in session.pipeline_stats['busy_seconds'].items():
+            timer.record(UPSERT_STAGES[stage], busy_seconds)
+
+        query_start = time.perf_counter()
+        for new_question in new_questions:
+            start = time.perf_counter()
+            session.query_tune_answer(cf_prompts['user_string'], cf_prompts['system_string'],
+                                      cf_prompts['substring_to_replace'], cf_prompts['different_answer_user_string'],
+                                      new_question=new_question, hist_qa_return_limit=rng.randint(1, 3),
+                                      gpt_answer_return_limit=answers_per_query)
+            timer.record('query_total', time.perf_counter() - start)
+        query_seconds = time.perf_counter() - query_start
+
+    peak_traced_mb = None
+    if track_allocations:
+        peak_traced_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+
+    return {
+        'meta': {'git_commit': _git_commit(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                 'python': platform.python_version(), 'platform': platform.platform()},
+        'config': {'n_questions': n_questions, 'n_queries': n_queries, 'gpt_latency': gpt_latency,
+                   'answers_per_query': answers_per_query, 'train_epochs': train_epochs, 'seed': seed},
+        'stages': timer.summary(),
+        'upsert_pipeline': session.pipeline_stats,
+        'throughput': {'upserted_questions_per_s': n_questions / upsert_seconds if upsert_seconds else None,
+                       'queries_per_s': n_queries / query_seconds if query_seconds else None},
+        'memory': {'setup_peak_rss_mb': setup_rss_mb,
+                   'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                   'serving_peak_traced_python_mb': peak_traced_mb},
+    }
+
+
+def compare_results(baseline: Dict, current: Dict) -> List[str]:
+    """
+    Lines comparing the mean stage latencies, throughput and memory of two benchmark results.
+
+    Args:
+        baseline (Dict): Result of the earlier run.
+        current (Dict): Result of the later run.
+
+    Returns:
+        List[str]: One line per metric, with the relative change.
+    """
+    def line(name, old, new, unit):
+        if old is None or new is None:
+            return f'{name:<32} {old!s:>12} -> {new!s:>12}'
+        change = (new - old) / old * 100 if old else float('nan')
+        return f'{name:<32} {old:>10.2f}{unit} -> {new:>10.2f}{unit} ({change:+.1f}%)'
+
+    lines = [f"baseline {baseline['meta']['git_commit']} vs current {current['meta']['git_commit']}"]
+    for stage in sorted(set(baseline['stages']) | set(current['stages'])):
+        lines.append(line(f'{stage} mean', baseline['stages'].get(stage, {}).get('mean_ms'),
+                          current['stages'].get(stage, {}).get('mean_ms'), 'ms'))
+    for metric in ('upserted_questions_per_s', 'queries_per_s'):
+        lines.append(line(metric, baseline['throughput'][metric], current['throughput'][metric], '/s'))
+    for metric in sorted(set(baseline['memory']) | set(current['memory'])):
+        lines.append(line(metric, baseline['memory'].get(metric), current['memory'].get(metric), 'MB'))
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Offline latency benchmark for ApplicationSession')
+    parser.add_argument('--questions', type=int, default=1000, help='size of the upserted question corpus')
+    parser.add_argument('--queries', type=int, default=100, help='number of query_tune_answer calls')
+    parser.add_argument('--gpt-latency', type=float, default=0.0, help='seconds per fake gpt call')
+    parser.add_argument('--answers', type=int, default=3, help='alternative answers per query')
+    parser.add_argument('--epochs', type=int, default=5, help='FastText epochs on the synthetic corpus')
+    parser.add_argument('--fasttext-model', type=Path, default=None,
+                        help='trained FastText model to use instead of training one on the synthetic corpus')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-tracemalloc', action='store_true', help='skip python allocation tracing')
+    parser.add_argument('--output', type=Path, default=None, help='write the results to this json file')
+    parser.add_argument('--compare', type=Path, nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help='compare two result files instead of running')
+    args = parser.parse_args()
+
+    if args.compare:
+        baseline, current = (json.loads(path.read_text()) for path in args.compare)
+        print('\n'.join(compare_results(baseline, current)))
+        sys.exit(0)
+
+    results = run_benchmark(args.questions, args.queries, args.gpt_latency, args.answers, args.epochs, args.seed,
+                            fasttext_model_path=args.fasttext_model, track_allocations=not args.no_tracemalloc)
+    output = json.dumps(results, indent=2)
+    if args.output is not None:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(output)
+    print(output)
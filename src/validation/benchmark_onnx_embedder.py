@@ -0,0 +1,59 @@
+"""
+Measures the latency and throughput of OnnxSentenceEmbedder per batch size, to pick embedding.onnx.batch_size.
+
+Run it from the repo root with
+    PYTHONPATH=src python src/validation/benchmark_onnx_embedder.py \
+        --model data/app_questions/artifacts/all-MiniLM-L6-v2-onnx/model.onnx \
+        --sentences data/app_questions/prep_data/prep_sentences_50K.csv \
+        --batch-sizes 1 8 16 32 64 --threads 2
+Every request embeds --request-size sentences, about the number of questions a user's form has. The report lists the
+p50/p95 latency of a request and the sentences per second for every batch size.
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+from modeling_clusterization.onnx_embedding import OnnxSentenceEmbedder
+from validation.fasttext_quantization_report import read_sentences
+
+
+def benchmark_batch_size(embedder: OnnxSentenceEmbedder, requests, warmup: int = 2) -> dict:
+    """Latency percentiles and throughput of embedding every request with the embedder's batch size."""
+    for request in requests[:warmup]:
+        embedder.liststr_to_matrix(request)
+    latencies = []
+    for request in requests:
+        start = time.perf_counter()
+        embedder.liststr_to_matrix(request)
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies)
+    return {'batch_size': embedder.batch_size,
+            'p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 2),
+            'p95_ms': round(float(np.percentile(latencies, 95)) * 1000, 2),
+            'sentences_per_second': round(sum(len(request) for request in requests) / float(latencies.sum()), 1)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Latency and throughput of the onnx sentence embedder per batch size')
+    parser.add_argument('--model', type=Path, required=True, help='exported model.onnx, with tokenizer.json next to it')
+    parser.add_argument('--sentences', type=Path, required=True, help='prepared sentences csv')
+    parser.add_argument('--sample', type=int, default=2000, help='number of sentences embedded per batch size')
+    parser.add_argument('--request-size', type=int, default=32, help='sentences embedded per call')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 16, 32, 64])
+    parser.add_argument('--threads', type=int, default=None, help='onnx runtime intra-op threads')
+    parser.add_argument('--max-seq-length', type=int, default=128)
+    args = parser.parse_args()
+
+    sentences = read_sentences(args.sentences, args.sample)
+    requests = [sentences[i:i + args.request_size] for i in range(0, len(sentences), args.request_size)]
+    embedder = OnnxSentenceEmbedder(args.model, max_seq_length=args.max_seq_length, num_threads=args.threads,
+                                    log_level='WARNING').load()
+    results = []
+    for batch_size in args.batch_sizes:
+        embedder.batch_size = batch_size
+        results.append(benchmark_batch_size(embedder, requests))
+    print(json.dumps({'model': str(args.model), 'threads': args.threads, 'request_size': args.request_size,
+                      'results': results}, indent=2))
@@ -0,0 +1,40 @@
+"""
+Checks that DescriptionPrep drops the boilerplate of a real job description and keeps its content.
+
+Run it from the repo root with
+    PYTHONPATH=src python src/validation/description_prep_check.py
+The fixture of validation/fixtures lists the sentences of a job posting that must be kept, the equal opportunity,
+accommodation and application sentences that must be dropped, and lists of protected classes that the list pattern
+must match on its own. It exits with status 1 and lists the failures if any check fails.
+"""
+import json
+import re
+import sys
+from itertools import zip_longest
+from pathlib import Path
+
+from preprocessing.description_prep import BOILERPLATE_PATTERNS, DescriptionPrep
+
+FIXTURE_PATH = Path('src/validation/fixtures/job_description_boilerplate.json')
+PROTECTED_CLASS_LIST_PATTERN = next(p for p in BOILERPLATE_PATTERNS if p.startswith('(?:\\b(?:race'))
+
+
+def check(fixture: dict) -> list:
+    """Returns the failed checks, empty if DescriptionPrep behaves."""
+    # boilerplate and content sentences share paragraphs, as in real postings
+    description = '\n'.join(' '.join(sentence for sentence in pair if sentence)
+                            for pair in zip_longest(fixture['keep'], fixture['drop']))
+    cleaned = DescriptionPrep(log_level='WARNING').strip_boilerplate(description)
+    failures = [f'dropped: {sentence}' for sentence in fixture['keep'] if sentence not in cleaned]
+    failures += [f'kept: {sentence}' for sentence in fixture['drop'] if sentence in cleaned]
+    list_pattern = re.compile(PROTECTED_CLASS_LIST_PATTERN, flags=re.IGNORECASE)
+    failures += [f'protected class list not matched: {text}' for text in fixture['protected_class_lists']
+                 if not list_pattern.search(text)]
+    return failures
+
+
+if __name__ == "__main__":
+    with open(FIXTURE_PATH, 'r', encoding='utf-8') as file:
+        failures = check(json.load(file))
+    print(json.dumps({'passed': not failures, 'failures': failures}, indent=2))
+    sys.exit(1 if failures else 0)
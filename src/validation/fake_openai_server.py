@@ -0,0 +1,86 @@
+"""
+Local stand-in for the OpenAI chat completions endpoint, used to exercise ChatGpt's concurrency and rate limiting
+without an api key or credits.
+
+Run it with
+    python src/validation/fake_openai_server.py --port 8089 --latency 0.5 --rate-limit-every 20
+and point the client at it by setting OPENAI_API_BASE = 'http://127.0.0.1:8089/v1' in .env
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+import uuid
+
+from flask import Flask, Response, jsonify, make_response, request
+
+
+def create_app(latency: float = 0.5, rate_limit_every: int = 0, retry_after: float = 1.0) -> Flask:
+    """
+    Builds the fake endpoint.
+
+    Args:
+        latency (float): Seconds every completion takes, requests are served concurrently.
+        rate_limit_every (int): Answer every n-th request with a 429 and a Retry-After header, 0 disables it.
+        retry_after (float): Value of the Retry-After header on rate limited responses.
+
+    Returns:
+        Flask: The application.
+    """
+    app = Flask(__name__)
+    counter = itertools.count(1)
+    lock = threading.Lock()
+
+    def stream_chunks(model: str, request_number: int):
+        """Streams a fake answer word by word, spreading the latency over the words."""
+        words = f'fake streamed answer {request_number}'.split()
+        for i, word in enumerate(words):
+            time.sleep(latency / len(words))
+            chunk = {'id': f'chatcmpl-{request_number}', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                     'model': model,
+                     'choices': [{'index': 0, 'delta': {'content': word if i == 0 else ' ' + word},
+                                  'finish_reason': None}]}
+            yield f'data: {json.dumps(chunk)}\n\n'
+        yield 'data: [DONE]\n\n'
+
+    @app.route('/v1/chat/completions', methods=['POST'])
+    def chat_completions():
+        with lock:
+            request_number = next(counter)
+        if rate_limit_every and request_number % rate_limit_every == 0:
+            response = make_response(jsonify({'error': {'message': 'Rate limit reached', 'type': 'requests',
+                                                        'param': None, 'code': None}}), 429)
+            response.headers['Retry-After'] = str(retry_after)
+            return response
+
+        body = request.json
+        if body.get('stream'):
+            return Response(stream_chunks(body['model'], request_number), mimetype='text/event-stream')
+        time.sleep(latency)
+        prompt_tokens = sum(len(message['content']) // 4 + 4 for message in body['messages'])
+        choices = [{'index': i,
+                    'message': {'role': 'assistant', 'content': f'fake answer {request_number}.{i}'},
+                    'finish_reason': 'stop'}
+                   for i in range(body.get('n', 1))]
+        return jsonify({'id': f'chatcmpl-{uuid.uuid4().hex}',
+                        'object': 'chat.completion',
+                        'created': int(time.time()),
+                        'model': body['model'],
+                        'choices': choices,
+                        'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': 5 * len(choices),
+                                  'total_tokens': prompt_tokens + 5 * len(choices)}})
+
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fake OpenAI chat completions endpoint')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.5)
+    parser.add_argument('--rate-limit-every', type=int, default=0)
+    parser.add_argument('--retry-after', type=float, default=1.0)
+    args = parser.parse_args()
+
+    create_app(args.latency, args.rate_limit_every, args.retry_after).run(host='127.0.0.1', port=args.port,
+                                                                           threaded=True)
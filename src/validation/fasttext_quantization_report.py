@@ -0,0 +1,55 @@
+"""
+Exports the quantized FastText artifact and reports how far it drifts from the full model.
+
+Run it from the repo root with
+    PYTHONPATH=src python src/validation/fasttext_quantization_report.py \
+        --model data/app_questions/artifacts/fasttext.model \
+        --sentences data/app_questions/prep_data/prep_sentences_50K.csv
+The quantization settings default to embedding.fasttext.quantization in application_questions_config.yaml.
+"""
+import argparse
+import json
+from pathlib import Path
+
+import pandas as pd
+from yaml import safe_load
+
+from modeling_clusterization.embedding import FastTextModel, embedding_drift_report
+
+
+def model_size_mb(model_path: Path) -> float:
+    """Size on disk of a saved gensim model, including its separately stored arrays."""
+    return sum(path.stat().st_size for path in model_path.parent.glob(f'{model_path.name}*')) / 2 ** 20
+
+
+def read_sentences(path: Path, sample: int, seed: int = 0):
+    """Tokenized sentences from a prepared sentences csv, one sentence per row and one token per column."""
+    df = pd.read_csv(path)
+    df = df.sample(n=min(sample, len(df)), random_state=seed)
+    return [[token for token in row if isinstance(token, str)] for row in df.values.tolist()]
+
+
+if __name__ == "__main__":
+    with open('src/application_questions_config.yaml', 'r') as file:
+        cf_quant = safe_load(file)['embedding']['fasttext']['quantization']
+
+    parser = argparse.ArgumentParser(description='Export a quantized FastText artifact and report its drift')
+    parser.add_argument('--model', type=Path, required=True, help='trained FastText model')
+    parser.add_argument('--sentences', type=Path, required=True, help='prepared sentences csv to measure drift on')
+    parser.add_argument('--output', type=Path, default=None, help='artifact path, defaults to <model>.q.npz')
+    parser.add_argument('--sample', type=int, default=5000, help='number of sentences to measure drift on')
+    parser.add_argument('--max-vocab', type=int, default=cf_quant['max_vocab'])
+    parser.add_argument('--max-buckets', type=int, default=cf_quant['max_buckets'])
+    parser.add_argument('--dtype', choices=['int8', 'float16'], default=cf_quant['dtype'])
+    parser.add_argument('--dims', type=int, default=cf_quant['dims'])
+    args = parser.parse_args()
+
+    output = args.output or args.model.with_suffix('.q.npz')
+    full = FastTextModel(args.model, log_level='WARNING').load()
+    quantized = full.export_quantized(output, max_vocab=args.max_vocab, max_buckets=args.max_buckets,
+                                      dtype=args.dtype, dims=args.dims)
+    report = {'settings': {'max_vocab': args.max_vocab, 'max_buckets': args.max_buckets, 'dtype': args.dtype,
+                           'dims': args.dims},
+              'full_model_mb': model_size_mb(args.model), 'quantized_mb': output.stat().st_size / 2 ** 20,
+              'drift': embedding_drift_report(full, quantized, read_sentences(args.sentences, args.sample))}
+    print(json.dumps(report, indent=2))
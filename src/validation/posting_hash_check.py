@@ -0,0 +1,65 @@
+"""
+Checks that a job posting gets the same content hash whatever it is read with, so no posting is summarized twice.
+
+Run it from the repo root with
+    PYTHONPATH=src python src/validation/posting_hash_check.py
+Every posting of the fixture of validation/fixtures is hashed on its own, then read by jobPostIingest in chunks of
+every size (so it shares a chunk with postings that lack its fields or hold nulls in them), after new postings are
+appended to the file, and from an output csv written the way the pipeline wrote them before checkpoints existed (from
+the json document read whole by pandas, one row at a time), matched back once a new posting has been added. It exits
+with status 1 and lists the failures if a hash differs.
+"""
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+from ingestion.jp_ingestion import jobPostIingest
+
+FIXTURE_PATH = Path('src/validation/fixtures/job_postings.jsonl')
+
+
+def read_hashes(path: Path, chunksize: int) -> list:
+    ingestion = jobPostIingest(path, path.with_suffix('.csv'), 'WARNING', chunksize=chunksize)
+    return [h for chunk in ingestion._read_chunks() for h in chunk[jobPostIingest.HASH_COLUMN]]
+
+
+def check(records: list, tmp_dir: Path) -> list:
+    """Returns the failed checks, empty if every posting hashes the same everywhere."""
+    expected = [jobPostIingest.record_hash(record) for record in records]
+    failures = [] if len(set(expected)) == len(expected) else ['distinct postings share a hash']
+
+    jsonl_path = tmp_dir / 'postings.jsonl'
+    jsonl_path.write_text(''.join(json.dumps(record) + '\n' for record in records), encoding='utf-8')
+    for chunksize in range(1, len(records) + 1):
+        if read_hashes(jsonl_path, chunksize) != expected:
+            failures.append(f'hashes change when read {chunksize} at a time')
+    with open(jsonl_path, 'a', encoding='utf-8') as file:
+        file.write(json.dumps({'title': 'Appended', 'reviews': None, 'rating': 2.5}) + '\n')
+    if read_hashes(jsonl_path, len(records) + 1)[:len(records)] != expected:
+        failures.append('hashes change when a posting is appended')
+
+    # output csvs before checkpoints: the json document read whole with pandas defaults, written a row at a time
+    json_path = tmp_dir / 'postings.json'
+    json_path.write_text(json.dumps(records), encoding='utf-8')
+    legacy_path = tmp_dir / 'legacy.csv'
+    for _, row in pd.read_json(json_path).iterrows():
+        row['hard_skills_gpt-3.5-turbo'] = 'python'
+        row.to_frame().T.to_csv(legacy_path, mode='a', header=not legacy_path.exists(), index=False)
+    json_path.write_text(json.dumps(records + [{'title': 'New', 'reviews': 1.5, 'zip': 'n/a'}]), encoding='utf-8')
+    legacy = jobPostIingest(json_path, legacy_path, 'WARNING').legacy_posting_hash(
+        pd.read_csv(legacy_path, dtype=str, keep_default_na=False))
+    if list(legacy) != expected:
+        failures.append(f'{len(set(expected) - set(legacy))} legacy csv rows are not matched to their posting')
+    return failures
+
+
+if __name__ == "__main__":
+    with open(FIXTURE_PATH, 'r', encoding='utf-8') as file:
+        fixture = [json.loads(line) for line in file if line.strip()]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        failures = check(fixture, Path(tmp_dir))
+    print(json.dumps({'passed': not failures, 'failures': failures}, indent=2))
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,171 @@
+"""
+Compares the rule-based preprocessing backend (RulePrep) with SpacyPrep: how often they clean a question to the same
+tokens, and how much faster and lighter the rules are.
+
+Run it from the repo root with
+    PYTHONPATH=src python src/validation/prep_parity_benchmark.py \
+        --lookup-corpus data/app_questions/raw_data/questions.txt --save
+The lemma lookup table is built from the SpacyPrep lemmas of --lookup-corpus (one question per line, ideally every
+stored application question), then both backends clean --fixture, the held-out questions of validation/fixtures by
+default. The two fixture files share no question, so the parity is measured on questions the table was not built
+from, as for new questions in production. RulePrep falls back to spaCy for questions with words missing from the
+table, as the session does (preprocessing.rules.unseen_fallback); --no-fallback measures the table alone.
+The report lists the share of questions cleaned to exactly the same tokens (with and without the fallback), the share
+of tokens that agree, the share of fixture tokens missing from the table, the share of questions that fell back to
+spaCy, the share of fixture questions that are also in the lookup corpus and the first mismatches; then, for both
+backends in a fresh interpreter each, the import and load time, the memory they add and the p50/p95 latency and
+throughput of cleaning --request-size questions at a time. The rules' footprint includes spaCy once a question falls
+back. With --save the table is written to preprocessing.rules.lookup_path, where the session loads it when
+preprocessing.backend is 'rules'; otherwise it goes to a temporary folder.
+It exits with status 1 if the exact match rate is below --min-exact-match.
+"""
+import argparse
+import difflib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from yaml import safe_load
+
+from preprocessing.rule_prep import RulePrep, tokenize
+
+LOOKUP_CORPUS_PATH = Path('src/validation/fixtures/application_questions_lookup.txt')
+FIXTURE_PATH = Path('src/validation/fixtures/application_questions_heldout.txt')
+# floor of the held-out exact match rate of RulePrep as the session runs it, with the spaCy fallback
+MIN_EXACT_MATCH = 0.9
+
+
+def read_questions(path: Path):
+    with open(path, 'r', encoding='utf-8') as file:
+        return [line.rstrip('\n') for line in file if line.strip()]
+
+
+def make_spacy_prep(model_name: str, model_path: Path):
+    # imported here, so the footprint of the rules is measured without spaCy loaded
+    from preprocessing.spacy_prep import SpacyPrep
+    return SpacyPrep(log_level='WARNING', model_name=model_name, model_path=model_path)
+
+
+def make_rule_prep(args, spacy_prep=None) -> RulePrep:
+    fallback = None if args.no_fallback else spacy_prep or make_spacy_prep(args.spacy_model, args.spacy_model_path)
+    return RulePrep(args.lookup, log_level='WARNING', fallback=fallback)
+
+
+def parity_report(spacy_tokens, rule_tokens, lookup_only_tokens, questions, lookup, lookup_questions,
+                  examples: int = 10) -> dict:
+    """Exact match rates, token agreement, unseen token rate and lookup corpus overlap of the rules against spaCy."""
+    matched_tokens, total_tokens, mismatches = 0, 0, []
+    for question, expected, got in zip(questions, spacy_tokens, rule_tokens):
+        matcher = difflib.SequenceMatcher(a=expected, b=got, autojunk=False)
+        matched_tokens += sum(block.size for block in matcher.get_matching_blocks())
+        total_tokens += max(len(expected), len(got))
+        if expected != got and len(mismatches) < examples:
+            mismatches.append({'question': question, 'spacy': expected, 'rules': got})
+    fixture_tokens = [token for question in questions for token in tokenize(question)]
+    return {'questions': len(questions),
+            'exact_match_rate': round(sum(a == b for a, b in zip(spacy_tokens, rule_tokens)) / len(questions), 4),
+            'lookup_only_exact_match_rate': round(sum(a == b for a, b in zip(spacy_tokens, lookup_only_tokens))
+                                                  / len(questions), 4),
+            'token_agreement': round(matched_tokens / total_tokens, 4) if total_tokens else 1.0,
+            'unseen_token_rate': round(sum(t not in lookup['lemmas'] for t in fixture_tokens) / len(fixture_tokens), 4),
+            'lookup_overlap_rate': round(len(set(questions) & set(lookup_questions)) / len(questions), 4),
+            'mismatches': mismatches}
+
+
+def rss_mb() -> float:
+    """Resident memory of this process (linux), the peak is inherited from the parent process so it can't be used."""
+    with open('/proc/self/status', 'r') as file:
+        return next(int(line.split()[1]) for line in file if line.startswith('VmRSS:')) / 1024
+
+
+def footprint(backend: str, args) -> dict:
+    """Import and load time, added memory, latency and throughput of a backend, measured in this process."""
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    if backend == 'rules':
+        prep = make_rule_prep(args).warm_up()
+    else:
+        prep = make_spacy_prep(args.spacy_model, args.spacy_model_path).warm_up()
+    load_seconds = time.perf_counter() - start
+
+    questions = read_questions(args.fixture)
+    requests = [questions[i:i + args.request_size] for i in range(0, len(questions), args.request_size)]
+    requests = requests * args.repeat
+    latencies = []
+    for request in requests:
+        start = time.perf_counter()
+        prep.prep_sentences_to_list_of_lists(request)
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies)
+    return {'backend': backend, 'load_seconds': round(load_seconds, 3),
+            'fallback_rate': round(prep.fallback_rate(), 4) if backend == 'rules' else None,
+            'added_rss_mb': round(rss_mb() - rss_before, 1),
+            'p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 3),
+            'p95_ms': round(float(np.percentile(latencies, 95)) * 1000, 3),
+            'sentences_per_second': round(sum(len(request) for request in requests) / float(latencies.sum()), 1)}
+
+
+def footprint_in_subprocess(backend: str, args) -> dict:
+    """Runs footprint() in a fresh interpreter, so neither backend is measured with the other's modules loaded."""
+    argv = [arg for arg in sys.argv[1:] if arg != '--save']
+    result = subprocess.run([sys.executable, sys.argv[0], *argv, '--footprint', backend, '--lookup', str(args.lookup)],
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout)
+
+
+if __name__ == "__main__":
+    with open('src/application_questions_config.yaml', 'r') as file:
+        cf_prep = safe_load(file)['preprocessing']
+    data_path = Path(os.getenv('PARENT_FOLDER_PATH', '.')) / 'data'
+
+    parser = argparse.ArgumentParser(description='Parity and throughput of the rule-based preprocessing against spaCy')
+    parser.add_argument('--lookup-corpus', type=Path, default=LOOKUP_CORPUS_PATH,
+                        help='questions the lookup table is built from, one per line')
+    parser.add_argument('--fixture', type=Path, default=FIXTURE_PATH,
+                        help='questions the backends are compared on, held out of the lookup corpus')
+    parser.add_argument('--min-exact-match', type=float, default=MIN_EXACT_MATCH,
+                        help='fails if fewer fixture questions are cleaned to the same tokens')
+    parser.add_argument('--lookup', type=Path, default=None, help='lookup table path, defaults to the configured one '
+                                                                   'with --save and a temporary file otherwise')
+    parser.add_argument('--save', action='store_true', help='write the lookup table to the configured path')
+    parser.add_argument('--no-fallback', action='store_true',
+                        help='keep words missing from the table instead of cleaning their questions with spaCy')
+    parser.add_argument('--spacy-model', default=cf_prep['spacy']['model'])
+    parser.add_argument('--spacy-model-path', type=Path,
+                        default=data_path / cf_prep['spacy']['model_path'] if cf_prep['spacy']['model_path'] else None)
+    parser.add_argument('--request-size', type=int, default=8, help='questions cleaned per call')
+    parser.add_argument('--repeat', type=int, default=20, help='passes over the fixture when measuring throughput')
+    parser.add_argument('--examples', type=int, default=10, help='mismatches listed in the report')
+    parser.add_argument('--footprint', choices=['rules', 'spacy'], default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.footprint:
+        print(json.dumps(footprint(args.footprint, args)))
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.lookup is None:
+            args.lookup = data_path / cf_prep['rules']['lookup_path'] if args.save else Path(tmp_dir) / 'lookup.json'
+        spacy_prep = make_spacy_prep(args.spacy_model, args.spacy_model_path)
+        lookup_questions = read_questions(args.lookup_corpus)
+        lookup = RulePrep.build_lookup(spacy_prep, lookup_questions, args.lookup)
+
+        questions = read_questions(args.fixture)
+        spacy_tokens = spacy_prep.prep_sentences_to_list_of_lists(questions)
+        rule_prep = make_rule_prep(args, spacy_prep)
+        rule_tokens = rule_prep.prep_sentences_to_list_of_lists(questions)
+        lookup_only_tokens = RulePrep(args.lookup, log_level='WARNING').prep_sentences_to_list_of_lists(questions)
+        report = {'lookup': str(args.lookup) if args.save else None, 'lookup_corpus': str(args.lookup_corpus),
+                  'lemmas': len(lookup['lemmas']),
+                  'parity': {**parity_report(spacy_tokens, rule_tokens, lookup_only_tokens, questions, lookup,
+                                             lookup_questions, args.examples),
+                             'fallback_rate': round(rule_prep.fallback_rate(), 4)},
+                  'footprint': [footprint_in_subprocess('rules', args), footprint_in_subprocess('spacy', args)]}
+    report['passed'] = report['parity']['exact_match_rate'] >= args.min_exact_match
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    sys.exit(0 if report['passed'] else 1)
@@ -0,0 +1,59 @@
+"""
+Fits the vector projection of the embedding model and reports the nearest neighbour recall it costs.
+
+Run it from the repo root with
+    PYTHONPATH=src python src/validation/projection_report.py \
+        --model data/app_questions/artifacts/fasttext.model \
+        --sentences data/app_questions/prep_data/prep_sentences_50K.csv \
+        --dims 32 64 100
+For every number of dimensions, the projection is fitted on --fit-sample sentences and evaluated on --sample other
+ones: recall@k of the projected vectors' nearest neighbours against the full vectors', drift of pairwise cosine
+similarities, and how much smaller stored vectors get. With --save (and a single --dims) the projection is written
+next to the model, where ProjectedEmbedder loads it when embedding.projection is enabled.
+"""
+import argparse
+import json
+from pathlib import Path
+
+from yaml import safe_load
+
+from modeling_clusterization.embedding import FastTextModel, QuantizedFastTextModel, embedding_drift_report
+from modeling_clusterization.projection import ProjectedEmbedder
+from validation.fasttext_quantization_report import read_sentences
+
+
+if __name__ == "__main__":
+    with open('src/application_questions_config.yaml', 'r') as file:
+        cf_projection = safe_load(file)['embedding']['projection']
+
+    parser = argparse.ArgumentParser(description='Fit the vector projection and report its recall@k')
+    parser.add_argument('--model', type=Path, required=True, help='FastText model, or a quantized .q.npz artifact')
+    parser.add_argument('--sentences', type=Path, required=True, help='prepared sentences csv')
+    parser.add_argument('--method', choices=['pca', 'random'], default=cf_projection['method'])
+    parser.add_argument('--dims', type=int, nargs='+', default=[cf_projection['dims']])
+    parser.add_argument('--fit-sample', type=int, default=cf_projection['fit_sample'])
+    parser.add_argument('--sample', type=int, default=5000, help='sentences the recall is measured on')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--save', action='store_true', help='save the fitted projection next to the model')
+    args = parser.parse_args()
+    if args.save and len(args.dims) > 1:
+        parser.error('--save needs a single --dims value')
+
+    if args.model.suffix == '.npz':
+        embedder = QuantizedFastTextModel(args.model, log_level='WARNING').load()
+    else:
+        embedder = FastTextModel(args.model, log_level='WARNING').load()
+    sentences = read_sentences(args.sentences, args.fit_sample + args.sample)
+    fit_sentences, eval_sentences = sentences[:args.fit_sample], sentences[args.fit_sample:]
+
+    source_dims = embedder.liststr_to_matrix(eval_sentences[:1]).shape[1]
+    reports = []
+    for dims in args.dims:
+        projected = ProjectedEmbedder(embedder, method=args.method, dims=dims, log_level='WARNING').fit(fit_sentences)
+        reports.append({'dims': dims, 'explained_variance': projected.projection.explained_variance,
+                        'storage_ratio': dims / source_dims,
+                        **embedding_drift_report(embedder, projected, eval_sentences, k=args.k)})
+        if args.save:
+            projected.projection.save()
+    print(json.dumps({'method': args.method, 'source_dims': source_dims, 'fit_sentences': len(fit_sentences),
+                      'reports': reports}, indent=2))